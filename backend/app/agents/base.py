@@ -1,14 +1,37 @@
 from abc import ABC, abstractmethod
 from typing import Dict, Any
+from ..services.llm import get_llm
+from ..config import LLM_MODEL
 
 class BaseAgent(ABC):
-    def __init__(self, user_credentials):
+    def __init__(self, user_credentials, llm=None):
         self.user_credentials = user_credentials
+        self.llm = llm or get_llm()
+        # Set for streamed turns (services/turn_stream.py), see say()
+        self.stream = None
+
+    @property
+    def user_id(self):
+        return getattr(self.user_credentials, "user_id", None)
+
+    @property
+    def model_name(self) -> str:
+        """Model the agent's LLM calls go to, part of the key of cached LLM output."""
+        return getattr(self.llm, "model_name", LLM_MODEL)
+
+    def say(self, text: str) -> None:
+        """
+        Stream the start of the response message ahead of the result. Only text the final
+        message begins with belongs here, the rest of the message is streamed afterwards.
+        """
+        if self.stream is not None:
+            self.stream.say(text)
 
     @abstractmethod
-    def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
+    async def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
         """
         Execute the agent's task based on the provided slots.
         Returns a dictionary with the result.
+        Runs on the event loop, so all Gmail and LLM I/O has to be awaited.
         """
         pass
@@ -1,94 +1,71 @@
 from .base import BaseAgent
 from ..services.gmail import GmailService
-from typing import Dict, Any
+from ..services.prefetch import prefetcher, READ_DEFAULT_LIMIT
+from ..services.renderings import RenderingCache
+from ..services.mail_body import prepare_body
+from ..config import READER_FORMAT_MODE, READER_MAX_CONCURRENCY, READER_BODY_TOKENS
+from typing import Dict, Any, List
+import asyncio
 import email.utils
+import json
+import weakref
 from datetime import datetime
-import os
-import google.generativeai as genai
+
+# Per-user cap on concurrent LLM calls, an entry disappears once no call of that user holds it
+_user_limits: "weakref.WeakValueDictionary[Any, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+def _user_limit(user_id) -> asyncio.Semaphore:
+    limit = _user_limits.get(user_id)
+    if limit is None:
+        limit = asyncio.Semaphore(READER_MAX_CONCURRENCY)
+        _user_limits[user_id] = limit
+    return limit
+
+# Bump when the read-out prompts change in a way that should re-render every mail
+SPEAKABLE_PROMPT_VERSION = "1"
+speakable_cache = RenderingCache("speakable", SPEAKABLE_PROMPT_VERSION)
 
 class EmailReaderAgent(BaseAgent):
-    def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
-        limit = slots.get("limit", 5)
+    def __init__(self, user_credentials, format_mode: str = None, llm=None):
+        super().__init__(user_credentials, llm)
+        self.format_mode = format_mode or READER_FORMAT_MODE
+
+    async def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
+        limit = slots.get("limit", READ_DEFAULT_LIMIT)
         sender = slots.get("sender")
 
         # Ensure limit is an integer
         try:
             limit = int(limit)
         except (ValueError, TypeError):
-            limit = 5
+            limit = READ_DEFAULT_LIMIT
 
-        gmail_service = GmailService(self.user_credentials)
-        # User requested body to be read
-        messages = gmail_service.list_messages(limit=limit, sender=sender, include_body=True)
+        gmail_service = await GmailService.open(self.user_credentials)
 
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        # Default request on an unchanged inbox: the read-out was already generated in the background
+        prefetched = None
+        if sender is None and self.user_id is not None:
+            prefetched = await prefetcher.lookup(self.user_id, gmail_service)
+            if prefetched and not prefetched.covers(limit):
+                prefetched = None
+
+        if prefetched:
+            messages = prefetched.messages[:limit]
+        else:
+            # User requested body to be read
+            messages = await gmail_service.alist_messages(limit=limit, sender=sender, include_body=True)
+
+        if not self.llm.available:
              return {"status": "error", "message": "API Key fehlt."}
-        
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-2.0-flash")
 
         if messages:
-            formatted_messages = []
-            for msg in messages:
-                # Clean sender: "Name <email>" -> "Name"
-                sender_raw = msg.get('sender', 'Unknown')
-                if '<' in sender_raw:
-                    sender_clean = sender_raw.split('<')[0].strip().replace('"', '')
-                else:
-                    sender_clean = sender_raw
-
-                # Format date: "Fri, 06 Dec 2024 14:30:00 +0000" -> "Heute um 14:30" or "6. Dezember um 14:30"
-                date_raw = msg.get('date', '')
-                date_str = "Unbekannte Zeit"
-                if date_raw:
-                    try:
-                        parsed_date = email.utils.parsedate_to_datetime(date_raw)
-                        now = datetime.now(parsed_date.tzinfo)
-                        if parsed_date.date() == now.date():
-                            date_str = parsed_date.strftime("Heute um %H:%M")
-                        else:
-                            # German month names would require locale or manual mapping, keeping simple for now
-                            # or just numeric
-                            date_str = parsed_date.strftime("%d.%m. um %H:%M")
-                    except Exception:
-                        date_str = date_raw # Fallback
-
-                subject = msg.get('subject', 'Kein Betreff')
-                body = msg.get('body') or msg.get('snippet', 'Kein Inhalt')
-                
-                # Use LLM to clean and format for voice
-                prompt = f"""
-                Du bist ein Assistent für einen Autofahrer.
-                Formatiere die folgende E-Mail so, dass sie laut vorgelesen werden kann.
-                Sprache: Deutsch.
-                
-                Infos:
-                Absender: {sender_clean}
-                Zeitpunkt: {date_str}
-                Betreff: {subject}
-                Inhalt: {body}
-                
-                Anweisungen:
-                1. Fasse den Inhalt kurz zusammen oder gib ihn wieder, aber entferne Marketing-Müll, Links, Footer, Disclaimer.
-                2. Wenn es nur Werbung ist, sag "Werbung von [Absender]: [Kurze Info]".
-                3. Keine Markdown-Formatierung (kein Fett, keine Listen, keine Sternchen).
-                4. Format: "E-Mail von [Absender], empfangen [Zeitpunkt]. Betreff: [Betreff]. [Bereinigter Inhalt]"
-                5. Sei prägnant und natürlich gesprochen.
-                """
-                
-                try:
-                    response = model.generate_content(prompt)
-                    speakable_text = response.text.strip()
-                except Exception as e:
-                    # Fallback if LLM fails
-                    body_clean = body.replace('*', '').replace('#', '').replace('`', '')[:200]
-                    speakable_text = f"E-Mail von {sender_clean}, empfangen {date_str}. Betreff: {subject}. {body_clean}"
-
-                formatted_messages.append(speakable_text)
+            # Streamed turns can start speaking while the mails are formatted
+            intro = "Hier sind deine E-Mails.\n\n"
+            self.say(intro)
+            formatted_messages = prefetched.read_texts[:limit] if prefetched else await self.format_messages(messages)
             
             # Join with a pause-like separator for TTS
-            full_response = "Hier sind deine E-Mails.\n\n" + "\n\nNächste E-Mail.\n\n".join(formatted_messages)
+            full_response = intro + "\n\nNächste E-Mail.\n\n".join(formatted_messages)
             
             return {
                 "status": "success",
@@ -97,3 +74,137 @@ class EmailReaderAgent(BaseAgent):
             }
         else:
             return {"status": "success", "message": "Keine E-Mails gefunden."}
+
+    async def format_messages(self, messages: List[Dict[str, Any]]) -> List[str]:
+        """Turn messages into speakable texts, in the same order as the input. Mails read before come from the cache."""
+        infos = [self._prepare(msg) for msg in messages]
+
+        async def render_missing(indexes: List[int]) -> List[str]:
+            return await self._format([infos[i] for i in indexes])
+
+        return await speakable_cache.render(
+            self.user_id, self.model_name, [msg.get('id') for msg in messages], [self._prompt(info) for info in infos],
+            render_missing, cacheable=lambda i, text: text != self._fallback_text(infos[i]),
+        )
+
+    async def _format(self, infos: List[Dict[str, str]]) -> List[str]:
+        if self.format_mode == "batch":
+            return await self._format_batched(infos)
+        if self.format_mode == "serial":
+            return [await self._format_one(info) for info in infos]
+        return await self._format_parallel(infos)
+
+    async def _format_parallel(self, infos: List[Dict[str, str]]) -> List[str]:
+        """One LLM call per mail, run concurrently but at most READER_MAX_CONCURRENCY at a time per user."""
+        limit = _user_limit(self.user_id)
+
+        async def run(info):
+            async with limit:
+                return await self._format_one(info)
+
+        # gather() returns results in input order, regardless of which call finishes first
+        return list(await asyncio.gather(*(run(info) for info in infos)))
+
+    async def _format_batched(self, infos: List[Dict[str, str]]) -> List[str]:
+        """Format all mails with a single LLM call, falling back per mail if the answer is unusable."""
+        try:
+            texts = json.loads(await self.llm.agenerate(self._batch_prompt(infos), json_output=True))
+        except Exception as e:
+            print(f"Batched formatting failed: {e}")
+            texts = []
+
+        if not isinstance(texts, list):
+            texts = []
+        return [
+            texts[i].strip() if i < len(texts) and isinstance(texts[i], str) and texts[i].strip() else self._fallback_text(info)
+            for i, info in enumerate(infos)
+        ]
+
+    async def _format_one(self, info: Dict[str, str]) -> str:
+        try:
+            return (await self.llm.agenerate(self._prompt(info))).strip()
+        except Exception as e:
+            # Fallback if LLM fails
+            return self._fallback_text(info)
+
+    def _prepare(self, msg: Dict[str, Any]) -> Dict[str, str]:
+        """Extract and clean the fields the prompts need."""
+        # Clean sender: "Name <email>" -> "Name"
+        sender_raw = msg.get('sender', 'Unknown')
+        if '<' in sender_raw:
+            sender_clean = sender_raw.split('<')[0].strip().replace('"', '')
+        else:
+            sender_clean = sender_raw
+
+        # Format date: "Fri, 06 Dec 2024 14:30:00 +0000" -> "Heute um 14:30" or "6. Dezember um 14:30"
+        date_raw = msg.get('date', '')
+        date_str = "Unbekannte Zeit"
+        if date_raw:
+            try:
+                parsed_date = email.utils.parsedate_to_datetime(date_raw)
+                now = datetime.now(parsed_date.tzinfo)
+                if parsed_date.date() == now.date():
+                    date_str = parsed_date.strftime("Heute um %H:%M")
+                else:
+                    # German month names would require locale or manual mapping, keeping simple for now
+                    # or just numeric
+                    date_str = parsed_date.strftime("%d.%m. um %H:%M")
+            except Exception:
+                date_str = date_raw # Fallback
+
+        return {
+            "sender": sender_clean,
+            "date": date_str,
+            "subject": msg.get('subject', 'Kein Betreff'),
+            "body": prepare_body(msg.get('body') or msg.get('snippet'), READER_BODY_TOKENS) or 'Kein Inhalt',
+        }
+
+    def _prompt(self, info: Dict[str, str]) -> str:
+        # Use LLM to clean and format for voice
+        return f"""
+        Du bist ein Assistent für einen Autofahrer.
+        Formatiere die folgende E-Mail so, dass sie laut vorgelesen werden kann.
+        Sprache: Deutsch.
+        
+        Infos:
+        Absender: {info['sender']}
+        Zeitpunkt: {info['date']}
+        Betreff: {info['subject']}
+        Inhalt: {info['body']}
+        
+        Anweisungen:
+        1. Fasse den Inhalt kurz zusammen oder gib ihn wieder, aber entferne Marketing-Müll, Links, Footer, Disclaimer.
+        2. Wenn es nur Werbung ist, sag "Werbung von [Absender]: [Kurze Info]".
+        3. Keine Markdown-Formatierung (kein Fett, keine Listen, keine Sternchen).
+        4. Format: "E-Mail von [Absender], empfangen [Zeitpunkt]. Betreff: [Betreff]. [Bereinigter Inhalt]"
+        5. Sei prägnant und natürlich gesprochen.
+        """
+
+    def _batch_prompt(self, infos: List[Dict[str, str]]) -> str:
+        mails = "\n".join(
+            f"""
+        ### E-Mail {i + 1}
+        Absender: {info['sender']}
+        Zeitpunkt: {info['date']}
+        Betreff: {info['subject']}
+        Inhalt: {info['body']}
+        """
+            for i, info in enumerate(infos)
+        )
+        return f"""
+        Du bist ein Assistent für einen Autofahrer.
+        Formatiere jede der folgenden {len(infos)} E-Mails so, dass sie laut vorgelesen werden kann.
+        Sprache: Deutsch.
+        {mails}
+        Anweisungen:
+        1. Fasse den Inhalt kurz zusammen oder gib ihn wieder, aber entferne Marketing-Müll, Links, Footer, Disclaimer.
+        2. Wenn es nur Werbung ist, sag "Werbung von [Absender]: [Kurze Info]".
+        3. Keine Markdown-Formatierung (kein Fett, keine Listen, keine Sternchen).
+        4. Format pro E-Mail: "E-Mail von [Absender], empfangen [Zeitpunkt]. Betreff: [Betreff]. [Bereinigter Inhalt]"
+        5. Sei prägnant und natürlich gesprochen.
+        6. Gib ein JSON-Array mit genau {len(infos)} Strings zurück, einen pro E-Mail, in derselben Reihenfolge.
+        """
+
+    def _fallback_text(self, info: Dict[str, str]) -> str:
+        body_clean = info['body'].replace('*', '').replace('#', '').replace('`', '')[:200]
+        return f"E-Mail von {info['sender']}, empfangen {info['date']}. Betreff: {info['subject']}. {body_clean}"
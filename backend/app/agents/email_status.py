@@ -0,0 +1,26 @@
+from .base import BaseAgent
+from ..services.outbox import outbox
+from typing import Dict, Any
+
+class EmailStatusAgent(BaseAgent):
+    """Answers "Wurde meine Mail gesendet?" from the outbox, without asking Gmail."""
+    async def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
+        if self.user_id is None:
+            return {"status": "error", "message": "Kein Benutzer angemeldet."}
+
+        item = await outbox.latest(self.user_id)
+        if item is None:
+            return {"status": "success", "message": "Du hast noch keine E-Mail über mich geschrieben."}
+
+        to = f" an {item.recipient_name or item.recipient}" if (item.recipient_name or item.recipient) else ""
+        if item.status == "sent":
+            message = f"Ja, deine E-Mail{to} wurde gesendet."
+        elif item.status == "failed":
+            message = f"Deine E-Mail{to} konnte leider nicht gesendet werden."
+        elif not item.send_requested:
+            message = f"Der Entwurf{to} wartet noch auf deine Bestätigung. Soll ich ihn senden?"
+        elif item.attempts > 1 and item.last_error:
+            message = f"Deine E-Mail{to} ist noch nicht gesendet, Gmail ist gerade schwer erreichbar. Ich versuche es weiter."
+        else:
+            message = f"Deine E-Mail{to} wird gerade gesendet."
+        return {"status": "success", "message": message, "outbox_id": item.id, "outbox_status": item.status}
@@ -1,60 +1,45 @@
-import os
-import google.generativeai as genai
 from .base import BaseAgent
 from ..services.gmail import GmailService
-from typing import Dict, Any
+from ..services.prefetch import prefetcher, SUMMARY_DEFAULT_LIMIT
+from ..services.renderings import RenderingCache
+from ..services.mail_body import prepare_body
+from ..config import SUMMARY_BODY_TOKENS
+from typing import Dict, Any, List
+import asyncio
+
+# Bump when the per-mail summary prompt changes in a way that should re-render every mail
+SUMMARY_PROMPT_VERSION = "1"
+summary_cache = RenderingCache("summary", SUMMARY_PROMPT_VERSION)
 
 class EmailSummarizerAgent(BaseAgent):
-    def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
-        limit = slots.get("limit", 3)
+    async def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
+        limit = slots.get("limit", SUMMARY_DEFAULT_LIMIT)
         sender = slots.get("sender")
 
         try:
             limit = int(limit)
         except (ValueError, TypeError):
-            limit = 3
+            limit = SUMMARY_DEFAULT_LIMIT
+
+        gmail_service = await GmailService.open(self.user_credentials)
 
-        gmail_service = GmailService(self.user_credentials)
-        messages = gmail_service.list_messages(limit=limit, sender=sender, include_body=True)
+        # Default request on an unchanged inbox: the summary was already generated in the background
+        if sender is None and limit == SUMMARY_DEFAULT_LIMIT and self.user_id is not None:
+            prefetched = await prefetcher.lookup(self.user_id, gmail_service)
+            if prefetched and prefetched.summary and prefetched.covers(limit):
+                return {"status": "success", "message": prefetched.summary, "data": prefetched.messages[:limit]}
+
+        messages = await gmail_service.alist_messages(limit=limit, sender=sender, include_body=True)
 
         if not messages:
             return {"status": "success", "message": "Keine E-Mails zum Zusammenfassen gefunden."}
 
-        # Prepare content for summarization
-        email_texts = []
-        for i, msg in enumerate(messages):
-            body = msg.get('body', '') or msg.get('snippet', '')
-            sender = msg.get('sender', 'Unknown')
-            subject = msg.get('subject', 'No Subject')
-            email_texts.append(f"Email {i+1} from {sender}: Subject: {subject}. Body: {body}\n")
-
-        full_text = "\n".join(email_texts)
-        
-        # Call Gemini to summarize
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        if not self.llm.available:
              return {"status": "error", "message": "API Key fehlt für Zusammenfassung."}
 
         try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            
-            prompt = f"""
-            Fasse die folgenden E-Mails für einen Autofahrer zusammen, der sie sich anhört.
-            Halte dich extrem kurz und gesprächig.
-            KEINE Markdown-Formatierung (kein Fett, keine Listen, keine Aufzählungszeichen).
-            KEINE Sonderzeichen wie *, #, -.
-            Nur reiner Text, der gut vorgelesen werden kann.
-            Sprache: Deutsch.
-            
-            Struktur: "Du hast X neue E-Mails. [Absender] schreibt wegen [Betreff/Thema]. [Absender 2] hat..."
-            
-            E-Mails:
-            {full_text}
-            """
-            
-            response = model.generate_content(prompt)
-            summary = response.text
+            self.say(self._intro(messages))
+            summary = await self.summarize(messages)
             
             return {
                 "status": "success",
@@ -64,3 +49,53 @@ class EmailSummarizerAgent(BaseAgent):
             
         except Exception as e:
             return {"status": "error", "message": f"Fehler bei der Zusammenfassung: {str(e)}"}
+
+    async def summarize(self, messages: List[Dict[str, Any]]) -> str:
+        """One spoken summary for all messages, built from a short summary per mail. Mails seen before come from the cache."""
+        prompts = [self._prompt(msg) for msg in messages]
+
+        async def render_missing(indexes: List[int]) -> List[str]:
+            return list(await asyncio.gather(*(self._summarize_one(messages[i], prompts[i]) for i in indexes)))
+
+        summaries = await summary_cache.render(
+            self.user_id, self.model_name, [msg.get('id') for msg in messages], prompts,
+            render_missing, cacheable=lambda i, text: text != self._fallback_text(messages[i]),
+        )
+        return self._intro(messages) + " ".join(summaries)
+
+    @staticmethod
+    def _intro(messages: List[Dict[str, Any]]) -> str:
+        count = "eine neue E-Mail" if len(messages) == 1 else f"{len(messages)} neue E-Mails"
+        return f"Du hast {count}. "
+
+    async def _summarize_one(self, msg: Dict[str, Any], prompt: str) -> str:
+        try:
+            return (await self.llm.agenerate(prompt)).strip()
+        except Exception as e:
+            print(f"Summary failed for {msg.get('id')}: {e}")
+            return self._fallback_text(msg)
+
+    @staticmethod
+    def _sender_name(msg: Dict[str, Any]) -> str:
+        sender = msg.get('sender', 'Unknown')
+        return sender.split('<')[0].strip().replace('"', '') if '<' in sender else sender
+
+    def _prompt(self, msg: Dict[str, Any]) -> str:
+        body = prepare_body(msg.get('body') or msg.get('snippet'), SUMMARY_BODY_TOKENS)
+        return f"""
+            Fasse die folgende E-Mail für einen Autofahrer, der sie sich anhört, in einem einzigen kurzen Satz zusammen.
+            Halte dich extrem kurz und gesprächig.
+            KEINE Markdown-Formatierung (kein Fett, keine Listen, keine Aufzählungszeichen).
+            KEINE Sonderzeichen wie *, #, -.
+            Nur reiner Text, der gut vorgelesen werden kann.
+            Sprache: Deutsch.
+
+            Struktur: "[Absender] schreibt wegen [Betreff/Thema]."
+
+            Absender: {self._sender_name(msg)}
+            Betreff: {msg.get('subject', 'No Subject')}
+            Inhalt: {body}
+            """
+
+    def _fallback_text(self, msg: Dict[str, Any]) -> str:
+        return f"{self._sender_name(msg)} schreibt wegen {msg.get('subject', 'No Subject')}."
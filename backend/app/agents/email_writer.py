@@ -1,11 +1,13 @@
-import os
-import google.generativeai as genai
 from .base import BaseAgent
 from ..services.gmail import GmailService
+from ..services.mail_body import prepare_body
+from ..services.contacts import contact_index
+from ..services.outbox import outbox
+from ..config import WRITER_CONTEXT_TOKENS
 from typing import Dict, Any
 
 class EmailWriterAgent(BaseAgent):
-    def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
+    async def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
         recipient = slots.get("recipient")
         subject = slots.get("subject")
         raw_body_instruction = slots.get("body")
@@ -13,39 +15,39 @@ class EmailWriterAgent(BaseAgent):
         if not all([recipient, subject, raw_body_instruction]):
             return {"status": "error", "message": "Missing required slots for writing email."}
 
-        gmail_service = GmailService(self.user_credentials)
+        gmail_service = await GmailService.open(self.user_credentials)
         
-        # 1. Fetch Context (Last 3 emails with this recipient)
-        received_msgs = gmail_service.list_messages(limit=3, sender=recipient, include_body=True)
-        
-        # Attempt to resolve email address if recipient is just a name
-        resolved_recipient = recipient
-        if "@" not in recipient and received_msgs:
-            # Extract email from the most recent message's sender
-            last_sender = received_msgs[0]['sender']
-            if "<" in last_sender and ">" in last_sender:
-                resolved_recipient = last_sender.split("<")[1].split(">")[0]
-            elif "@" in last_sender:
-                resolved_recipient = last_sender
+        # 1. Resolve the spoken name to an address locally, then fetch context (last 3 emails) for that address only
+        contact = await contact_index.resolve(self.user_id, recipient) if self.user_id is not None else None
+        if contact:
+            resolved_recipient = contact.address
+            recipient = contact.name or recipient
+            received_msgs = await gmail_service.alist_messages(limit=3, sender=contact.address, include_body=True)
+        else:
+            # Not in the contact index: search Gmail for the name and take the newest sender's address
+            received_msgs = await gmail_service.alist_messages(limit=3, sender=recipient, include_body=True)
+            resolved_recipient = recipient
+            if "@" not in recipient and received_msgs:
+                last_sender = received_msgs[0]['sender']
+                if "<" in last_sender and ">" in last_sender:
+                    resolved_recipient = last_sender.split("<")[1].split(">")[0]
+                elif "@" in last_sender:
+                    resolved_recipient = last_sender
         
         context_text = ""
         if received_msgs:
             context_text = "Verlauf der letzten E-Mails mit diesem Empfänger:\n"
             for msg in received_msgs:
-                body_preview = msg.get('body', '')[:500] # Limit body length
+                body_preview = prepare_body(msg.get('body'), WRITER_CONTEXT_TOKENS)
                 context_text += f"- Von: {msg['sender']}\n  Betreff: {msg['subject']}\n  Inhalt: {body_preview}\n\n"
         else:
             context_text = "Keine vorherigen E-Mails mit diesem Empfänger gefunden."
 
         # 2. Generate Email Content with Gemini
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        if not self.llm.available:
              return {"status": "error", "message": "API Key missing for email generation."}
 
         try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            
             prompt = f"""
             Du bist ein professioneller E-Mail-Assistent.
             Deine Aufgabe ist es, den Text für eine E-Mail zu verfassen.
@@ -64,22 +66,26 @@ class EmailWriterAgent(BaseAgent):
             4. Gib NUR den E-Mail-Text zurück. Keine Betreffzeile, keine Einleitung wie "Hier ist der Entwurf".
             """
             
-            response = model.generate_content(prompt)
-            generated_body = response.text
-            
-            # 3. Create Draft
-            draft = gmail_service.create_draft(resolved_recipient, subject, generated_body)
+            if "@" not in resolved_recipient or self.user_id is None:
+                return {"status": "error", "message": f"Ich habe keine E-Mail-Adresse für {recipient} gefunden."}
 
-            if draft:
-                return {
-                    "status": "success",
-                    "message": f"Entwurf erstellt. Inhalt: {generated_body}. Soll ich ihn senden?",
-                    "draft_id": draft['id'],
-                    "action_needed": "confirm_send",
-                    "generated_content": generated_body
-                }
+            if self.stream is not None:
+                # The driver hears the mail while Gemini is still writing it
+                self.say("Entwurf wird erstellt. Inhalt: ")
+                generated_body = await self.llm.agenerate_streamed(prompt, self.say)
             else:
-                return {"status": "error", "message": "Fehler beim Erstellen des Entwurfs. Überprüfen Sie die E-Mail-Adresse."}
+                generated_body = await self.llm.agenerate(prompt)
+            
+            # 3. Queue the draft, the outbox worker creates it in Gmail while the user listens
+            queued = await outbox.enqueue(self.user_id, resolved_recipient, subject, generated_body, recipient_name=recipient)
+
+            return {
+                "status": "success",
+                "message": f"Entwurf wird erstellt. Inhalt: {generated_body}. Soll ich ihn senden?",
+                "outbox_id": queued.id,
+                "action_needed": "confirm_send",
+                "generated_content": generated_body
+            }
 
         except Exception as e:
             return {"status": "error", "message": f"Fehler bei der E-Mail-Generierung: {str(e)}"}
@@ -1,27 +1,27 @@
 from .base import BaseAgent
-from ..services.gmail import GmailService
+from ..services.outbox import outbox
 from typing import Dict, Any
 
 class SendEmailAgent(BaseAgent):
-    def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
-        # This agent expects a 'draft_id' to be passed in slots, 
-        # OR it might need to look up the last created draft from context if not provided explicitly.
-        # For now, let's assume the orchestrator or the user provides it, 
-        # or we handle the "send the last draft" logic here.
-        
+    async def execute(self, slots: Dict[str, Any]) -> Dict[str, Any]:
+        # The orchestrator passes the outbox entry of the conversation's last draft.
+        # Drafts created before the outbox existed only have their Gmail draft id.
+        outbox_id = slots.get("outbox_id")
         draft_id = slots.get("draft_id")
-        
-        if not draft_id:
-            return {"status": "error", "message": "Keine Entwurfs-ID gefunden. Bitte erstelle zuerst einen Entwurf."}
 
-        gmail_service = GmailService(self.user_credentials)
-        result = gmail_service.send_email(draft_id)
+        if self.user_id is None or not (outbox_id or draft_id):
+            return {"status": "error", "message": "Keine Entwurfs-ID gefunden. Bitte erstelle zuerst einen Entwurf."}
 
-        if result:
-            return {
-                "status": "success",
-                "message": "E-Mail erfolgreich gesendet!",
-                "data": result
-            }
+        # Only queued here, the outbox worker sends (and retries) without keeping the driver waiting
+        if outbox_id:
+            queued = await outbox.request_send(self.user_id, outbox_id)
         else:
-            return {"status": "error", "message": "Fehler beim Senden der E-Mail."}
+            queued = await outbox.enqueue(self.user_id, "", "", "", draft_id=draft_id, send=True, key=f"draft-{draft_id}")
+
+        if queued is None:
+            return {"status": "error", "message": "Kein Entwurf zum Senden gefunden."}
+        if queued.status == "failed":
+            return {"status": "error", "message": "Der Entwurf konnte nicht erstellt werden. Überprüfe die E-Mail-Adresse."}
+        if queued.status == "sent":
+            return {"status": "success", "message": "Die E-Mail wurde bereits gesendet.", "outbox_id": queued.id}
+        return {"status": "success", "message": "Alles klar, ich sende die E-Mail.", "outbox_id": queued.id}
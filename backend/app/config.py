@@ -1,5 +1,6 @@
 # config.py
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,3 +10,124 @@ TRANSCRIBE_SST_API_KEY = os.getenv("TRANSCRIBE_SST_API")
 LLM_API_KEY = os.getenv("LLM_API")
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
+
+# Database engines (see database.py), pool settings apply per engine and worker
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true" # log every SQL statement
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30")) # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800")) # seconds before a connection is replaced
+
+# Conversation history rows (Message) written in bulk in the background instead of in the turn's transaction
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "false").lower() == "true"
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "200"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0")) # seconds between bulk inserts
+HISTORY_MAX_QUEUE = int(os.getenv("HISTORY_MAX_QUEUE", "10000")) # rows beyond this are written inline
+
+# Gmail allows up to 100 calls per batch request, 50 is the recommended maximum
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))
+
+# Local mailbox mirror (see services/mailbox.py)
+MAILBOX_MIRROR_ENABLED = os.getenv("MAILBOX_MIRROR_ENABLED", "true").lower() == "true"
+MAILBOX_MIRROR_SIZE = int(os.getenv("MAILBOX_MIRROR_SIZE", "100")) # newest messages kept per user
+MAILBOX_SYNC_INTERVAL = int(os.getenv("MAILBOX_SYNC_INTERVAL", "30")) # seconds before the mirror counts as stale
+MAILBOX_SYNC_THREADS = int(os.getenv("MAILBOX_SYNC_THREADS", "4")) # full syncs running in the background per worker
+
+# Contact index for recipient resolution (see services/contacts.py)
+CONTACT_MATCH_THRESHOLD = float(os.getenv("CONTACT_MATCH_THRESHOLD", "0.75")) # minimum name similarity, 0..1
+CONTACT_CACHE_TTL = float(os.getenv("CONTACT_CACHE_TTL", "60")) # seconds a worker reuses a user's loaded contacts
+
+# Outbox for drafts and sends (see services/outbox.py), delivered by a background worker with retries
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5")) # seconds between scans for due deliveries
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20")) # deliveries claimed per scan
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")) # after this many failed tries a mail counts as failed
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "2")) # seconds before the first retry, doubled per attempt
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "300")) # upper bound of the retry delay
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "120")) # seconds a claimed delivery is locked against other workers
+
+# EmailReaderAgent: how mails are formatted for read-out ("parallel", "batch" or "serial")
+READER_FORMAT_MODE = os.getenv("READER_FORMAT_MODE", "parallel")
+READER_MAX_CONCURRENCY = int(os.getenv("READER_MAX_CONCURRENCY", "4")) # concurrent LLM calls per user
+
+# Per-mail token budgets for the cleaned body text (quotes, signatures and footers removed) in each prompt
+READER_BODY_TOKENS = int(os.getenv("READER_BODY_TOKENS", "600"))
+SUMMARY_BODY_TOKENS = int(os.getenv("SUMMARY_BODY_TOKENS", "250"))
+WRITER_CONTEXT_TOKENS = int(os.getenv("WRITER_CONTEXT_TOKENS", "150"))
+
+# Per-mail speakable texts and summaries stored in the database (see services/renderings.py)
+MESSAGE_CACHE_ENABLED = os.getenv("MESSAGE_CACHE_ENABLED", "true").lower() == "true"
+MESSAGE_CACHE_MAX_AGE_DAYS = int(os.getenv("MESSAGE_CACHE_MAX_AGE_DAYS", "30")) # older entries are purged at startup
+
+# Background inbox prefetch with pre-rendered read-outs (see services/prefetch.py)
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true" # users can still opt out via /ai/prefetch
+PREFETCH_LIMIT = int(os.getenv("PREFETCH_LIMIT", "5")) # newest mails fetched and pre-rendered
+PREFETCH_FRESH_AGE = float(os.getenv("PREFETCH_FRESH_AGE", "30")) # seconds a result is used without checking Gmail
+PREFETCH_MAX_AGE = float(os.getenv("PREFETCH_MAX_AGE", "300")) # seconds after which a result is always discarded
+PREFETCH_WAIT = float(os.getenv("PREFETCH_WAIT", "2")) # seconds a turn waits for a running prefetch before fetching itself
+PREFETCH_MAX_USERS = int(os.getenv("PREFETCH_MAX_USERS", "1000")) # results and users kept in memory, least recently active dropped first
+PREFETCH_IDLE = float(os.getenv("PREFETCH_IDLE", "3600")) # seconds without a turn after which a user is no longer re-prefetched
+
+# Gemini (see services/llm.py)
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30")) # seconds per generate_content call
+
+# Upstream rate limiting (see services/ratelimit.py), token buckets per worker: divide by the number of workers
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "2")) # bucket size, in seconds of the rate
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3")) # retries of a call answered with 429
+RATE_LIMIT_BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "1")) # seconds, doubled per retry
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "32"))
+GMAIL_QUOTA_USER_RATE = float(os.getenv("GMAIL_QUOTA_USER_RATE", "250")) # Gmail quota units per second and user
+GMAIL_QUOTA_GLOBAL_RATE = float(os.getenv("GMAIL_QUOTA_GLOBAL_RATE", "20000")) # quota units per second for the project
+LLM_RPM_USER = float(os.getenv("LLM_RPM_USER", "300")) # Gemini requests per minute and user
+LLM_RPM_GLOBAL = float(os.getenv("LLM_RPM_GLOBAL", "2000")) # Gemini requests per minute for the API key
+
+# Pool of built Gmail API clients (see services/gmail_pool.py)
+GMAIL_POOL_SIZE = int(os.getenv("GMAIL_POOL_SIZE", "256")) # users kept warm per worker
+GMAIL_POOL_TTL = int(os.getenv("GMAIL_POOL_TTL", "1800")) # seconds a client is reused before it is rebuilt
+GMAIL_HTTP_TIMEOUT = float(os.getenv("GMAIL_HTTP_TIMEOUT", "30"))
+
+# Intent schema used by /ai/process_intent (see services/intents.py)
+INTENT_SCHEMA_PATH = os.getenv(
+    "INTENT_SCHEMA_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example-json-output.json")
+)
+INTENT_SCHEMA_RELOAD = os.getenv("INTENT_SCHEMA_RELOAD", "false").lower() == "true" # re-read the file when its mtime changes
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true" # classify obvious utterances locally
+
+# Text-to-speech (see services/tts.py)
+TTS_MAX_CHUNK_BYTES = int(os.getenv("TTS_MAX_CHUNK_BYTES", "4500")) # Google TTS rejects inputs over 5000 bytes
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "300")) # sentences after the first are merged up to this size
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4")) # chunks synthesized in parallel per request
+
+# Synthesized audio in the shared cache, with hot entries also kept in each worker's memory
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_TTL = float(os.getenv("TTS_CACHE_TTL", str(30 * 24 * 3600))) # seconds, the audio of a text never changes
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+TTS_CACHE_PREWARM = os.getenv("TTS_CACHE_PREWARM", "true").lower() == "true" # synthesize schema prompts at startup
+
+# Speech-to-text (see services/audio.py)
+TRANSCODE_CONCURRENCY = int(os.getenv("TRANSCODE_CONCURRENCY", str(os.cpu_count() or 2))) # parallel ffmpeg processes per worker
+INLINE_AUDIO_MAX_BYTES = int(os.getenv("INLINE_AUDIO_MAX_BYTES", str(15 * 1024 * 1024))) # larger audio goes through the File API
+STT_PARTIAL_INTERVAL = float(os.getenv("STT_PARTIAL_INTERVAL", "1.5")) # seconds between partial transcripts on /speech/stream
+STT_PARTIAL_MIN_AUDIO = float(os.getenv("STT_PARTIAL_MIN_AUDIO", "1.0")) # seconds of new audio needed for another partial
+STT_PARTIAL_WINDOW = float(os.getenv("STT_PARTIAL_WINDOW", "8")) # seconds of trailing audio a partial transcribes
+STT_MAX_PARTIALS = int(os.getenv("STT_MAX_PARTIALS", "10")) # partial transcripts per utterance, each one is a Gemini call
+
+# Shared cache (see services/cache.py): "memory" (per worker), "sqlite" (a file shared by the workers of one host)
+# or "database" (a table in DATABASE_URL, shared by every host)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "drivemail-cache.db"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(512 * 1024 * 1024))) # least recently read entries are evicted beyond this
+CACHE_LOCK_TIMEOUT = float(os.getenv("CACHE_LOCK_TIMEOUT", "30")) # seconds other workers wait for one computing a missing value
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "600")) # seconds a Gemini intent classification is reused for the same prompt, 0 disables
+
+# Seconds the texts of a /voice/turn stay available at GET /voice/turn/{id}
+VOICE_TURN_TEXT_TTL = float(os.getenv("VOICE_TURN_TEXT_TTL", "600"))
+
+# Blocking Gmail API calls made from async code run on this many threads per worker
+GMAIL_IO_THREADS = int(os.getenv("GMAIL_IO_THREADS", "32"))
+
+# Requests slower than this many seconds are logged with their per-stage breakdown
+METRICS_SLOW_REQUEST = float(os.getenv("METRICS_SLOW_REQUEST", "1.0"))
@@ -1,12 +1,41 @@
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 import os
 from dotenv import load_dotenv
+from .config import DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, echo=True)
+def _engine_options(url: str) -> dict:
+    options = {"echo": DB_ECHO}
+    # SQLite uses a single-connection pool that takes no sizing arguments
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+    return options
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+
+def _async_database_url(url: str) -> str:
+    """Same database, async driver (asyncpg for Postgres)."""
+    for prefix in ("postgresql+psycopg2://", "postgresql+pg8000://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+# Used by the request path (process_intent), the sync engine stays for startup, scripts and
+# code that already runs in worker threads (e.g. the mailbox mirror).
+async_engine = create_async_engine(_async_database_url(DATABASE_URL), **_engine_options(DATABASE_URL))
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
@@ -14,3 +43,8 @@ def create_db_and_tables():
 def get_session():
     with Session(engine) as session:
         yield session
+
+async def get_async_session():
+    # Objects stay usable after commit, lazy refreshes are not possible on an async session
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
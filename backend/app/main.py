@@ -1,8 +1,19 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from .database import create_db_and_tables
-from .routers import auth, speech, ai
+from sqlmodel import Session
+from .database import create_db_and_tables, engine
+from .services.intents import load_intents
+from .services import tts, renderings
+from .services.prefetch import prefetcher
+from .services.mailbox import on_mailbox_change
+from .services.history import history_writer
+from .services.outbox import outbox
+from .services.cache import shared_backend, cache_stats
+from .services.metrics import MetricsMiddleware, render_metrics
+from .config import TTS_CACHE_PREWARM, HISTORY_WRITE_BEHIND, METRICS_SLOW_REQUEST
+from .routers import auth, speech, ai, voice
 
 load_dotenv()
 
@@ -11,6 +22,34 @@ app = FastAPI()
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
+    # Fail the boot on a broken intent schema instead of on the first live request
+    intents = load_intents()
+    # Cached mail renderings of replaced prompt versions will never be read again
+    with Session(engine) as session:
+        renderings.purge_outdated(session)
+    # Entries that expired while no worker was writing, before the first lookups
+    try:
+        shared_backend().evict()
+    except Exception as e:
+        print(f"Cache eviction failed: {e}")
+    if TTS_CACHE_PREWARM:
+        tts.prewarm(intents.slot_prompts() + tts.COMMON_PHRASES)
+
+@app.on_event("startup")
+async def start_background_work():
+    # Logins and mailbox syncs run in worker threads, they hand prefetches over to this loop
+    prefetcher.attach(asyncio.get_running_loop())
+    on_mailbox_change(prefetcher.notify_changed)
+    if HISTORY_WRITE_BEHIND:
+        history_writer.start()
+    # Drafts and sends queued by the turns, and retries of earlier failures
+    outbox.start()
+
+@app.on_event("shutdown")
+async def flush_history():
+    # Conversation history still waiting in the write-behind queue
+    await history_writer.stop()
+    await outbox.stop()
 
 # Allow CORS for frontend
 app.add_middleware(
@@ -19,13 +58,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=voice.TURN_HEADERS,
 )
+# Outermost, so the latency includes CORS handling and the whole streamed body
+app.add_middleware(MetricsMiddleware, slow_request=METRICS_SLOW_REQUEST)
 
 @app.get("/health")
 def health():
     return {"status": "ok", "service": "DriveMail Backend"}
 
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape target: per-stage, intent and agent latency histograms, in-flight and error counters
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+@app.get("/cache/stats")
+def cache_statistics():
+    """Hits and misses per cache namespace of this worker, and the size of the (shared) store."""
+    return cache_stats()
+
 # Include Routers
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(speech.router, prefix="/speech", tags=["Speech"])
-app.include_router(ai.router, prefix="/ai", tags=["AI"])
\ No newline at end of file
+app.include_router(ai.router, prefix="/ai", tags=["AI"])
+app.include_router(voice.router, prefix="/voice", tags=["Voice"])
\ No newline at end of file
@@ -1,5 +1,7 @@
-from typing import Optional, List
-from sqlmodel import Field, SQLModel, Relationship
+from typing import Optional, List, Dict, Any
+from sqlmodel import Field, SQLModel, Relationship, UniqueConstraint, Index
+from sqlalchemy import BigInteger, JSON, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
 import json
 
@@ -8,13 +10,14 @@ class User(SQLModel, table=True):
     email: str = Field(index=True, unique=True)
     name: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    prefetch_enabled: bool = Field(default=True) # background inbox prefetch, see services/prefetch.py
     
     conversations: List["Conversation"] = Relationship(back_populates="user")
     credentials: List["OAuthCredential"] = Relationship(back_populates="user")
 
 class OAuthCredential(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id")
+    user_id: int = Field(foreign_key="user.id", index=True)
     access_token: str
     refresh_token: Optional[str] = None
     token_uri: Optional[str] = None
@@ -25,12 +28,18 @@ class OAuthCredential(SQLModel, table=True):
     
     user: Optional[User] = Relationship(back_populates="credentials")
 
+# JSONB on Postgres, plain JSON (text) elsewhere, e.g. SQLite in scripts
+JSONState = JSON().with_variant(JSONB(), "postgresql")
+
 class Conversation(SQLModel, table=True):
+    # process_intent loads a user's latest conversation on every turn
+    __table_args__ = (Index("ix_conversation_user_id_updated_at", "user_id", "updated_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
-    state: str = Field(default="{}") # JSON string storing current intent and slots
+    state: Dict[str, Any] = Field(default_factory=dict, sa_type=JSONState) # current intent and slots, assign a new dict to change it
     
     user: Optional[User] = Relationship(back_populates="conversations")
     messages: List["Message"] = Relationship(back_populates="conversation")
@@ -38,7 +47,7 @@ class Conversation(SQLModel, table=True):
 
 class Message(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    conversation_id: int = Field(foreign_key="conversation.id")
+    conversation_id: int = Field(foreign_key="conversation.id", index=True)
     role: str # "user" or "assistant"
     content: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -46,6 +55,9 @@ class Message(SQLModel, table=True):
     conversation: Optional[Conversation] = Relationship(back_populates="messages")
 
 class Task(SQLModel, table=True):
+    # confirm_send looks up the conversation's latest send_email task
+    __table_args__ = (Index("ix_task_conversation_id_intent_created_at", "conversation_id", "intent", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     conversation_id: int = Field(foreign_key="conversation.id")
     intent: str
@@ -55,4 +67,95 @@ class Task(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     completed_at: Optional[datetime] = None
 
-    conversation: Optional[Conversation] = Relationship(back_populates="tasks")
\ No newline at end of file
+    conversation: Optional[Conversation] = Relationship(back_populates="tasks")
+
+class MailboxMessage(SQLModel, table=True):
+    """Local mirror of a Gmail message (headers + decoded body), kept fresh via history syncs."""
+    __table_args__ = (UniqueConstraint("user_id", "gmail_id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    gmail_id: str
+    thread_id: Optional[str] = None
+    subject: str
+    sender: str
+    to: str
+    date: str
+    snippet: Optional[str] = None
+    body: Optional[str] = None
+    label_ids: str = Field(default="") # Comma separated Gmail label ids
+    internal_date: int = Field(default=0, sa_type=BigInteger) # Gmail internalDate (ms since epoch), used for ordering
+    synced_at: datetime = Field(default_factory=datetime.utcnow)
+
+class MailboxSyncState(SQLModel, table=True):
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    history_id: Optional[str] = None # Gmail historyId the mirror is consistent with
+    complete: bool = Field(default=False) # True if the mirror holds the whole mailbox
+    synced_at: Optional[datetime] = None
+
+class Contact(SQLModel, table=True):
+    """Someone the user exchanged mail with, to resolve spoken names to addresses (see services/contacts.py)."""
+    __table_args__ = (UniqueConstraint("user_id", "address"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    address: str # lowercased email address
+    name: str = Field(default="") # display name from the newest header that had one
+    phonetic: str = Field(default="") # Kölner Phonetik codes of the name parts, space separated
+    sent_count: int = Field(default=0) # mails the user sent to this address (To/Cc)
+    received_count: int = Field(default=0) # mails from this address, or with it in Cc
+    last_seen: int = Field(default=0, sa_type=BigInteger) # internalDate (ms) of the newest mail counted
+
+class OutboxMessage(SQLModel, table=True):
+    """A mail the user dictated, drafted and sent by the outbox worker (see services/outbox.py)."""
+    # The worker scans for due deliveries, the status intent looks up a user's newest mail
+    __table_args__ = (
+        Index("ix_outboxmessage_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("ix_outboxmessage_user_id_created_at", "user_id", "created_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    idempotency_key: str = Field(unique=True) # also the mail's Message-ID, to find it in Gmail after an unclear failure
+    recipient: str
+    recipient_name: str = Field(default="") # as the user said it, for spoken status answers
+    subject: str
+    body: str
+    status: str = Field(default="pending") # pending (draft not created yet), drafted, sent, failed
+    send_requested: bool = Field(default=False) # set when the user confirms, the worker sends once drafted
+    draft_id: Optional[str] = None
+    gmail_message_id: Optional[str] = None
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    locked_until: Optional[datetime] = None # lease of the worker delivering it
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+
+class MessageRendering(SQLModel, table=True):
+    """LLM output for one mail (speakable text or short summary), reused until the prompt or model changes."""
+    __table_args__ = (UniqueConstraint("user_id", "gmail_id", "kind", "prompt_version", "model"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    gmail_id: str
+    kind: str # "speakable" or "summary"
+    prompt_version: str
+    model: str
+    source_hash: str # hash of the full prompt, changed inputs (e.g. "Heute" turning into a date) are re-rendered
+    text: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CacheEntry(SQLModel, table=True):
+    """One value of the shared cache (see services/cache.py), in the application database or the local SQLite cache file."""
+    # Eviction deletes expired entries, then the least recently read ones
+    __table_args__ = (
+        Index("ix_cacheentry_expires_at", "expires_at"),
+        Index("ix_cacheentry_accessed_at", "accessed_at"),
+    )
+
+    key: str = Field(primary_key=True) # "<namespace>:<key>"
+    value: bytes = Field(sa_type=LargeBinary)
+    expires_at: Optional[float] = None # epoch seconds, None = until evicted
+    accessed_at: float # epoch seconds of the last read, updated at most once a minute
+    size: int # bytes of value, for the size bound
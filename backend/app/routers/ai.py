@@ -1,21 +1,42 @@
 import os
 import json
+import logging
+import time
+import asyncio
+from typing import Awaitable, Callable, Optional
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import google.generativeai as genai
-from sqlmodel import Session, select
-from ..database import get_session
-from ..models import User, Conversation, Message, Task, OAuthCredential
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ..database import get_async_session, async_engine
+from ..services.llm import get_llm, agenerate_cached
+from ..services.intents import get_intents, IntentSchemaError
+from ..services.intent_classifier import get_classifier
+from ..services.contacts import contact_index
+from ..services.prefetch import prefetcher
+from ..services.outbox import outbox
+from ..services.ratelimit import current_user
+from ..services.turn_stream import TurnStream
+from ..services.unit_of_work import TurnUnitOfWork
+from ..services.metrics import INTENT_LATENCY, AGENT_LATENCY
+from ..config import FAST_PATH_ENABLED
+from ..models import User, Conversation, Task, OAuthCredential
 from ..agents.email_writer import EmailWriterAgent
 from ..agents.email_reader import EmailReaderAgent
 from ..agents.email_summarizer import EmailSummarizerAgent
 from ..agents.send_email import SendEmailAgent
-from datetime import datetime
+from ..agents.email_status import EmailStatusAgent
 
 load_dotenv()
 
 router = APIRouter()
+# Per-turn details (user input, state, raw LLM output) hold personal data, they are only logged at debug level
+logger = logging.getLogger(__name__)
+
+# Streamed turns run on as tasks when the client disconnects, so the turn is still saved
+_stream_tasks = set()
 
 class AIRequest(BaseModel):
     prompt: str
@@ -24,102 +45,184 @@ class IntentRequest(BaseModel):
     text: str
     user_id: int
 
+class PrefetchSettings(BaseModel):
+    user_id: int
+    enabled: bool
+
+def _timeless(response_text: str) -> bool:
+    """Classifications can be cached, chitchat answers are written for the moment ("Wie spät ist es?")."""
+    try:
+        return json.loads(response_text).get("intent") != "chitchat"
+    except (ValueError, AttributeError):
+        return False
+
 @router.post("/generate")
-def generate_text(request: AIRequest):
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
+async def generate_text(request: AIRequest):
+    llm = get_llm()
+    if not llm.available:
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
         
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-2.0-flash")
+        result = await llm.agenerate(request.prompt)
         
-        response = model.generate_content(request.prompt)
-        
-        return {"result": response.text}
+        return {"result": result}
         
     except Exception as e:
         print(f"Gemini Error: {e}")
         raise HTTPException(status_code=500, detail=f"Gemini Error: {str(e)}")
 
+@router.get("/fast_path/stats")
+def fast_path_stats():
+    """How many utterances the local classifier answered without an LLM call."""
+    return get_classifier().stats()
+
+@router.post("/prefetch")
+async def prefetch_settings(request: PrefetchSettings, session: AsyncSession = Depends(get_async_session)):
+    """Opt in to or out of the background inbox prefetch."""
+    user = await session.get(User, request.user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user.prefetch_enabled = request.enabled
+    session.add(user)
+    await session.commit()
+    if not request.enabled:
+        prefetcher.forget(request.user_id)
+    return {"user_id": request.user_id, "prefetch_enabled": request.enabled}
+
+@router.get("/prefetch/stats")
+def prefetch_stats():
+    return prefetcher.stats()
+
+@router.get("/outbox/stats")
+def outbox_stats():
+    """Drafts created, mails sent, retried and failed by this worker's outbox."""
+    return outbox.stats()
+
 @router.post("/process_intent")
-def process_intent(request: IntentRequest, session: Session = Depends(get_session)):
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
+async def process_intent(request: IntentRequest, session: AsyncSession = Depends(get_async_session)):
+    return await handle_intent(request.text, request.user_id, session)
+
+@router.post("/process_intent/stream")
+async def process_intent_stream(request: IntentRequest):
+    """
+    Same turn as /ai/process_intent, as Server-Sent Events: "intent" once the utterance is
+    classified, a "sentence" for every complete sentence of the response as the agent
+    produces it, then "done" with the full result (or "error").
+    """
+    stream = start_streamed_turn(request.text, request.user_id)
+    return StreamingResponse(
+        stream.events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def start_streamed_turn(text: str, user_id: int,
+                        on_result: Optional[Callable[[dict], Awaitable[None]]] = None) -> TurnStream:
+    """
+    Run handle_intent as a background task feeding a TurnStream, ending with "done" or
+    "error". on_result(result_json) runs when the turn succeeded, even if the client is gone.
+    """
+    stream = TurnStream()
+
+    async def run_turn():
+        try:
+            # Own session: the request's dependency session would close when the response starts
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                result_json = await handle_intent(text, user_id, session, stream=stream)
+            if on_result:
+                await on_result(result_json)
+            stream.event("done", result_json)
+        except HTTPException as e:
+            stream.event("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            stream.event("error", {"status_code": 500, "detail": str(e)})
+        finally:
+            stream.close()
+
+    task = asyncio.create_task(run_turn())
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+    return stream
+
+async def run_agent(agent, slots: dict, stream: Optional[TurnStream] = None) -> dict:
+    """Execute an agent and record its latency per agent class and outcome."""
+    start = time.perf_counter()
+    status = "error"
+    agent.stream = stream
+    try:
+        response = await agent.execute(slots)
+        status = response.get("status", "success")
+        return response
+    finally:
+        AGENT_LATENCY.labels(type(agent).__name__, status).observe(time.perf_counter() - start)
+
+async def handle_intent(text: str, user_id: int, session: AsyncSession, stream: Optional[TurnStream] = None) -> dict:
+    """
+    One conversation turn: classify the utterance, update the conversation state and run
+    the agent once all slots are filled. Shared by /ai/process_intent, its streamed
+    variant (stream receives the response as it is produced) and /voice/turn.
+    """
+    llm = get_llm()
+    if not llm.available:
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
+    # The turn's Gemini calls count against this user's request budget
+    current_user.set(user_id)
 
-    # 1. Load Intent Schema
+    # 1. Load Intent Schema (parsed and validated once, see services/intents.py)
     try:
-        with open("example-json-output.json", "r", encoding="utf-8") as f:
-            intent_schema = json.load(f)
-    except Exception as e:
+        intents = get_intents()
+    except IntentSchemaError as e:
         raise HTTPException(status_code=500, detail=f"Could not load intent schema: {e}")
 
-    # 2. Get or Create Conversation
-    conversation = session.exec(select(Conversation).where(Conversation.user_id == request.user_id).order_by(Conversation.updated_at.desc())).first()
+    # 2. Get or Create Conversation (all writes of the turn are saved in one transaction at the end)
+    conversation = (await session.exec(select(Conversation).where(Conversation.user_id == user_id).order_by(Conversation.updated_at.desc()).limit(1))).first()
     
     if not conversation:
-        conversation = Conversation(user_id=request.user_id, state="{}")
-        session.add(conversation)
-        session.commit()
-        session.refresh(conversation)
+        conversation = Conversation(user_id=user_id, state={})
+    uow = TurnUnitOfWork(session, conversation)
 
     # 3. Save User Message
-    user_msg = Message(conversation_id=conversation.id, role="user", content=request.text)
-    session.add(user_msg)
-    session.commit()
+    uow.add_message("user", text)
+
+    # Credentials are needed for prefetching and for running the agent
+    creds_row = (await session.exec(
+        select(OAuthCredential, User.prefetch_enabled).join(User, User.id == OAuthCredential.user_id)
+        .where(OAuthCredential.user_id == user_id).limit(1)
+    )).first()
+    creds, prefetch_enabled = creds_row if creds_row else (None, False)
 
     # 4. Construct Prompt for Gemini
-    current_state = json.loads(conversation.state)
-    
-    print(f"--- DEBUG: process_intent ---")
-    print(f"User Input: {request.text}")
-    print(f"Current State: {current_state}")
+    current_state = conversation.state or {}
     
-    system_prompt = f"""
-    You are an intelligent assistant for an email app called DriveMail.
-    Your goal is to classify the user's intent and extract necessary information based on the provided schema.
+    logger.debug("process_intent user %s input %r state %s", user_id, text, current_state)
     
-    Capabilities:
-    - You can READ emails ("Lies meine E-Mails", "Was gibt es Neues?").
-    - You can SUMMARIZE emails ("Fasse meine E-Mails zusammen", "Worum geht es in der Mail von X?").
-    - You can WRITE and SEND emails ("Schreibe eine E-Mail an X", "Antworte auf die letzte Mail").
-    - You can answer general questions about what you can do (Chitchat).
-    
-    Schema:
-    {json.dumps(intent_schema, indent=2)}
-    
-    Current State:
-    {json.dumps(current_state, indent=2)}
-    
-    User Input: "{request.text}"
-    
-    Instructions:
-    1. Identify the intent from the user's input. If the intent is already known in Current State, continue with it unless the user explicitly changes topic.
-    2. Extract values for the slots defined in the schema for that intent.
-    3. If a required slot is missing, your 'response' should be the 'prompt' defined in the schema for that slot.
-    4. If all required slots are filled, your 'response' should be a confirmation message in German, like "Bereit, die E-Mail an [recipient] mit dem Betreff [subject] zu senden...".
-    5. If the intent is 'chitchat', provide a helpful and natural response in German in the 'response' field. Explain your capabilities if asked.
-    6. Return a JSON object with the following structure:
-    {{
-        "intent": "string (name of the intent)",
-        "slots": {{ "slot_name": "extracted_value" }},
-        "missing_slots": ["slot_name"],
-        "response": "string (what to say back to the user)",
-        "completed": boolean (true if all required slots are filled)
-    }}
-    
-    Only return the JSON object, no markdown formatting.
-    """
+    # A new command usually reads or summarizes the inbox: fetch it while the utterance is classified
+    if not current_state and creds and prefetch_enabled:
+        prefetcher.schedule(creds)
 
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-2.0-flash", generation_config={"response_mime_type": "application/json"})
-        
-        response = model.generate_content(system_prompt)
-        print(f"DEBUG: LLM Raw Response: {response.text}")
-        result_json = json.loads(response.text)
-        print(f"DEBUG: Extracted Intent Data: {json.dumps(result_json, indent=2)}")
+        # Obvious utterances are classified locally, everything else goes to Gemini
+        result_json = None
+        classify_start = time.perf_counter()
+        source = "fast_path"
+        if FAST_PATH_ENABLED:
+            result_json = get_classifier().classify(text, current_state, await contact_index.names(user_id))
+        # No connection is held while Gemini and the agents work
+        await uow.release()
+
+        if result_json is None:
+            source = "llm"
+            system_prompt = intents.build_prompt(current_state, text)
+            # The prompt holds the whole conversation state, the same one classifies the same way (chitchat answers excepted)
+            response_text = await agenerate_cached(system_prompt, json_output=True, cacheable=_timeless)
+            logger.debug("LLM raw response: %s", response_text)
+            result_json = json.loads(response_text)
+        INTENT_LATENCY.labels(str(result_json.get("intent")), source).observe(time.perf_counter() - classify_start)
+        logger.debug("Intent data: %s", result_json)
+        if stream:
+            stream.event("intent", {
+                "intent": result_json.get("intent"), "slots": result_json.get("slots", {}),
+                "missing_slots": result_json.get("missing_slots", []), "completed": result_json.get("completed"), "source": source,
+            })
         
         # 5. Update State
         new_state = {
@@ -133,54 +236,50 @@ def process_intent(request: IntentRequest, session: Session = Depends(get_sessio
             intent_name = result_json.get("intent")
             slots = new_state["slots"]
             
-            # Get User Credentials
-            creds = session.exec(select(OAuthCredential).where(OAuthCredential.user_id == request.user_id)).first()
             if not creds:
                 result_json["response"] = "Fehler: Keine Anmeldeinformationen gefunden."
             else:
                 agent_response = None
                 if intent_name == "send_email" or intent_name == "save_draft":
                      agent = EmailWriterAgent(creds)
-                     agent_response = agent.execute(slots)
+                     agent_response = await run_agent(agent, slots, stream)
                 elif intent_name == "read_emails":
                      agent = EmailReaderAgent(creds)
-                     agent_response = agent.execute(slots)
+                     agent_response = await run_agent(agent, slots, stream)
                 elif intent_name == "summarize_emails":
                      agent = EmailSummarizerAgent(creds)
-                     agent_response = agent.execute(slots)
+                     agent_response = await run_agent(agent, slots, stream)
                 elif intent_name == "chitchat":
                      # No agent needed, the response is already in result_json["response"]
                      # But we need to ensure we don't treat it as an error or empty agent response
                      agent_response = {"status": "success", "message": result_json.get("response")}
                 elif intent_name == "confirm_send":
                      # We need to find the last draft created in this conversation
-                     last_task = session.exec(select(Task).where(Task.conversation_id == conversation.id).where(Task.intent == "send_email").order_by(Task.created_at.desc())).first()
+                     last_task = None
+                     if conversation.id is not None:
+                         last_task = (await session.exec(select(Task).where(Task.conversation_id == conversation.id).where(Task.intent == "send_email").order_by(Task.created_at.desc()).limit(1))).first()
+                         await uow.release()
                      
-                     draft_id = None
+                     send_slots = {}
                      if last_task and last_task.result:
                          try:
                              last_result = json.loads(last_task.result)
-                             draft_id = last_result.get("draft_id")
+                             send_slots = {key: last_result[key] for key in ("outbox_id", "draft_id") if last_result.get(key)}
                          except:
                              pass
                      
-                     if draft_id:
+                     if send_slots:
                          agent = SendEmailAgent(creds)
-                         agent_response = agent.execute({"draft_id": draft_id})
+                         agent_response = await run_agent(agent, send_slots, stream)
                      else:
                          agent_response = {"status": "error", "message": "Kein Entwurf zum Senden gefunden."}
+                elif intent_name == "email_status":
+                     agent = EmailStatusAgent(creds)
+                     agent_response = await run_agent(agent, slots, stream)
                 
                 if agent_response:
                     # Create Task Record
-                    task = Task(
-                        conversation_id=conversation.id,
-                        intent=intent_name,
-                        slots=json.dumps(slots),
-                        status=agent_response.get("status", "completed"),
-                        result=json.dumps(agent_response),
-                        completed_at=datetime.utcnow()
-                    )
-                    session.add(task)
+                    uow.add_task(intent_name, slots, agent_response)
                     
                     # Update Response to User
                     if agent_response.get("status") == "success":
@@ -191,14 +290,13 @@ def process_intent(request: IntentRequest, session: Session = Depends(get_sessio
                     else:
                         result_json["response"] = f"Fehler: {agent_response.get('message')}"
 
-        conversation.state = json.dumps(new_state)
-        conversation.updated_at = datetime.utcnow()
-        session.add(conversation)
+        uow.set_state(new_state)
         
         # 6. Save Assistant Message
-        assistant_msg = Message(conversation_id=conversation.id, role="assistant", content=result_json.get("response"))
-        session.add(assistant_msg)
-        session.commit()
+        uow.add_message("assistant", result_json.get("response"))
+        if stream:
+            stream.finish(result_json.get("response"))
+        await uow.commit()
         
         return result_json
 
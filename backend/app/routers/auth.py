@@ -2,10 +2,11 @@ from fastapi import APIRouter, HTTPException, Depends
 from sqlmodel import Session, select
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 from pydantic import BaseModel
 from ..database import get_session
 from ..models import User, OAuthCredential
+from ..services.gmail_pool import gmail_pool, build_gmail_client
+from ..services.prefetch import prefetcher
 import os
 
 router = APIRouter()
@@ -49,7 +50,7 @@ def google_auth(payload: AuthPayload, session: Session = Depends(get_session)):
         creds = flow.credentials
 
         # 2. Verify Token & Get User Info from Google
-        service = build('gmail', 'v1', credentials=creds)
+        service = build_gmail_client(creds)
         profile = service.users().getProfile(userId='me').execute()
         
         email = profile.get('emailAddress')
@@ -85,6 +86,12 @@ def google_auth(payload: AuthPayload, session: Session = Depends(get_session)):
             
         session.commit()
 
+        # Keep the client we just built, the first voice turn can then use it right away
+        gmail_pool.put(oauth_cred, service, creds)
+        # "Lies meine E-Mails" is the usual first command, have the answer ready before it comes
+        if user.prefetch_enabled:
+            prefetcher.schedule(oauth_cred)
+
         return {
             "status": "success", 
             "email": email, 
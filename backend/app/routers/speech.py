@@ -1,134 +1,140 @@
-import os
-import shutil
-import tempfile
-import time
-import subprocess
-import uuid
-from fastapi import APIRouter, HTTPException, UploadFile, File, Body
-from fastapi.responses import FileResponse
+import asyncio
+import json
+from fastapi import APIRouter, HTTPException, UploadFile, File, Body, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import google.generativeai as genai
-from google.cloud import texttospeech
-from imageio_ffmpeg import get_ffmpeg_exe
+from ..services.llm import get_llm
+from ..services import tts, audio
+from ..config import STT_PARTIAL_INTERVAL
 
 load_dotenv()
 
 router = APIRouter()
 
-# Initialize Google Cloud TTS Client
-# Ensure GOOGLE_APPLICATION_CREDENTIALS is set in your environment or .env
-try:
-    tts_client = texttospeech.TextToSpeechClient()
-except Exception as e:
-    print(f"Warning: Could not initialize Google TTS Client: {e}")
-    tts_client = None
-
 class SpeakRequest(BaseModel):
     text: str
+    stream: bool = False # stream audio chunks as soon as each sentence is synthesized
 
 @router.post("/speak")
 async def speak_text(request: SpeakRequest):
     """
     Generate speech from text using Google Cloud Text-to-Speech (Neural2 Voice).
     """
-    if not tts_client:
+    if not tts.tts_client:
         raise HTTPException(status_code=500, detail="Google TTS Client not initialized. Check credentials.")
 
+    if request.stream:
+        async def audio_stream():
+            try:
+                async for chunk in tts.stream_speech(request.text):
+                    yield chunk
+            except Exception as e:
+                # Headers are already sent, all we can do is end the stream
+                print(f"Google TTS Error: {e}")
+
+        return StreamingResponse(audio_stream(), media_type="audio/mpeg")
+
     try:
-        # Configure the request
-        synthesis_input = texttospeech.SynthesisInput(text=request.text)
-        
-        # Select the language and voice (German Neural2 Female)
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="de-DE",
-            name="de-DE-Neural2-F",
-        )
-        
-        # Select the type of audio file you want returned
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
-        )
-
-        # Perform the text-to-speech request
-        response = tts_client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config,
-        )
-
-        # Save to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-            tmp.write(response.audio_content)
-            output_file = tmp.name
-
-        return FileResponse(output_file, media_type="audio/mpeg", filename="speech.mp3")
+        audio = await tts.synthesize_text(request.text)
+        return Response(content=audio, media_type="audio/mpeg", headers={"Content-Disposition": 'attachment; filename="speech.mp3"'})
 
     except Exception as e:
         print(f"Google TTS Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/cache/stats")
+def tts_cache_stats():
+    """Hit/miss counters of the synthesized audio cache, the store's size is in /cache/stats."""
+    if not tts.tts_cache:
+        return {"enabled": False}
+    return {"enabled": True, **tts.tts_cache.stats()}
+
 @router.post("/transcribe")
 async def transcribe_audio(file: UploadFile = File(...)):
     print(f"Received file: {file.filename}, content_type: {file.content_type}")
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
+    llm = get_llm()
+    if not llm.available:
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
 
-    genai.configure(api_key=api_key)
-    
-    tmp_path = None
-    converted_path = None
-
     try:
-        # Create a temporary file to save the uploaded audio
+        # Audio stays in memory: ffmpeg reads and writes pipes, Gemini gets the bytes
         file_ext = file.filename.split('.')[-1].lower()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}") as tmp:
-            shutil.copyfileobj(file.file, tmp)
-            tmp_path = tmp.name
-
-        # Convert WebM/M4A to MP3 if necessary
-        upload_path = tmp_path
-        if file_ext in ['webm', 'm4a']:
-            converted_path = tmp_path.rsplit('.', 1)[0] + '.mp3'
-            ffmpeg_exe = get_ffmpeg_exe()
-            print(f"Converting {file_ext} to mp3...")
-            subprocess.run([
-                ffmpeg_exe, '-i', tmp_path, '-vn', '-ar', '44100', '-ac', '2', '-b:a', '192k', converted_path
-            ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            upload_path = converted_path
+        data = await file.read()
+        text = await audio.transcribe_upload(data, file_ext, file.content_type)
 
-        try:
-            # Upload the file to Gemini
-            myfile = genai.upload_file(upload_path)
-            
-            # Wait for the file to be active
-            while myfile.state.name == "PROCESSING":
-                time.sleep(1)
-                myfile = genai.get_file(myfile.name)
-
-            if myfile.state.name != "ACTIVE":
-                raise Exception(f"File upload failed with state: {myfile.state.name}")
-            
-            # Initialize the model
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            
-            # Generate content (transcription)
-            result = model.generate_content(["Transcribe this audio file exactly as spoken.", myfile])
-            
-            return {"text": result.text}
-            
-        finally:
-            # Clean up temporary files
-            if tmp_path and os.path.exists(tmp_path):
-                os.remove(tmp_path)
-            if converted_path and os.path.exists(converted_path):
-                os.remove(converted_path)
+        return {"text": text}
 
     except Exception as e:
         print(f"Gemini Transcribe Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.websocket("/stream")
+async def stream_transcription(websocket: WebSocket, format: str = "webm"):
+    """
+    Streaming speech-to-text.
+    The client sends audio as binary frames while recording and {"type": "end"} when the
+    user stops talking. The server answers with {"type": "partial", "text": ...} messages
+    while audio comes in and one {"type": "final", "text": ...} before closing.
+    format is the container of the frames and has to be streamable (see audio.STREAMING_FORMATS).
+    """
+    await websocket.accept()
+    if format not in audio.STREAMING_FORMATS:
+        # 1003: unsupported data, M4A/MP4 cannot be decoded before the recording is complete
+        message = f"Format {format} cannot be streamed, use one of {', '.join(sorted(audio.STREAMING_FORMATS))}"
+        await websocket.send_json({"type": "error", "message": message})
+        await websocket.close(code=1003, reason="Unsupported audio format") # reasons are capped at 123 bytes
+        return
+    if not get_llm().available:
+        await websocket.send_json({"type": "error", "message": "GEMINI_API_KEY not configured"})
+        await websocket.close()
+        return
+
+    transcriber = audio.StreamingTranscriber(format)
+    await transcriber.start()
+
+    async def send_partials():
+        while True:
+            await asyncio.sleep(STT_PARTIAL_INTERVAL)
+            if transcriber.has_new_audio():
+                try:
+                    text = await transcriber.partial()
+                except Exception as e:
+                    print(f"Partial transcription failed: {e}")
+                    continue
+                if text:
+                    await websocket.send_json({"type": "partial", "text": text})
+
+    partials = asyncio.create_task(send_partials())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                await transcriber.feed(message["bytes"])
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    continue
+                if control.get("type") == "end":
+                    break
+
+        partials.cancel()
+        text = await transcriber.finish()
+        await websocket.send_json({"type": "final", "text": text})
+        await websocket.close()
+
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        print(f"Gemini Transcribe Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"Streaming Transcribe Error: {e}")
+        try:
+            await websocket.send_json({"type": "error", "message": str(e)})
+            await websocket.close()
+        except Exception:
+            pass
+    finally:
+        partials.cancel()
+        await transcriber.close()
@@ -0,0 +1,152 @@
+import asyncio
+import time
+import uuid
+from urllib.parse import quote
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from dotenv import load_dotenv
+from ..services.llm import get_llm
+from ..services import tts, audio
+from ..services.cache import get_cache
+from ..services.ratelimit import current_user
+from ..services.turn_stream import TurnStream
+from ..config import VOICE_TURN_TEXT_TTL
+from .ai import start_streamed_turn
+
+load_dotenv()
+
+router = APIRouter()
+
+NOT_UNDERSTOOD = "Entschuldigung, das habe ich nicht verstanden."
+
+# Headers a browser client may read on the cross-origin response (see CORS setup in main.py)
+TURN_HEADERS = ["Server-Timing", "X-Transcript", "X-Intent", "X-Turn-Id"]
+# Proxies commonly reject responses with more than 8 KB of headers, the transcript header stays well below
+MAX_HEADER_TEXT_BYTES = 1024
+
+# Transcript, intent and answer text of recent turns, by X-Turn-Id, for any worker to answer
+turn_texts = get_cache("voice_turns", ttl=VOICE_TURN_TEXT_TTL)
+
+def _ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+def _header_text(text: str) -> str:
+    """Percent-encoded UTF-8, cut to MAX_HEADER_TEXT_BYTES (with "…") at a character boundary."""
+    encoded = quote(text)
+    if len(encoded) <= MAX_HEADER_TEXT_BYTES:
+        return encoded
+    kept, size = [], len(quote("…"))
+    for char in text:
+        size += len(quote(char))
+        if size > MAX_HEADER_TEXT_BYTES:
+            break
+        kept.append(char)
+    return quote("".join(kept) + "…")
+
+@router.post("/turn")
+async def voice_turn(file: UploadFile = File(...), user_id: int = Form(...)):
+    """
+    Whole voice turn in one request: transcribe the recording, run the intent/agent
+    pipeline and stream the spoken answer back (audio/mpeg).
+    Audio starts as soon as the first sentence of the answer exists and is synthesized,
+    the rest is synthesized while the agent still produces it. Per-stage timings are in
+    the Server-Timing header, the transcript (percent-encoded UTF-8, possibly shortened)
+    in X-Transcript and the intent in X-Intent. The full texts are at GET /voice/turn/{X-Turn-Id}
+    once the turn has finished.
+    """
+    if not get_llm().available:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
+    if not tts.tts_client:
+        raise HTTPException(status_code=500, detail="Google TTS Client not initialized. Check credentials.")
+
+    turn_start = time.perf_counter()
+    # The transcription counts against this user's Gemini budget too
+    current_user.set(user_id)
+
+    start = time.perf_counter()
+    try:
+        file_ext = file.filename.split('.')[-1].lower()
+        transcript = (await audio.transcribe_upload(await file.read(), file_ext, file.content_type)).strip()
+    except Exception as e:
+        print(f"Gemini Transcribe Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    stt_ms = _ms(start)
+
+    turn_id = uuid.uuid4().hex
+
+    async def remember(result_json: dict) -> None:
+        texts = {"transcript": transcript, "intent": result_json.get("intent"), "response": result_json.get("response") or ""}
+        await asyncio.to_thread(turn_texts.set, turn_id, texts)
+
+    start = time.perf_counter()
+    if transcript:
+        stream = start_streamed_turn(transcript, user_id, on_result=remember)
+    else:
+        # Nothing said (or only noise): don't spend an LLM call, just ask again
+        stream = TurnStream()
+        await remember({"intent": None, "response": NOT_UNDERSTOOD})
+        stream.finish(NOT_UNDERSTOOD)
+        stream.close()
+    messages = stream.messages()
+
+    # Up to the first sentence, so the intent is known for the headers and a failed turn is a proper error response
+    intent = None
+    first_sentence = None
+    async for name, data in messages:
+        if name == "intent":
+            intent = data.get("intent")
+        elif name == "sentence":
+            first_sentence = data["text"]
+            break
+        elif name == "error":
+            raise HTTPException(status_code=data["status_code"], detail=data["detail"])
+    intent_ms = _ms(start)
+
+    async def sentences():
+        if first_sentence is not None:
+            yield first_sentence
+        async for name, data in messages:
+            if name == "sentence":
+                yield data["text"]
+            elif name == "error":
+                # The answer broke off mid-way, the spoken part is all there is
+                print(f"Voice turn failed for user {user_id}: {data['detail']}")
+
+    # Wait for the first chunk so a synthesis error can still become a proper error response
+    start = time.perf_counter()
+    chunks = tts.stream_speech_parts(sentences())
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except Exception as e:
+        print(f"Google TTS Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    tts_first_ms = _ms(start)
+
+    async def audio_stream():
+        yield first_chunk
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            # Headers are already sent, all we can do is end the stream
+            print(f"Google TTS Error: {e}")
+        finally:
+            await chunks.aclose()
+
+    headers = {
+        "Server-Timing": f"stt;dur={stt_ms:.0f}, intent;desc=\"first sentence\";dur={intent_ms:.0f}, tts;desc=\"first chunk\";dur={tts_first_ms:.0f}, first_audio;desc=\"time to first audio\";dur={_ms(turn_start):.0f}",
+        "X-Transcript": _header_text(transcript),
+        "X-Intent": intent or "",
+        "X-Turn-Id": turn_id,
+    }
+    return StreamingResponse(audio_stream(), media_type="audio/mpeg", headers=headers)
+
+@router.get("/turn/{turn_id}")
+async def voice_turn_texts(turn_id: str):
+    """Transcript, intent and full answer text of a finished /voice/turn."""
+    texts = await asyncio.to_thread(turn_texts.get, turn_id)
+    if texts is None:
+        raise HTTPException(status_code=404, detail="Unknown or unfinished turn")
+    return texts
@@ -0,0 +1,179 @@
+import asyncio
+import io
+import os
+import tempfile
+import wave
+from functools import lru_cache
+from imageio_ffmpeg import get_ffmpeg_exe
+from .llm import get_llm
+from .metrics import span, traced
+from ..config import TRANSCODE_CONCURRENCY, INLINE_AUDIO_MAX_BYTES, STT_PARTIAL_MIN_AUDIO, STT_PARTIAL_WINDOW, STT_MAX_PARTIALS
+
+TRANSCRIBE_PROMPT = "Transcribe this audio file exactly as spoken."
+
+# Recorder formats Gemini does not take directly, converted to MP3 first
+CONVERT_FORMATS = {'webm', 'm4a'}
+# Containers whose index may sit at the end of the file, ffmpeg needs to seek for those
+SEEKING_FORMATS = {'m4a', 'mp4', 'mov'}
+# Containers ffmpeg can decode from a pipe while they are still being recorded
+STREAMING_FORMATS = {'webm', 'ogg', 'mp3', 'wav', 'aac', 'flac'}
+MIME_TYPES = {
+    'mp3': 'audio/mp3', 'wav': 'audio/wav', 'aac': 'audio/aac', 'ogg': 'audio/ogg',
+    'flac': 'audio/flac', 'aiff': 'audio/aiff',
+}
+# Speech only needs 16 kHz mono, which also keeps the upload small
+MP3_OUTPUT_ARGS = ['-vn', '-ar', '16000', '-ac', '1', '-b:a', '64k', '-f', 'mp3', 'pipe:1']
+
+_transcode_slots = asyncio.Semaphore(TRANSCODE_CONCURRENCY)
+
+@lru_cache(maxsize=1)
+def ffmpeg_exe() -> str:
+    return get_ffmpeg_exe()
+
+@traced("ffmpeg", "transcode")
+async def _run_ffmpeg(args, stdin_data: bytes = None) -> bytes:
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', *args,
+        stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate(stdin_data)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({process.returncode}): {stderr.decode(errors='replace').strip()}")
+    return stdout
+
+async def convert_to_mp3(data: bytes, file_ext: str) -> bytes:
+    """
+    Convert recorded audio to MP3 with ffmpeg over stdin/stdout pipes, without blocking the loop.
+    At most TRANSCODE_CONCURRENCY conversions run at once per worker.
+    """
+    async with _transcode_slots:
+        try:
+            return await _run_ffmpeg(['-i', 'pipe:0', *MP3_OUTPUT_ARGS], data)
+        except RuntimeError:
+            if file_ext not in SEEKING_FORMATS:
+                raise
+        # MP4/M4A with the moov atom at the end cannot be read from a pipe, give ffmpeg a seekable file
+        with tempfile.NamedTemporaryFile(suffix=f".{file_ext}") as tmp:
+            tmp.write(data)
+            tmp.flush()
+            return await _run_ffmpeg(['-i', tmp.name, *MP3_OUTPUT_ARGS])
+
+@traced("stt")
+async def transcribe(data: bytes, mime_type: str) -> str:
+    """
+    Transcribe audio with Gemini.
+    Short recordings are sent inline with the request, longer ones go through the File API,
+    polled asynchronously with backoff until the file is ready.
+    """
+    llm = get_llm()
+    if len(data) <= INLINE_AUDIO_MAX_BYTES:
+        return await llm.agenerate([TRANSCRIBE_PROMPT, {"mime_type": mime_type, "data": data}])
+
+    # Upload the file to Gemini
+    myfile = await asyncio.to_thread(llm.upload_file, io.BytesIO(data), mime_type)
+
+    # Wait for the file to be active
+    delay = 0.25
+    while myfile.state.name == "PROCESSING":
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 2.0)
+        myfile = await asyncio.to_thread(llm.get_file, myfile.name)
+
+    if myfile.state.name != "ACTIVE":
+        raise Exception(f"File upload failed with state: {myfile.state.name}")
+
+    return await llm.agenerate([TRANSCRIBE_PROMPT, myfile])
+
+async def transcribe_upload(data: bytes, file_ext: str, content_type: str = None) -> str:
+    """Convert the recording if Gemini cannot read its format, then transcribe it."""
+    if file_ext in CONVERT_FORMATS:
+        print(f"Converting {file_ext} to mp3...")
+        data = await convert_to_mp3(data, file_ext)
+        mime_type = MIME_TYPES['mp3']
+    else:
+        mime_type = MIME_TYPES.get(file_ext) or content_type or 'audio/mp3'
+    return await transcribe(data, mime_type)
+
+# Raw PCM the streaming decoder produces: 16 kHz, mono, 16 bit
+PCM_RATE = 16000
+PCM_BYTES_PER_SECOND = PCM_RATE * 2
+
+def pcm_to_wav(pcm: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(PCM_RATE)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+class StreamingTranscriber:
+    """
+    Incremental speech-to-text for one utterance.
+    Audio frames are piped into a long-running ffmpeg process while the user is still
+    talking, so decoding is finished the moment the recording stops. partial() transcribes
+    the last STT_PARTIAL_WINDOW seconds decoded so far (at most STT_MAX_PARTIALS times, each
+    one is a Gemini call), finish() the complete utterance.
+    The input has to be a streamable container (WebM/Ogg from MediaRecorder, MP3, WAV);
+    M4A/MP4 needs seeking and cannot be decoded incrementally.
+    """
+    def __init__(self, input_format: str = 'webm'):
+        self.input_format = input_format
+        self.pcm = bytearray()
+        self.transcribed_bytes = 0
+        self.partials = 0
+        self._process = None
+        self._reader = None
+
+    async def start(self) -> None:
+        self._process = await asyncio.create_subprocess_exec(
+            ffmpeg_exe(), '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0', '-vn', '-ar', str(PCM_RATE), '-ac', '1', '-f', 's16le', 'pipe:1',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self._reader = asyncio.create_task(self._read_pcm())
+
+    async def _read_pcm(self) -> None:
+        while True:
+            chunk = await self._process.stdout.read(65536)
+            if not chunk:
+                break
+            self.pcm.extend(chunk)
+
+    async def feed(self, data: bytes) -> None:
+        self._process.stdin.write(data)
+        await self._process.stdin.drain()
+
+    def has_new_audio(self, min_seconds: float = STT_PARTIAL_MIN_AUDIO) -> bool:
+        if self.partials >= STT_MAX_PARTIALS:
+            return False
+        return len(self.pcm) - self.transcribed_bytes >= min_seconds * PCM_BYTES_PER_SECOND
+
+    async def partial(self, window: float = STT_PARTIAL_WINDOW) -> str:
+        """Transcript of the last `window` seconds decoded so far."""
+        self.transcribed_bytes = len(self.pcm)
+        self.partials += 1
+        window_bytes = int(window * PCM_BYTES_PER_SECOND) // 2 * 2 # whole 16-bit samples
+        pcm = bytes(self.pcm[max(0, self.transcribed_bytes - window_bytes):self.transcribed_bytes])
+        return (await transcribe(pcm_to_wav(pcm), 'audio/wav')).strip()
+
+    async def finish(self) -> str:
+        """Flush the decoder and transcribe the whole utterance."""
+        with span("ffmpeg", "stream_flush"):
+            self._process.stdin.close()
+            await self._reader
+            await self._process.wait()
+        if not self.pcm:
+            return ""
+        return (await transcribe(pcm_to_wav(bytes(self.pcm)), 'audio/wav')).strip()
+
+    async def close(self) -> None:
+        if self._process and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        if self._reader:
+            self._reader.cancel()
@@ -0,0 +1,483 @@
+import asyncio
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from sqlalchemy import create_engine, event, select, delete, update, func
+from .metrics import CACHE_LOOKUPS
+from .ratelimit import SingleFlight
+from ..models import CacheEntry
+from ..config import CACHE_BACKEND, CACHE_SQLITE_PATH, CACHE_MAX_BYTES, CACHE_LOCK_TIMEOUT
+
+# A stored value and when it expires (epoch seconds, shared backends compare it across processes), None = never
+Entry = Tuple[Any, Optional[float]]
+
+# Shared backends: accessed_at is only rewritten this often, so reads stay reads
+TOUCH_INTERVAL = 60
+# Writes between two eviction passes of a shared backend
+EVICT_EVERY = 100
+
+class CacheBackend(ABC):
+    """
+    Where cached values live. Keys are strings, values bytes; the memory backend also keeps
+    arbitrary objects. shared backends are visible to every worker using the same store.
+    """
+    shared = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Entry]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        pass
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: Optional[float]) -> bool:
+        """Store the value only if the key is absent (or expired), atomic for everyone sharing the backend."""
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    def evict(self) -> int:
+        """Drop expired entries and enforce the size bound, returns how many were removed."""
+        return 0
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        pass
+
+def _expires_at(ttl: Optional[float]) -> Optional[float]:
+    return time.time() + ttl if ttl else None
+
+def _size(value: Any) -> int:
+    return len(value) if isinstance(value, (bytes, str)) else 0
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU, bounded by entries and by the total size of bytes/str values."""
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        self.store(key, value, _expires_at(ttl))
+
+    def store(self, key: str, value: Any, expires_at: Optional[float]) -> None:
+        """set() with an absolute expiry, used to keep copies of shared entries."""
+        if self.max_bytes is not None and _size(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._bytes += _size(value)
+            while self._entries and ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                                     or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def add(self, key: str, value: Any, ttl: Optional[float]) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.time()):
+                return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+    def _remove(self, key: str) -> None:
+        """Caller holds the lock."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= _size(entry[0])
+
+class SQLBackend(CacheBackend):
+    """
+    CacheEntry table in a SQL database: a SQLite file shared by the workers of one host,
+    or the application database (Postgres) shared by all hosts. Bounded by the total
+    size of the values, least recently read entries and expired ones are deleted first.
+    """
+    shared = True
+
+    def __init__(self, engine, max_bytes: int = CACHE_MAX_BYTES):
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._table = CacheEntry.__table__
+        self._writes = 0
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def sqlite(cls, path: str = CACHE_SQLITE_PATH, max_bytes: int = CACHE_MAX_BYTES) -> "SQLBackend":
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 10})
+
+        @event.listens_for(engine, "connect")
+        def concurrent_access(connection, _):
+            # Readers don't block the writer of another worker
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+        return cls(engine, max_bytes)
+
+    def _connect(self):
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    self._table.create(self.engine, checkfirst=True)
+                    self._ready = True
+        return self.engine.begin()
+
+    def _insert(self, key: str, value: bytes, ttl: Optional[float]):
+        if self.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        now = time.time()
+        values = {"value": value, "expires_at": _expires_at(ttl), "accessed_at": now, "size": len(value)}
+        return insert(self._table).values(key=key, **values), values, now
+
+    def get(self, key: str) -> Optional[Entry]:
+        table = self._table
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                select(table.c.value, table.c.expires_at, table.c.accessed_at).where(table.c.key == key)
+            ).first()
+            if row is None or (row.expires_at is not None and row.expires_at <= now):
+                return None
+            if row.accessed_at < now - TOUCH_INTERVAL:
+                connection.execute(update(table).where(table.c.key == key).values(accessed_at=now))
+        return row.value, row.expires_at
+
+    def set(self, key: str, value: bytes, ttl: Optional[float]) -> None:
+        statement, values, _ = self._insert(key, value, ttl)
+        with self._connect() as connection:
+            connection.execute(statement.on_conflict_do_update(index_elements=["key"], set_=values))
+        self._written()
+
+    def add(self, key: str, value: bytes, ttl: Optional[float]) -> bool:
+        statement, values, now = self._insert(key, value, ttl)
+        expires_at = self._table.c.expires_at
+        with self._connect() as connection:
+            result = connection.execute(statement.on_conflict_do_update(
+                index_elements=["key"], set_=values, where=expires_at.is_not(None) & (expires_at <= now),
+            ))
+        self._written()
+        return result.rowcount == 1
+
+    def delete(self, key: str) -> None:
+        with self._connect() as connection:
+            connection.execute(delete(self._table).where(self._table.c.key == key))
+
+    def evict(self) -> int:
+        """Delete expired entries, then the least recently read ones until the size bound holds."""
+        table = self._table
+        with self._connect() as connection:
+            removed = connection.execute(delete(table).where(table.c.expires_at <= time.time())).rowcount
+            excess = (connection.execute(select(func.coalesce(func.sum(table.c.size), 0))).scalar() or 0) - self.max_bytes
+            if excess > 0:
+                victims = []
+                for key, size in connection.execute(select(table.c.key, table.c.size).order_by(table.c.accessed_at)):
+                    victims.append(key)
+                    excess -= size
+                    if excess <= 0:
+                        break
+                for start in range(0, len(victims), 500):
+                    removed += connection.execute(delete(table).where(table.c.key.in_(victims[start:start + 500]))).rowcount
+        self.evictions += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        table = self._table
+        with self._connect() as connection:
+            entries, size = connection.execute(select(func.count(), func.coalesce(func.sum(table.c.size), 0))).one()
+        return {"backend": self.engine.dialect.name, "entries": entries, "bytes": size, "evictions": self.evictions}
+
+    def _written(self) -> None:
+        with self._lock:
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            try:
+                self.evict()
+            except Exception as e:
+                print(f"Cache eviction failed: {e}")
+
+CODECS: Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    "bytes": (bytes, bytes),
+    "json": (lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8"), lambda data: json.loads(data.decode("utf-8"))),
+}
+
+class _Flight:
+    """A value being computed by one thread, the others of this worker wait for it."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+class Cache:
+    """
+    One namespace ("tts", "llm", ...) of a backend, with a TTL and an optional in-process
+    LRU in front of shared backends. get_or_set() and aget_or_set() protect against
+    stampedes: a missing value is computed by one caller per worker (the others wait for
+    it) and, on shared backends, by one worker at a time. The others poll for its result
+    until CACHE_LOCK_TIMEOUT and only then compute it themselves. A failing backend never
+    fails the caller, it just behaves like a miss.
+    """
+    def __init__(self, namespace: str, backend: CacheBackend, ttl: Optional[float] = None, codec: Optional[str] = "json",
+                 memory_bytes: int = 0, lock_timeout: float = CACHE_LOCK_TIMEOUT):
+        if codec is None and backend.shared:
+            raise ValueError(f"Cache {namespace}: a shared backend needs a codec")
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        self.settings = (ttl, codec, memory_bytes) # what get_cache() checks later users against
+        self.lock_timeout = lock_timeout
+        self._encode, self._decode = CODECS[codec] if codec else (None, None)
+        self._front = MemoryBackend(max_bytes=memory_bytes) if backend.shared and memory_bytes else None
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights = SingleFlight(f"cache_{namespace}")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0 # misses answered by a computation of another worker
+        self.errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._front.get(self._key(key)) if self._front else None
+        if entry is None:
+            try:
+                entry = self.backend.get(self._key(key))
+            except Exception as e:
+                self._failed("lookup", e)
+            if entry is not None:
+                entry = (self._decode(entry[0]) if self._decode else entry[0], entry[1])
+                if self._front:
+                    self._front.store(self._key(key), entry[0], entry[1])
+        self._count(entry is not None)
+        return entry[0] if entry is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = ttl or self.ttl
+        if self._front:
+            self._front.set(self._key(key), value, ttl)
+        try:
+            self.backend.set(self._key(key), self._encode(value) if self._encode else value, ttl)
+        except Exception as e:
+            self._failed("update", e)
+
+    def delete(self, key: str) -> None:
+        if self._front:
+            self._front.delete(self._key(key))
+        try:
+            self.backend.delete(self._key(key))
+        except Exception as e:
+            self._failed("update", e)
+
+    def get_or_set(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None,
+                   cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Blocking form, for code running on worker threads. None results, and those cacheable() rejects, are not cached."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait(self.lock_timeout)
+            if flight.value is not None:
+                return flight.value
+            return compute()
+        try:
+            flight.value = self._compute_once(key, compute, ttl, cacheable)
+            return flight.value
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def aget_or_set(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: Optional[float] = None,
+                          cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Async form: shared backends are queried on a thread, concurrent callers of this worker share one computation."""
+        value = await self._call(self.get, key)
+        if value is not None:
+            return value
+        return await self._async_flights.do(key, lambda: self._acompute_once(key, compute, ttl, cacheable))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        stats = {
+            "hits": self.hits, "misses": self.misses, "waits": self.waits, "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+        if self._front:
+            stats["memory"] = self._front.stats()
+        return stats
+
+    def _lock_key(self, key: str) -> str:
+        return self._key(key) + ":lock"
+
+    def _claim(self, key: str) -> bool:
+        """Become the worker computing key. Unshared backends have no other workers to coordinate with."""
+        if not self.backend.shared:
+            return True
+        try:
+            return self.backend.add(self._lock_key(key), b"1", self.lock_timeout)
+        except Exception as e:
+            self._failed("lock", e)
+            return True
+
+    def _holder_gone(self, key: str) -> bool:
+        try:
+            return self.backend.get(self._lock_key(key)) is None
+        except Exception:
+            return True
+
+    def _release(self, key: str) -> None:
+        try:
+            self.backend.delete(self._lock_key(key))
+        except Exception as e:
+            self._failed("lock", e)
+
+    def _compute_once(self, key: str, compute: Callable[[], Any], ttl: Optional[float],
+                      cacheable: Optional[Callable[[Any], bool]]) -> Any:
+        claimed = self._claim(key)
+        if not claimed:
+            deadline = time.monotonic() + self.lock_timeout
+            delay = 0.05
+            while time.monotonic() < deadline:
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+                value = self.get(key)
+                if value is not None:
+                    self.waits += 1
+                    return value
+                if self._holder_gone(key):
+                    break # it failed, nothing will come
+        try:
+            value = compute()
+            if value is not None and (cacheable is None or cacheable(value)):
+                self.set(key, value, ttl)
+            return value
+        finally:
+            if claimed and self.backend.shared:
+                self._release(key)
+
+    async def _acompute_once(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: Optional[float],
+                             cacheable: Optional[Callable[[Any], bool]]) -> Any:
+        claimed = await self._call(self._claim, key)
+        if not claimed:
+            deadline = time.monotonic() + self.lock_timeout
+            delay = 0.05
+            while time.monotonic() < deadline:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+                value = await self._call(self.get, key)
+                if value is not None:
+                    self.waits += 1
+                    return value
+                if await self._call(self._holder_gone, key):
+                    break
+        try:
+            value = await compute()
+            if value is not None and (cacheable is None or cacheable(value)):
+                await self._call(self.set, key, value, ttl)
+            return value
+        finally:
+            if claimed and self.backend.shared:
+                await self._call(self._release, key)
+
+    async def _call(self, function: Callable, *args) -> Any:
+        # A memory lookup is cheaper than a thread hop
+        if not self.backend.shared:
+            return function(*args)
+        return await asyncio.to_thread(function, *args)
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        CACHE_LOOKUPS.labels(self.namespace, "hit" if hit else "miss").inc()
+
+    def _failed(self, operation: str, error: Exception) -> None:
+        self.errors += 1
+        print(f"Cache {operation} failed ({self.namespace}): {error}")
+
+_shared_backend: Optional[CacheBackend] = None
+_caches: Dict[str, Cache] = {}
+_registry_lock = threading.Lock()
+
+def shared_backend() -> CacheBackend:
+    """The worker's backend selected by CACHE_BACKEND, built on first use."""
+    global _shared_backend
+    if _shared_backend is None:
+        with _registry_lock:
+            if _shared_backend is None:
+                if CACHE_BACKEND == "memory":
+                    _shared_backend = MemoryBackend(max_bytes=CACHE_MAX_BYTES)
+                elif CACHE_BACKEND == "sqlite":
+                    _shared_backend = SQLBackend.sqlite()
+                elif CACHE_BACKEND == "database":
+                    from ..database import engine
+                    _shared_backend = SQLBackend(engine)
+                else:
+                    raise ValueError(f"Unknown CACHE_BACKEND {CACHE_BACKEND!r}, choose memory, sqlite or database")
+    return _shared_backend
+
+def get_cache(namespace: str, ttl: Optional[float] = None, codec: str = "json", memory_bytes: int = 0) -> Cache:
+    """
+    The namespace's cache on the shared backend, created by its first user. Every user of a
+    namespace must ask for the same settings, a different ttl or codec raises ValueError
+    (pass a per-call ttl to get_or_set() instead).
+    """
+    with _registry_lock:
+        cache = _caches.get(namespace)
+    if cache is None:
+        cache = Cache(namespace, shared_backend(), ttl=ttl, codec=codec, memory_bytes=memory_bytes)
+        with _registry_lock:
+            cache = _caches.setdefault(namespace, cache)
+    if cache.settings != (ttl, codec, memory_bytes):
+        raise ValueError(f"Cache {namespace} exists with ttl, codec, memory_bytes {cache.settings}, not {(ttl, codec, memory_bytes)}")
+    return cache
+
+def cache_stats() -> Dict[str, Any]:
+    with _registry_lock:
+        caches = dict(_caches)
+    stats: Dict[str, Any] = {"backend": CACHE_BACKEND, "namespaces": {name: cache.stats() for name, cache in caches.items()}}
+    if _shared_backend is not None:
+        try:
+            stats["store"] = _shared_backend.stats()
+        except Exception as e:
+            stats["store"] = {"error": str(e)}
+    return stats
@@ -0,0 +1,246 @@
+import math
+import re
+import threading
+import time
+from difflib import SequenceMatcher
+from email.utils import getaddresses
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlmodel import Session, select, col
+from sqlalchemy.exc import IntegrityError
+from ..models import Contact, MailboxMessage, User
+from ..config import CONTACT_MATCH_THRESHOLD, CONTACT_CACHE_TTL
+
+# (From, To, Cc, label ids, internalDate) of one mail, all the index looks at
+MailHeaders = Tuple[str, str, str, List[str], int]
+
+EXCLUDED_LABELS = {'SPAM', 'TRASH'}
+# Addresses nobody dictates a mail to
+UNREPLYABLE_RE = re.compile(r"^(no-?reply|do-?not-?reply|mailer-daemon|postmaster|bounces?|notifications?|newsletter)[+.@-]", re.I)
+# Words around a spoken name that are not part of it ("an Herrn Dr. Müller")
+NAME_NOISE = {"an", "herr", "herrn", "frau", "dr", "prof", "doktor", "professor", "mr", "mrs", "ms"}
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss", "é": "e", "è": "e", "á": "a", "à": "a", "ç": "c"})
+
+def koelner_phonetik(word: str) -> str:
+    """Kölner Phonetik code of a word: German names that sound alike (Meier/Mayer/Maier) get the same code."""
+    letters = re.sub(r"[^A-Z]", "", word.lower().translate(UMLAUTS).upper())
+    digits = []
+    for i, ch in enumerate(letters):
+        prev = letters[i - 1] if i > 0 else ""
+        nxt = letters[i + 1] if i + 1 < len(letters) else ""
+        if ch in "AEIJOUY":
+            code = "0"
+        elif ch == "H":
+            code = ""
+        elif ch == "B":
+            code = "1"
+        elif ch == "P":
+            code = "3" if nxt == "H" else "1"
+        elif ch in "DT":
+            code = "8" if nxt and nxt in "CSZ" else "2"
+        elif ch in "FVW":
+            code = "3"
+        elif ch in "GKQ":
+            code = "4"
+        elif ch == "C":
+            if i == 0:
+                code = "4" if nxt and nxt in "AHKLOQRUX" else "8"
+            else:
+                code = "8" if prev in "SZ" else ("4" if nxt and nxt in "AHKOQUX" else "8")
+        elif ch == "X":
+            code = "8" if prev and prev in "CKQ" else "48"
+        elif ch == "L":
+            code = "5"
+        elif ch in "MN":
+            code = "6"
+        elif ch == "R":
+            code = "7"
+        else: # S, Z
+            code = "8"
+        digits.append(code)
+
+    collapsed = []
+    for digit in "".join(digits):
+        if not collapsed or collapsed[-1] != digit:
+            collapsed.append(digit)
+    return "".join(d for i, d in enumerate(collapsed) if d != "0" or i == 0)
+
+def name_tokens(text: str) -> List[str]:
+    """Lowercased name parts with umlauts spelled out, so "Müller" and "Mueller" compare equal."""
+    words = re.split(r"[^\w]+|_", text.lower().translate(UMLAUTS))
+    return [w for w in words if w and not w.isdigit() and w not in NAME_NOISE]
+
+def mail_headers(full_msg: Dict[str, Any]) -> MailHeaders:
+    """MailHeaders of a Gmail message resource."""
+    headers = {h['name'].lower(): h['value'] for h in full_msg.get('payload', {}).get('headers', [])}
+    return (headers.get('from', ''), headers.get('to', ''), headers.get('cc', ''),
+            full_msg.get('labelIds', []), int(full_msg.get('internalDate') or 0))
+
+class _Entry:
+    """A contact prepared for matching."""
+    __slots__ = ("contact", "tokens", "token_codes", "codes", "weight")
+
+    def __init__(self, contact: Contact):
+        self.contact = contact
+        local_part = contact.address.split("@")[0]
+        self.tokens = list(dict.fromkeys(name_tokens(contact.name) + name_tokens(local_part)))
+        self.token_codes = [koelner_phonetik(token) for token in self.tokens]
+        self.codes = set(self.token_codes) - {""}
+        # People the user writes to are the likelier recipients
+        self.weight = math.log2(1 + 3 * contact.sent_count + contact.received_count)
+
+class ContactIndex:
+    """
+    Per-user address book built from the From/To/Cc headers of mirrored mail, sent and
+    received. MailboxMirror feeds every synced message through index(), so it grows
+    incrementally; resolve() turns a transcribed name into an address with exact,
+    phonetic (Kölner Phonetik) and fuzzy matching, all in memory.
+    """
+    def __init__(self, threshold: float = CONTACT_MATCH_THRESHOLD, ttl: float = CONTACT_CACHE_TTL):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[float, List[_Entry]]] = {}
+        self._lock = threading.Lock()
+
+    def index(self, session: Session, user_id: int, mails: Iterable[MailHeaders]) -> int:
+        """
+        Add the people of these mails to the user's contacts. Not committed; call forget()
+        after the commit so this worker's matcher sees the changes. Returns the number of new contacts.
+        """
+        user = session.get(User, user_id)
+        own_address = (user.email if user else "").lower()
+        observed = []
+        for sender, to, cc, labels, internal_date in sorted(mails, key=lambda mail: mail[4]):
+            if EXCLUDED_LABELS & set(labels):
+                continue
+            sent = 'SENT' in labels
+            people = getaddresses([to, cc]) if sent else getaddresses([sender, to, cc])
+            for name, address in people:
+                address = address.strip().lower()
+                if "@" in address and address != own_address and not UNREPLYABLE_RE.match(address):
+                    observed.append((name.strip().strip('"'), address, sent, internal_date))
+        if not observed:
+            return 0
+
+        addresses = {address for _, address, _, _ in observed}
+        contacts = {
+            contact.address: contact
+            for contact in session.exec(select(Contact).where(Contact.user_id == user_id).where(col(Contact.address).in_(addresses)))
+        }
+        created = 0
+        for name, address, sent, internal_date in observed:
+            contact = contacts.get(address)
+            if contact is None:
+                contact = contacts[address] = Contact(user_id=user_id, address=address)
+                created += 1
+            elif internal_date <= contact.last_seen:
+                # Already counted, e.g. a full sync fetching the same mails again; a missing name is still welcome
+                if name and not contact.name:
+                    self._set_name(contact, name)
+                    session.add(contact)
+                continue
+            if sent:
+                contact.sent_count += 1
+            else:
+                contact.received_count += 1
+            contact.last_seen = internal_date
+            if name:
+                self._set_name(contact, name)
+            session.add(contact)
+        return created
+
+    def backfill(self, session: Session, user_id: int) -> int:
+        """Build the index from mail mirrored before the index existed."""
+        rows = session.exec(
+            select(MailboxMessage.sender, MailboxMessage.to, MailboxMessage.label_ids, MailboxMessage.internal_date)
+            .where(MailboxMessage.user_id == user_id)
+        ).all()
+        return self.index(session, user_id, [(sender, to, "", labels.split(","), date) for sender, to, labels, date in rows])
+
+    def forget(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    async def names(self, user_id: int) -> List[str]:
+        """Display names of the user's contacts, e.g. to recognise names in utterances."""
+        return list(dict.fromkeys(entry.contact.name for entry in await self._load(user_id) if entry.contact.name))
+
+    async def resolve(self, user_id: int, spoken: str) -> Optional[Contact]:
+        """Best contact for a spoken name (or address), None if nothing matches well enough."""
+        spoken = spoken.strip()
+        entries = await self._load(user_id)
+        if "@" in spoken:
+            address = spoken.lower()
+            return next((e.contact for e in entries if e.contact.address == address), Contact(user_id=user_id, address=address))
+
+        tokens = name_tokens(spoken)
+        if not tokens or not entries:
+            return None
+        codes = {koelner_phonetik(token) for token in tokens} - {""}
+        # Exact or phonetic hits are cheap to find, only fall back to fuzzy scoring of everyone without them
+        candidates = [e for e in entries if codes & e.codes or set(tokens) & set(e.tokens)] or entries
+
+        best, best_score = None, 0.0
+        for entry in candidates:
+            score = self._score(tokens, entry)
+            if score < self.threshold:
+                continue
+            ranked = score + 0.02 * min(entry.weight, 5)
+            if ranked > best_score:
+                best, best_score = entry, ranked
+        return best.contact if best else None
+
+    @staticmethod
+    def _score(tokens: List[str], entry: _Entry) -> float:
+        """Mean over the spoken name parts of their best match among the contact's name parts."""
+        total = 0.0
+        for token in tokens:
+            code = koelner_phonetik(token)
+            best = 0.0
+            for candidate, candidate_code in zip(entry.tokens, entry.token_codes):
+                if token == candidate:
+                    best = 1.0
+                    break
+                if code and code == candidate_code:
+                    best = max(best, 0.9)
+                elif len(token) >= 3 and candidate.startswith(token):
+                    best = max(best, 0.8) # "Alex" for "Alexander"
+                else:
+                    matcher = SequenceMatcher(None, token, candidate)
+                    if matcher.quick_ratio() >= 0.75:
+                        best = max(best, 0.85 * matcher.ratio())
+            total += best
+        return total / len(tokens)
+
+    @staticmethod
+    def _set_name(contact: Contact, name: str) -> None:
+        contact.name = name
+        contact.phonetic = " ".join(koelner_phonetik(token) for token in name_tokens(name))
+
+    async def _load(self, user_id: int) -> List[_Entry]:
+        with self._lock:
+            cached = self._entries.get(user_id)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+
+        async with self._session() as session:
+            contacts = (await session.exec(select(Contact).where(Contact.user_id == user_id))).all()
+            if not contacts and await session.run_sync(lambda sync_session: self.backfill(sync_session, user_id)):
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    # A mailbox sync indexed the same people meanwhile, its rows are just as good
+                    await session.rollback()
+                contacts = (await session.exec(select(Contact).where(Contact.user_id == user_id))).all()
+        entries = [_Entry(contact) for contact in contacts]
+        with self._lock:
+            self._entries[user_id] = (time.monotonic(), entries)
+        return entries
+
+    @staticmethod
+    def _session():
+        # Imported lazily so the index can be used without a configured database (benchmarks)
+        from sqlmodel.ext.asyncio.session import AsyncSession
+        from ..database import async_engine
+        return AsyncSession(async_engine, expire_on_commit=False)
+
+contact_index = ContactIndex()
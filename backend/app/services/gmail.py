@@ -1,37 +1,93 @@
 import os
+import asyncio
 import base64
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from email.mime.text import MIMEText
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from .metrics import traced
+from .mail_body import extract_body
+from .ratelimit import (
+    SingleFlight, gmail_limiter, gmail_rate_limit, call_with_quota, backoff_delay, GMAIL_QUOTA_UNITS,
+)
+from .gmail_pool import gmail_pool, build_gmail_client, credentials_from_row
+from ..config import GMAIL_BATCH_SIZE, MAILBOX_MIRROR_ENABLED, GMAIL_IO_THREADS, RATE_LIMIT_MAX_RETRIES
+
+# Only request what list_messages actually reads from each message
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Date']
+METADATA_FIELDS = 'id,threadId,historyId,internalDate,labelIds,snippet,payload/headers'
+FULL_FIELDS = 'id,threadId,historyId,internalDate,labelIds,snippet,payload(mimeType,headers,body/data,parts)'
+
+# googleapiclient/httplib2 are blocking, async callers get the calls run on these threads
+_io_pool = ThreadPoolExecutor(max_workers=GMAIL_IO_THREADS, thread_name_prefix="gmail-io")
+
+async def _run_blocking(fn, *args, **kwargs):
+    # Run in a copy of the caller's context so the call's span is attributed to its request
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_io_pool, ctx.run, partial(fn, *args, **kwargs))
+
+# Identical mailbox reads in flight at the same time (a prefetch and the turn it was started for,
+# double-submitted turns) share one Gmail call
+_list_flights = SingleFlight("gmail")
 
 class GmailService:
-    def __init__(self, user_credentials):
+    def __init__(self, user_credentials, http=None):
         """
         Initialize Gmail Service with user credentials.
         user_credentials: Dictionary or Object containing token, refresh_token, etc.
+        http: Optional httplib2-compatible transport (e.g. the offline fake used by the benchmarks).
+        The API client comes from the per-user pool, so this does no discovery or client setup
+        for users that were seen recently.
         """
-        self.creds = Credentials(
-            token=user_credentials.access_token,
-            refresh_token=user_credentials.refresh_token,
-            token_uri=user_credentials.token_uri,
-            client_id=user_credentials.client_id,
-            client_secret=user_credentials.client_secret,
-            scopes=user_credentials.scopes.split(',') if user_credentials.scopes else []
-        )
-        self.service = build('gmail', 'v1', credentials=self.creds)
+        if http is not None:
+            self.creds = credentials_from_row(user_credentials)
+            self.service = build_gmail_client(http=http)
+        else:
+            self.service, self.creds = gmail_pool.get(user_credentials)
+
+        # Reads are served from the local mirror when we know whose mailbox this is
+        self.mirror = None
+        self.user_id = getattr(user_credentials, 'user_id', None)
+        if MAILBOX_MIRROR_ENABLED and self.user_id is not None:
+            from .mailbox import MailboxMirror
+            self.mirror = MailboxMirror(self.user_id, self)
+
+    @classmethod
+    async def open(cls, user_credentials, http=None) -> "GmailService":
+        """Async constructor, a cold client build (and the mirror's DB access) stays off the event loop."""
+        return await _run_blocking(cls, user_credentials, http)
+
+    async def alist_messages(self, *args, **kwargs):
+        if self.user_id is None:
+            return await _run_blocking(self.list_messages, *args, **kwargs)
+        key = (self.user_id, args, tuple(sorted(kwargs.items())))
+        messages = await _list_flights.do(key, lambda: _run_blocking(self.list_messages, *args, **kwargs))
+        # Shared between the coalesced callers, each gets dicts of its own to modify
+        return [dict(msg) for msg in messages]
+
+    async def acreate_draft(self, *args, **kwargs):
+        return await _run_blocking(self.create_draft, *args, **kwargs)
+
+    async def asend_email(self, *args, **kwargs):
+        return await _run_blocking(self.send_email, *args, **kwargs)
+
+    async def ainsert_draft(self, *args, **kwargs):
+        return await _run_blocking(self.insert_draft, *args, **kwargs)
+
+    async def asend_draft(self, *args, **kwargs):
+        return await _run_blocking(self.send_draft, *args, **kwargs)
+
+    async def afind_draft(self, *args, **kwargs):
+        return await _run_blocking(self.find_draft, *args, **kwargs)
+
+    async def afind_sent(self, *args, **kwargs):
+        return await _run_blocking(self.find_sent, *args, **kwargs)
 
     def create_draft(self, recipient: str, subject: str, body: str):
         """Create a draft email."""
         try:
-            message = MIMEText(body)
-            message['to'] = recipient
-            message['subject'] = subject
-            raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-            
-            draft_body = {'message': {'raw': raw}}
-            draft = self.service.users().drafts().create(userId='me', body=draft_body).execute()
-            return draft
+            return self.insert_draft(recipient, subject, body)
         except HttpError as error:
             print(f'An error occurred: {error}')
             return None
@@ -39,16 +95,61 @@ class GmailService:
     def send_email(self, draft_id: str):
         """Send a draft email."""
         try:
-            # If we had the raw message we could send directly, but if we have a draft ID:
-            # The drafts.send method takes a draft object with an ID
-            result = self.service.users().drafts().send(userId='me', body={'id': draft_id}).execute()
-            return result
+            return self.send_draft(draft_id)
         except HttpError as error:
             print(f'An error occurred: {error}')
             return None
 
-    def list_messages(self, limit: int = 5, sender: str = None, recipient: str = None, include_body: bool = False):
-        """List recent messages."""
+    @traced("gmail")
+    def insert_draft(self, recipient: str, subject: str, body: str, message_id: str = None):
+        """
+        Create a draft, raising HttpError (the outbox decides whether to retry).
+        message_id sets the Message-ID header so the draft can be found again with find_draft.
+        """
+        message = MIMEText(body)
+        message['to'] = recipient
+        message['subject'] = subject
+        if message_id:
+            message['Message-ID'] = message_id
+        raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+        return self._execute(self.service.users().drafts().create(userId='me', body={'message': {'raw': raw}}))
+
+    @traced("gmail")
+    def send_draft(self, draft_id: str):
+        """Send a draft, raising HttpError. Returns the sent message (id, threadId, labelIds)."""
+        return self._execute(self.service.users().drafts().send(userId='me', body={'id': draft_id}))
+
+    @traced("gmail")
+    def find_draft(self, message_id: str):
+        """Id of the draft with this Message-ID, None if there is none."""
+        results = self._execute(self.service.users().drafts().list(
+            userId='me', q=f'rfc822msgid:{message_id.strip("<>")}', maxResults=1, fields='drafts/id'
+        ))
+        drafts = results.get('drafts', [])
+        return drafts[0]['id'] if drafts else None
+
+    @traced("gmail")
+    def find_sent(self, message_id: str):
+        """Gmail id of the sent message with this Message-ID, None if it was not sent."""
+        results = self._execute(self.service.users().messages().list(
+            userId='me', q=f'rfc822msgid:{message_id.strip("<>")} in:sent', maxResults=1, fields='messages/id'
+        ))
+        messages = results.get('messages', [])
+        return messages[0]['id'] if messages else None
+
+    @traced("gmail")
+    def list_messages(self, limit: int = 5, sender: str = None, recipient: str = None, include_body: bool = False, batch: bool = True, use_mirror: bool = True):
+        """
+        List recent messages.
+        Served from the local mailbox mirror when it can answer the query, otherwise from Gmail.
+        With batch=True all message gets go out in one Gmail batch request and only
+        the fields we actually use are requested (metadata only unless include_body).
+        """
+        if use_mirror and self.mirror:
+            mirrored = self.mirror.list_messages(limit=limit, sender=sender, recipient=recipient, include_body=include_body)
+            if mirrored is not None:
+                return mirrored
+
         try:
             query = ""
             if sender:
@@ -56,47 +157,147 @@ class GmailService:
             if recipient:
                 query += f"to:{recipient} "
             
-            results = self.service.users().messages().list(userId='me', maxResults=limit, q=query.strip()).execute()
+            results = self._execute(self.service.users().messages().list(
+                userId='me', maxResults=limit, q=query.strip(), fields='messages/id'
+            ))
             messages = results.get('messages', [])
-            
-            final_messages = []
-            for msg in messages:
-                full_msg = self.service.users().messages().get(userId='me', id=msg['id']).execute()
-                snippet = full_msg.get('snippet')
-                headers = full_msg.get('payload', {}).get('headers', [])
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                sender_val = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-                to_val = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown')
-                date_val = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-                
-                body = None
-                if include_body:
-                    body = self._get_body(full_msg.get('payload', {}))
-
-                final_messages.append({
-                    'id': msg['id'],
-                    'snippet': snippet,
-                    'subject': subject,
-                    'sender': sender_val,
-                    'to': to_val,
-                    'date': date_val,
-                    'body': body
-                })
-            return final_messages
+            message_ids = [msg['id'] for msg in messages]
+
+            if batch:
+                full_msgs = self._get_messages_batched(message_ids, include_body)
+            else:
+                full_msgs = [self._get_message(msg_id, include_body) for msg_id in message_ids]
+
+            return [self._parse_message(full_msg, include_body) for full_msg in full_msgs if full_msg]
         except HttpError as error:
             print(f'An error occurred: {error}')
             return []
 
+    @traced("gmail")
+    def get_profile(self):
+        """Return the mailbox profile (emailAddress, messagesTotal, historyId)."""
+        return self._execute(self.service.users().getProfile(userId='me'))
+
+    @traced("gmail")
+    def list_message_ids(self, limit: int = 100):
+        """Return the ids of the newest messages and whether that is the whole mailbox."""
+        results = self._execute(self.service.users().messages().list(
+            userId='me', maxResults=limit, fields='messages/id,nextPageToken'
+        ))
+        message_ids = [msg['id'] for msg in results.get('messages', [])]
+        return message_ids, 'nextPageToken' not in results
+
+    @traced("gmail")
+    def list_history(self, start_history_id: str):
+        """
+        Collect mailbox changes since start_history_id.
+        Returns (added message ids, deleted message ids, message id -> label ids after its
+        last label change (archived, trashed, read, ...), latest historyId).
+        """
+        added, deleted, labels = [], set(), {}
+        history_id = None
+        page_token = None
+        while True:
+            results = self._execute(self.service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+                pageToken=page_token,
+                fields='history(messagesAdded/message/id,messagesDeleted/message/id,'
+                       'labelsAdded/message(id,labelIds),labelsRemoved/message(id,labelIds)),historyId,nextPageToken'
+            ))
+            for record in results.get('history', []):
+                added.extend(item['message']['id'] for item in record.get('messagesAdded', []))
+                deleted.update(item['message']['id'] for item in record.get('messagesDeleted', []))
+                # Records come oldest first, so the last one holds the current labels
+                for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                    labels[item['message']['id']] = item['message'].get('labelIds', [])
+            history_id = results.get('historyId', history_id)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+        return list(dict.fromkeys(added)), deleted, labels, history_id
+
+    def _execute(self, request):
+        """Execute an API request within the user's Gmail quota, 429s are retried with backoff."""
+        units = GMAIL_QUOTA_UNITS.get(request.methodId.replace('gmail.users.', ''), 5)
+        return call_with_quota(gmail_limiter, self.user_id, units, request.execute, gmail_rate_limit)
+
+    def _get_message(self, msg_id: str, include_body: bool = False):
+        """Fetch a single message, restricted to the fields we need."""
+        return self._execute(self._message_request(msg_id, include_body))
+
+    def _get_messages_batched(self, message_ids, include_body: bool = False):
+        """
+        Fetch several messages through the Gmail batch endpoint, keeping the input order.
+        Every message counts against the quota on its own; messages answered with a
+        rate limit are fetched again in a later batch, after a backoff.
+        """
+        fetched = {}
+        limited = {}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                rate_limit = gmail_rate_limit(exception)
+                if rate_limit is not None:
+                    limited[request_id] = rate_limit
+                else:
+                    print(f'An error occurred fetching message {request_id}: {exception}')
+                return
+            fetched[request_id] = response
+
+        pending = list(message_ids)
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            limited.clear()
+            for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+                chunk = pending[start:start + GMAIL_BATCH_SIZE]
+                batch_request = self.service.new_batch_http_request(callback=on_response)
+                for msg_id in chunk:
+                    batch_request.add(self._message_request(msg_id, include_body), request_id=msg_id)
+                units = GMAIL_QUOTA_UNITS['messages.get'] * len(chunk)
+                call_with_quota(gmail_limiter, self.user_id, units, batch_request.execute, gmail_rate_limit)
+            if not limited or attempt == RATE_LIMIT_MAX_RETRIES:
+                break
+            per_user, retry_after = next(iter(limited.values()))
+            gmail_limiter.backoff(self.user_id, backoff_delay(attempt, retry_after), per_user=per_user)
+            pending = [msg_id for msg_id in pending if msg_id in limited]
+        for msg_id in limited:
+            print(f'Gmail rate limit fetching message {msg_id}, giving up')
+
+        return [fetched.get(msg_id) for msg_id in message_ids]
+
+    def _message_request(self, msg_id: str, include_body: bool = False):
+        """Build a messages().get request that only returns headers unless the body is needed."""
+        if include_body:
+            return self.service.users().messages().get(
+                userId='me', id=msg_id, format='full', fields=FULL_FIELDS
+            )
+        return self.service.users().messages().get(
+            userId='me', id=msg_id, format='metadata', metadataHeaders=METADATA_HEADERS, fields=METADATA_FIELDS
+        )
+
+    def _parse_message(self, full_msg, include_body: bool = False):
+        """Turn a Gmail message resource into the dict the agents work with."""
+        headers = full_msg.get('payload', {}).get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        sender_val = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
+        to_val = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown')
+        date_val = next((h['value'] for h in headers if h['name'] == 'Date'), '')
+
+        body = None
+        if include_body:
+            body = self._get_body(full_msg.get('payload', {}))
+
+        return {
+            'id': full_msg['id'],
+            'snippet': full_msg.get('snippet'),
+            'subject': subject,
+            'sender': sender_val,
+            'to': to_val,
+            'date': date_val,
+            'body': body
+        }
+
     def _get_body(self, payload):
-        """Extract body from message payload."""
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain':
-                    data = part['body'].get('data')
-                    if data:
-                        return base64.urlsafe_b64decode(data).decode()
-        elif 'body' in payload:
-            data = payload['body'].get('data')
-            if data:
-                return base64.urlsafe_b64decode(data).decode()
-        return ""
\ No newline at end of file
+        """Readable text of the message, from the whole MIME tree (nested multiparts, HTML-only mails)."""
+        return extract_body(payload)
\ No newline at end of file
@@ -0,0 +1,118 @@
+import json
+import threading
+from typing import Any, Dict, Optional, Tuple
+import httplib2
+import google_auth_httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+from .cache import MemoryBackend
+from ..config import GMAIL_POOL_SIZE, GMAIL_POOL_TTL, GMAIL_HTTP_TIMEOUT
+
+_discovery_document: Optional[Dict[str, Any]] = None
+_discovery_lock = threading.Lock()
+
+def gmail_discovery_document() -> Dict[str, Any]:
+    """The Gmail v1 discovery document bundled with googleapiclient, parsed once per process."""
+    global _discovery_document
+    if _discovery_document is None:
+        with _discovery_lock:
+            if _discovery_document is None:
+                _discovery_document = json.loads(get_static_doc('gmail', 'v1'))
+    return _discovery_document
+
+def credentials_from_row(user_credentials) -> Credentials:
+    """Build google-auth credentials from an OAuthCredential row (or anything shaped like it)."""
+    return Credentials(
+        token=user_credentials.access_token,
+        refresh_token=user_credentials.refresh_token,
+        token_uri=user_credentials.token_uri,
+        client_id=user_credentials.client_id,
+        client_secret=user_credentials.client_secret,
+        scopes=user_credentials.scopes.split(',') if user_credentials.scopes else []
+    )
+
+def build_gmail_client(creds: Credentials = None, http=None):
+    """
+    Build a Gmail client from the bundled discovery document, without any discovery request.
+    httplib2 connections are not thread safe, so every thread gets its own authorized
+    connection (kept alive across requests) while sharing the client and credentials.
+    With an explicit http transport (e.g. the offline fake) that transport is used as is.
+    """
+    if http is not None:
+        return build_from_document(gmail_discovery_document(), http=http)
+
+    local = threading.local()
+
+    def thread_http():
+        if not hasattr(local, 'http'):
+            local.http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=GMAIL_HTTP_TIMEOUT))
+        return local.http
+
+    def request_builder(_http, *args, **kwargs):
+        return HttpRequest(thread_http(), *args, **kwargs)
+
+    return build_from_document(gmail_discovery_document(), http=thread_http(), requestBuilder=request_builder)
+
+class _PooledClient:
+    def __init__(self, service, creds: Credentials, fingerprint: Tuple):
+        self.service = service
+        self.creds = creds
+        self.fingerprint = fingerprint
+
+class GmailClientPool:
+    """
+    Built Gmail clients keyed by user id, with LRU eviction beyond max_size and a TTL.
+    A client is rebuilt when the stored tokens change (e.g. after the user logs in again).
+    Clients hold open connections, so they stay in this worker's memory backend of the
+    cache (services/cache.py) instead of the shared one.
+    """
+    def __init__(self, max_size: int = GMAIL_POOL_SIZE, ttl: float = GMAIL_POOL_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clients = MemoryBackend(max_entries=max_size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _fingerprint(user_credentials) -> Tuple:
+        return (user_credentials.access_token, user_credentials.refresh_token, user_credentials.client_id)
+
+    def get(self, user_credentials) -> Tuple[Any, Credentials]:
+        """Return (service, credentials) for the user, building the client only if needed."""
+        user_id = getattr(user_credentials, 'user_id', None)
+        fingerprint = self._fingerprint(user_credentials)
+
+        if user_id is not None:
+            cached = self._clients.get(str(user_id))
+            entry = cached[0] if cached else None
+            with self._lock:
+                if entry and entry.fingerprint == fingerprint:
+                    self.hits += 1
+                    return entry.service, entry.creds
+                self.misses += 1
+
+        # Build outside the lock, a concurrent build for the same user just loses the race
+        creds = credentials_from_row(user_credentials)
+        service = build_gmail_client(creds)
+        if user_id is not None:
+            self._store(user_id, _PooledClient(service, creds, fingerprint))
+        return service, creds
+
+    def put(self, user_credentials, service, creds: Credentials) -> None:
+        """Register an already built client, e.g. the one used during login."""
+        self._store(user_credentials.user_id, _PooledClient(service, creds, self._fingerprint(user_credentials)))
+
+    def evict(self, user_id) -> None:
+        self._clients.delete(str(user_id))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": self._clients.stats()["entries"], "hits": self.hits, "misses": self.misses}
+
+    def _store(self, user_id, entry: _PooledClient) -> None:
+        self._clients.set(str(user_id), entry, self.ttl)
+
+gmail_pool = GmailClientPool()
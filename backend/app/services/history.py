@@ -0,0 +1,86 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+from sqlalchemy import insert
+from ..database import async_engine
+from .metrics import traced
+from ..models import Message
+from ..config import HISTORY_WRITE_BEHIND, HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL, HISTORY_MAX_QUEUE
+
+class HistoryWriter:
+    """
+    Write-behind queue for conversation history (Message rows).
+    Nothing in the request path reads these rows back, so they are collected in memory
+    and bulk-inserted every HISTORY_FLUSH_INTERVAL seconds or HISTORY_BATCH_SIZE rows.
+    Rows still queued when the worker stops are flushed by stop(); a crash loses at most
+    one interval of history.
+    """
+    def __init__(self, batch_size: int = HISTORY_BATCH_SIZE, interval: float = HISTORY_FLUSH_INTERVAL, max_queue: int = HISTORY_MAX_QUEUE):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue = max_queue
+        self.written = 0
+        self.batches = 0
+        self._queue: List[Dict[str, Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            # Not cancelled: a batch taken off the queue would be lost mid-insert. The worker
+            # writes what it has and exits, stop() then writes what was queued meanwhile.
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def accepts(self, count: int) -> bool:
+        """False if the rows should be written inline (worker not running or queue full)."""
+        return self.running and len(self._queue) + count <= self.max_queue
+
+    def enqueue(self, rows: List[Dict[str, Any]]) -> None:
+        self._queue.extend(rows)
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        while self._queue:
+            batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            try:
+                await self._insert(batch)
+            except Exception as e:
+                print(f"History write failed, {len(batch)} rows dropped: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": HISTORY_WRITE_BEHIND, "running": self.running, "queued": len(self._queue),
+                "written": self.written, "batches": self.batches}
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    @traced("db", "history_insert")
+    async def _insert(self, batch: List[Dict[str, Any]]) -> None:
+        async with async_engine.begin() as conn:
+            await conn.execute(insert(Message.__table__), batch)
+        self.written += len(batch)
+        self.batches += 1
+
+history_writer = HistoryWriter()
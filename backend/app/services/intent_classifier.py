@@ -0,0 +1,171 @@
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .intents import IntentCatalog, PLACEHOLDER_RE, get_intents
+
+# Words that do not change what the user wants, dropped from utterances and examples alike
+FILLER_WORDS = {
+    "bitte", "mal", "doch", "jetzt", "gerne", "mir", "mein", "meine", "meinen", "meiner",
+    "die", "der", "den", "das", "alle", "neuen", "neusten", "neuesten",
+}
+# Spelling variants of "mail" as they come out of speech-to-text
+MAIL_WORDS = {"e-mails", "emails", "e-mail", "email", "mails", "mail", "nachrichten", "nachricht"}
+
+NUMBER_WORDS = {
+    "ein": 1, "eine": 1, "einen": 1, "eins": 1, "zwei": 2, "drei": 3, "vier": 4, "fünf": 5,
+    "sechs": 6, "sieben": 7, "acht": 8, "neun": 9, "zehn": 10, "elf": 11, "zwölf": 12,
+}
+NUMBER_PATTERN = r"\d{1,3}|" + "|".join(sorted(NUMBER_WORDS, key=len, reverse=True))
+NAME_PATTERN = r"[\w.@+-]+(?: [\w.@+-]+){0,3}"
+# "von gestern" is a time, not a sender
+TIME_WORDS = {
+    "heute", "gestern", "vorgestern", "morgen", "übermorgen", "früh", "vormittag", "mittag", "nachmittag", "abend",
+    "nacht", "letzter", "letzten", "letzte", "dieser", "diese", "diesem", "vorhin", "eben", "woche", "wochenende",
+    "montag", "dienstag", "mittwoch", "donnerstag", "freitag", "samstag", "sonntag",
+}
+
+# Slot extractors by slot name: regex for the placeholder and a function that cleans the match
+SLOT_EXTRACTORS = {
+    "limit": (NUMBER_PATTERN, lambda value: int(value) if value.isdigit() else NUMBER_WORDS[value]),
+    "sender": (NAME_PATTERN, str.strip),
+    "recipient": (NAME_PATTERN, str.strip),
+}
+
+def normalize(text: str) -> str:
+    """Lowercase, strip punctuation and filler words, unify the different spellings of mail."""
+    words = re.sub(r"[^\w@.+\- ]", " ", text.lower()).replace(" - ", " ").split()
+    words = [w.strip(".") for w in words]
+    return " ".join("mails" if w in MAIL_WORDS else w for w in words if w and w not in FILLER_WORDS)
+
+class FastIntentClassifier:
+    """
+    Deterministic first stage in front of the LLM.
+    Patterns are generated from the "examples" of each intent in the schema, {slot}
+    placeholders become slot extractors. Only full matches count, and a name slot only
+    when it is an address or names exactly one known contact; everything else is left
+    to the LLM (classify() returns None).
+    """
+    def __init__(self, catalog: IntentCatalog):
+        self.catalog = catalog
+        self.rules: List[Tuple[str, re.Pattern]] = []
+        for intent in catalog.schema["intents"]:
+            for example in intent.get("examples", []):
+                self.rules.append((intent["name"], self._compile(example)))
+
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hits = 0
+        self.hits_by_intent: Dict[str, int] = {}
+
+    @staticmethod
+    def _compile(example: str) -> re.Pattern:
+        pattern = ""
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(example):
+            pattern += re.escape(normalize(example[position:match.start()])) + " "
+            slot = match.group(1)
+            extractor = SLOT_EXTRACTORS.get(slot, (NAME_PATTERN, str.strip))[0]
+            pattern += f"(?P<{slot}>{extractor}) "
+            position = match.end()
+        pattern += re.escape(normalize(example[position:]))
+        return re.compile(re.sub(r"\s+", " ", pattern).strip().replace(r"\ ", " "))
+
+    def classify(self, text: str, current_state: Dict[str, Any], contacts: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+        """Return an LLM-shaped result for high-confidence utterances, None to fall back to the LLM."""
+        utterance = normalize(text)
+        result = self._match_examples(utterance) or self._match_follow_up(utterance, current_state)
+        slots = None
+        if result:
+            slots = {name: self._clean_slot(name, value, contacts) for name, value in result[1].items()}
+            if any(value is None for value in slots.values()):
+                slots = None
+
+        with self._lock:
+            self.calls += 1
+            if slots is not None:
+                self.hits += 1
+                self.hits_by_intent[result[0]] = self.hits_by_intent.get(result[0], 0) + 1
+        if slots is None:
+            return None
+
+        intent_name = result[0]
+        if intent_name == current_state.get("intent"):
+            known_slots = {**current_state.get("slots", {}), **slots}
+        else:
+            known_slots = slots
+        missing = [name for name in self.catalog.required_slots(intent_name) if not known_slots.get(name)]
+        prompts = {slot["name"]: slot.get("prompt") for slot in self.catalog.slots(intent_name)}
+
+        return {
+            "intent": intent_name,
+            "slots": slots,
+            "missing_slots": missing,
+            "response": prompts.get(missing[0]) if missing else "Alles klar.",
+            "completed": not missing,
+            "source": "fast_path",
+        }
+
+    def _match_examples(self, utterance: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        for intent_name, rule in self.rules:
+            match = rule.fullmatch(utterance)
+            if match:
+                return intent_name, {k: v for k, v in match.groupdict().items() if v}
+        return None
+
+    def _match_follow_up(self, utterance: str, current_state: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, str]]]:
+        """Bare slot answers ("drei", "von Anna") while an intent is already in progress."""
+        intent_name = current_state.get("intent")
+        if not intent_name or intent_name not in self.catalog.intents:
+            return None
+        slot_names = {slot["name"] for slot in self.catalog.slots(intent_name)}
+
+        if "limit" in slot_names and re.fullmatch(f"(?:{NUMBER_PATTERN})(?: mails)?", utterance):
+            return intent_name, {"limit": utterance.split()[0]}
+        for slot_name, prefix in (("sender", "von"), ("recipient", "an")):
+            match = re.fullmatch(f"(?:nur )?{prefix} ({NAME_PATTERN})", utterance)
+            if slot_name in slot_names and match:
+                return intent_name, {slot_name: match.group(1)}
+        return None
+
+    @staticmethod
+    def _clean_slot(name: str, value: str, contacts: Iterable[str]):
+        """The slot value, None if it cannot be trusted without the LLM."""
+        clean = SLOT_EXTRACTORS.get(name, (None, str.strip))[1](value)
+        if name not in ("sender", "recipient"):
+            return clean
+        words = clean.lower().split()
+        if TIME_WORDS & set(words):
+            return None
+        if "@" in clean:
+            return clean
+        # Only a name that picks exactly one known contact, in that contact's spelling
+        matches = [contact for contact in contacts if FastIntentClassifier._names_contact(words, contact.lower().split())]
+        return matches[0] if len(set(matches)) == 1 else None
+
+    @staticmethod
+    def _names_contact(words: List[str], contact_words: List[str]) -> bool:
+        """The spoken words are the contact's name or a run of its words ("anna", "müller", "anna müller")."""
+        return any(contact_words[i:i + len(words)] == words for i in range(len(contact_words) - len(words) + 1))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hits": self.hits,
+                "llm_calls_saved": self.hits,
+                "hit_rate": round(self.hits / self.calls, 3) if self.calls else 0.0,
+                "hits_by_intent": dict(self.hits_by_intent),
+            }
+
+_classifier: Optional[FastIntentClassifier] = None
+_classifier_lock = threading.Lock()
+
+def get_classifier() -> FastIntentClassifier:
+    """Classifier for the current intent catalog, rebuilt when the schema is reloaded."""
+    global _classifier
+    catalog = get_intents()
+    if _classifier is None or _classifier.catalog is not catalog:
+        with _classifier_lock:
+            if _classifier is None or _classifier.catalog is not catalog:
+                _classifier = FastIntentClassifier(catalog)
+    return _classifier
@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+from ..config import INTENT_SCHEMA_PATH, INTENT_SCHEMA_RELOAD
+
+PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+class IntentSchemaError(Exception):
+    pass
+
+def validate_schema(schema: Any) -> None:
+    """Raise IntentSchemaError if the schema is not usable by process_intent."""
+    if not isinstance(schema, dict) or not isinstance(schema.get("intents"), list) or not schema["intents"]:
+        raise IntentSchemaError("Schema must be an object with a non-empty 'intents' list")
+
+    names = set()
+    for intent in schema["intents"]:
+        name = intent.get("name") if isinstance(intent, dict) else None
+        if not isinstance(name, str) or not name:
+            raise IntentSchemaError(f"Intent without a name: {intent!r}")
+        if name in names:
+            raise IntentSchemaError(f"Duplicate intent '{name}'")
+        names.add(name)
+
+        slots = intent.get("slots", [])
+        if not isinstance(slots, list):
+            raise IntentSchemaError(f"Intent '{name}': 'slots' must be a list")
+        slot_names = set()
+        for slot in slots:
+            slot_name = slot.get("name") if isinstance(slot, dict) else None
+            if not isinstance(slot_name, str) or not slot_name:
+                raise IntentSchemaError(f"Intent '{name}': slot without a name")
+            if slot_name in slot_names:
+                raise IntentSchemaError(f"Intent '{name}': duplicate slot '{slot_name}'")
+            slot_names.add(slot_name)
+            if not isinstance(slot.get("required", False), bool):
+                raise IntentSchemaError(f"Intent '{name}', slot '{slot_name}': 'required' must be a boolean")
+            if slot.get("required") and not slot.get("prompt"):
+                raise IntentSchemaError(f"Intent '{name}', slot '{slot_name}': required slots need a 'prompt'")
+
+        # Optional example utterances, used by the local fast-path classifier
+        examples = intent.get("examples", [])
+        if not isinstance(examples, list) or not all(isinstance(e, str) and e.strip() for e in examples):
+            raise IntentSchemaError(f"Intent '{name}': 'examples' must be a list of non-empty strings")
+        for example in examples:
+            for placeholder in PLACEHOLDER_RE.findall(example):
+                if placeholder not in slot_names:
+                    raise IntentSchemaError(f"Intent '{name}': example '{example}' uses unknown slot '{placeholder}'")
+
+class IntentCatalog:
+    """
+    A validated intent schema plus everything derived from it that does not change per request.
+    The prompt prefix is built once and is byte-identical for every request, only the state
+    and the user utterance get appended (which also lets the provider cache the prefix).
+    """
+    def __init__(self, schema: Dict[str, Any], mtime: float = 0.0):
+        validate_schema(schema)
+        self.schema = schema
+        self.mtime = mtime
+        self.intents: Dict[str, Dict[str, Any]] = {intent["name"]: intent for intent in schema["intents"]}
+        self.prompt_prefix = self._build_prompt_prefix()
+
+    def slots(self, intent_name: str) -> List[Dict[str, Any]]:
+        return self.intents.get(intent_name, {}).get("slots", [])
+
+    def required_slots(self, intent_name: str) -> List[str]:
+        return [slot["name"] for slot in self.slots(intent_name) if slot.get("required")]
+
+    def slot_prompts(self) -> List[str]:
+        """Every prompt the schema can ask the user, e.g. for pre-warming TTS."""
+        return [slot["prompt"] for intent in self.schema["intents"] for slot in intent.get("slots", []) if slot.get("prompt")]
+
+    def _build_prompt_prefix(self) -> str:
+        return f"""
+    You are an intelligent assistant for an email app called DriveMail.
+    Your goal is to classify the user's intent and extract necessary information based on the provided schema.
+    
+    Capabilities:
+    - You can READ emails ("Lies meine E-Mails", "Was gibt es Neues?").
+    - You can SUMMARIZE emails ("Fasse meine E-Mails zusammen", "Worum geht es in der Mail von X?").
+    - You can WRITE and SEND emails ("Schreibe eine E-Mail an X", "Antworte auf die letzte Mail").
+    - You can answer general questions about what you can do (Chitchat).
+    
+    Schema:
+    {json.dumps(self.schema, indent=2)}
+    
+    Instructions:
+    1. Identify the intent from the user's input. If the intent is already known in Current State, continue with it unless the user explicitly changes topic.
+    2. Extract values for the slots defined in the schema for that intent.
+    3. If a required slot is missing, your 'response' should be the 'prompt' defined in the schema for that slot.
+    4. If all required slots are filled, your 'response' should be a confirmation message in German, like "Bereit, die E-Mail an [recipient] mit dem Betreff [subject] zu senden...".
+    5. If the intent is 'chitchat', provide a helpful and natural response in German in the 'response' field. Explain your capabilities if asked.
+    6. Return a JSON object with the following structure:
+    {{
+        "intent": "string (name of the intent)",
+        "slots": {{ "slot_name": "extracted_value" }},
+        "missing_slots": ["slot_name"],
+        "response": "string (what to say back to the user)",
+        "completed": boolean (true if all required slots are filled)
+    }}
+    
+    Only return the JSON object, no markdown formatting.
+    """
+
+    def build_prompt(self, current_state: Dict[str, Any], text: str) -> str:
+        return f"""{self.prompt_prefix}
+    Current State:
+    {json.dumps(current_state, indent=2)}
+    
+    User Input: "{text}"
+    """
+
+def load_catalog(path: str = INTENT_SCHEMA_PATH) -> IntentCatalog:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            schema = json.load(f)
+    except (OSError, ValueError) as e:
+        raise IntentSchemaError(f"Could not load intent schema from {path}: {e}")
+    return IntentCatalog(schema, os.path.getmtime(path))
+
+_catalog: Optional[IntentCatalog] = None
+_catalog_lock = threading.Lock()
+
+def load_intents() -> IntentCatalog:
+    """Load and validate the schema, called at startup so a broken schema stops the boot."""
+    global _catalog
+    with _catalog_lock:
+        _catalog = load_catalog()
+    return _catalog
+
+def get_intents() -> IntentCatalog:
+    """
+    Return the loaded catalog.
+    With INTENT_SCHEMA_RELOAD the file is re-read when its mtime changes, a broken
+    edit is reported and the previous catalog stays in use.
+    """
+    global _catalog
+    if _catalog is None:
+        return load_intents()
+    if INTENT_SCHEMA_RELOAD:
+        try:
+            mtime = os.path.getmtime(INTENT_SCHEMA_PATH)
+        except OSError:
+            return _catalog
+        if mtime != _catalog.mtime:
+            with _catalog_lock:
+                if mtime != _catalog.mtime:
+                    try:
+                        _catalog = load_catalog()
+                    except IntentSchemaError as e:
+                        print(f"Intent schema reload failed, keeping previous schema: {e}")
+    return _catalog
@@ -1,6 +1,158 @@
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import google.generativeai as genai
+from .metrics import traced
+from .ratelimit import SingleFlight, llm_limiter, llm_rate_limit, call_with_quota, acall_with_quota, current_user
+from .cache import get_cache
+from ..config import GEMINI_API_KEY, LLM_MODEL, LLM_TIMEOUT, LLM_CACHE_TTL
 
+JSON_CONFIG = {"response_mime_type": "application/json"}
 
-async def call_llm(payload: dict) -> str:
-    # call your LLM API (with LLM_API_KEY) to generate a string (e-mail body) based on payload
-    # e.g. use httpx to POST to LLM endpoint. For now, stub:
-    return "Generated email body based on content_hint and history..."
+class LLMNotConfigured(Exception):
+    pass
+
+class LLMClient:
+    """
+    Process-wide Gemini client.
+    genai.configure() resets the library's cached API clients (and with them the open
+    gRPC channels), so it runs exactly once here. GenerativeModel objects are built once
+    per (model, generation config) and reused by every request on this worker.
+    Calls wait for the per-user and global request budgets (services/ratelimit.py), and
+    identical text prompts of one user in flight at the same time share one call.
+    """
+    def __init__(self, api_key: str = None, model_name: str = LLM_MODEL, timeout: float = LLM_TIMEOUT):
+        self.api_key = api_key if api_key is not None else GEMINI_API_KEY
+        self.model_name = model_name
+        self.timeout = timeout
+        self._configured = False
+        self._models: Dict[Tuple[str, bool], genai.GenerativeModel] = {}
+        self._lock = threading.Lock()
+        self._flights = SingleFlight("llm")
+
+    @property
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def _ensure_configured(self):
+        if self._configured:
+            return
+        with self._lock:
+            if self._configured:
+                return
+            if not self.api_key:
+                raise LLMNotConfigured("GEMINI_API_KEY not configured")
+            genai.configure(api_key=self.api_key)
+            self._configured = True
+
+    def model(self, json_output: bool = False, model_name: str = None) -> genai.GenerativeModel:
+        """Return the shared model instance, building it on first use."""
+        self._ensure_configured()
+        key = (model_name or self.model_name, json_output)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = genai.GenerativeModel(key[0], generation_config=JSON_CONFIG if json_output else None)
+                    self._models[key] = model
+        return model
+
+    def _request_options(self, timeout: Optional[float]) -> Dict[str, Any]:
+        return {"timeout": timeout or self.timeout}
+
+    @traced("llm")
+    def generate(self, contents, json_output: bool = False, model_name: str = None, timeout: float = None) -> str:
+        """Blocking generate_content, returns the response text."""
+        def call():
+            return self.model(json_output, model_name).generate_content(
+                contents, request_options=self._request_options(timeout)
+            ).text
+        return call_with_quota(llm_limiter, current_user.get(), 1, call, llm_rate_limit)
+
+    @traced("llm", "generate")
+    async def agenerate(self, contents, json_output: bool = False, model_name: str = None, timeout: float = None) -> str:
+        """Async generate_content on the library's gRPC asyncio client, returns the response text."""
+        user_id = current_user.get()
+
+        async def call():
+            response = await self.model(json_output, model_name).generate_content_async(
+                contents, request_options=self._request_options(timeout)
+            )
+            return response.text
+
+        async def limited_call():
+            return await acall_with_quota(llm_limiter, user_id, 1, call, llm_rate_limit)
+
+        # Audio and file parts are not worth hashing, only plain prompts are coalesced
+        if not isinstance(contents, str):
+            return await limited_call()
+        key = (user_id, model_name or self.model_name, json_output, contents)
+        return await self._flights.do(key, limited_call)
+
+    @traced("llm", "generate_stream")
+    async def agenerate_streamed(self, contents, on_text: Callable[[str], None], json_output: bool = False,
+                                 model_name: str = None, timeout: float = None) -> str:
+        """
+        generate_content with stream=True: on_text gets every piece of text as Gemini produces
+        it, the whole text is returned. A rate limit is only retried before the first piece.
+        """
+        parts: List[str] = []
+
+        async def call():
+            response = await self.model(json_output, model_name).generate_content_async(
+                contents, stream=True, request_options=self._request_options(timeout)
+            )
+            async for chunk in response:
+                # The last chunk may only carry the finish reason
+                if chunk.parts and chunk.text:
+                    parts.append(chunk.text)
+                    on_text(chunk.text)
+            return "".join(parts)
+
+        return await acall_with_quota(llm_limiter, current_user.get(), 1, call,
+                                      lambda error: None if parts else llm_rate_limit(error))
+
+    def upload_file(self, path, mime_type: str = None):
+        self._ensure_configured()
+        return genai.upload_file(path, mime_type=mime_type)
+
+    def get_file(self, name: str):
+        self._ensure_configured()
+        return genai.get_file(name)
+
+_client: Optional[LLMClient] = None
+_client_lock = threading.Lock()
+
+def get_llm() -> LLMClient:
+    """Return the worker's shared LLM client."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
+
+def set_llm(client) -> None:
+    """Replace the shared client, e.g. with an offline stand-in for benchmarks."""
+    global _client
+    _client = client
+
+async def call_llm(prompt, json_output: bool = False) -> str:
+    return await get_llm().agenerate(prompt, json_output=json_output)
+
+async def agenerate_cached(prompt: str, json_output: bool = False, ttl: float = LLM_CACHE_TTL,
+                           cacheable: Optional[Callable[[str], bool]] = None) -> str:
+    """
+    agenerate() through the shared cache: the same prompt within ttl seconds is answered
+    without calling Gemini, on every worker, and concurrent misses make a single call.
+    Only for prompts whose answer does not depend on when it is asked; answers that
+    cacheable() rejects are returned but not stored.
+    """
+    llm = get_llm()
+    if ttl <= 0:
+        return await llm.agenerate(prompt, json_output=json_output)
+    key = hashlib.sha256("\x1f".join([llm.model_name, str(json_output), prompt]).encode("utf-8")).hexdigest()
+    return await get_cache("llm", ttl=LLM_CACHE_TTL).aget_or_set(
+        key, lambda: llm.agenerate(prompt, json_output=json_output), ttl=ttl, cacheable=cacheable,
+    )
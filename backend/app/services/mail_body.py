@@ -0,0 +1,185 @@
+import base64
+import re
+from html import unescape
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional
+
+# Gemini averages about four characters of German text per token, budgets are converted with this
+CHARS_PER_TOKEN = 4
+# Newsletters can be megabytes of markup, nothing past this is ever within a prompt budget
+MAX_HTML_CHARS = 200_000
+
+# Elements whose content is never visible text
+SKIPPED_TAGS = {"script", "style", "head", "title", "noscript", "template", "svg"}
+BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "h1", "h2", "h3", "h4", "h5", "h6",
+    "blockquote", "section", "article", "header", "footer", "hr", "pre",
+}
+CELL_TAGS = {"td", "th"}
+VOID_TAGS = {"br", "img", "hr", "meta", "link", "input", "area", "base", "col", "source", "wbr"}
+HIDDEN_STYLE_RE = re.compile(r"display\s*:\s*none|visibility\s*:\s*hidden|max-height\s*:\s*0|font-size\s*:\s*0", re.I)
+
+# Start of the quoted history in replies (Gmail, Apple Mail, Outlook, in German and English)
+REPLY_HEADER_RE = re.compile(
+    r"^((?=.*\d)On\s.{1,200}\swrote:|(?=.*\d)Am\s.{1,200}\sschrieb\s.{0,200}:|"
+    r"-{2,}\s*(Original Message|Ursprüngliche Nachricht|Originalnachricht)\s*-{2,})\s*$",
+    re.I,
+)
+OUTLOOK_FROM_RE = re.compile(r"^\*?(Von|From)\s?:\*?\s", re.I)
+OUTLOOK_FIELD_RE = re.compile(r"^\*?(Gesendet|Sent|Datum|Date|An|To|Betreff|Subject)\s?:", re.I)
+SIGNATURE_RE = re.compile(r"^--\s?$|^_{10,}$")
+CLOSING_RE = re.compile(
+    r"^(mit )?(freundlichen|herzlichen|besten|lieben|liebe|beste|viele|schöne|sonnige)? ?(grüßen|grüße|gruß)[,.!]?$|"
+    r"^(mfg|lg|vg|bg|best regards|kind regards|regards|best|cheers)[,.!]?$",
+    re.I,
+)
+SENT_FROM_RE = re.compile(r"^(Von meinem .{1,40} gesendet|Gesendet von .{1,40}|Sent from my .{1,40}|Get Outlook for .{1,20})$", re.I)
+BOILERPLATE_RE = re.compile(
+    r"abbestellen|abmelden|unsubscribe|newsletter abbestellen|im browser (an)?sehen|view (it )?in (your )?browser|"
+    r"online[- ]version|diese e-mail wurde an .* gesendet|this (e-?mail|message) was sent to|"
+    r"datenschutzerklärung|privacy policy|impressum|e-mail-einstellungen|email preferences|manage preferences|"
+    r"alle rechte vorbehalten|all rights reserved|vertraulichkeitshinweis|confidentiality notice",
+    re.I,
+)
+URL_RE = re.compile(r"[<\[(]?\s*(https?://|www\.)[^\s<>\[\]()]+\s*[>\])]?", re.I)
+# Zero-width and soft-hyphen characters newsletters use to pad preview texts
+INVISIBLE_RE = re.compile("[\u00ad\u034f\u200b-\u200f\u2060\ufeff]")
+SPACES_RE = re.compile(r"[ \t\xa0]+")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+class _TextExtractor(HTMLParser):
+    """Visible text of an HTML mail, block elements become line breaks, links keep only their text."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks: List[str] = []
+        self._stack: List[bool] = [] # per open element: does it hide its content
+        self._hidden = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.chunks.append("\n")
+        elif tag in CELL_TAGS:
+            self.chunks.append(" ")
+        if tag in VOID_TAGS:
+            return
+        style = dict(attrs).get("style") or ""
+        hides = tag in SKIPPED_TAGS or bool(HIDDEN_STYLE_RE.search(style))
+        self._stack.append(hides)
+        self._hidden += hides
+
+    def handle_endtag(self, tag):
+        if tag in BLOCK_TAGS:
+            self.chunks.append("\n")
+        if tag in VOID_TAGS or not self._stack:
+            return
+        self._hidden -= self._stack.pop()
+
+    def handle_data(self, data):
+        if not self._hidden:
+            self.chunks.append(data)
+
+def html_to_text(html: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(html[:MAX_HTML_CHARS])
+    parser.close()
+    return normalize_whitespace("".join(parser.chunks))
+
+def normalize_whitespace(text: str) -> str:
+    text = INVISIBLE_RE.sub("", text.replace("\r\n", "\n").replace("\r", "\n"))
+    lines = [SPACES_RE.sub(" ", line).strip() for line in text.split("\n")]
+    return BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+def _header(part: Dict[str, Any], name: str) -> str:
+    return next((h["value"] for h in part.get("headers", []) if h["name"].lower() == name), "")
+
+def _decode(part: Dict[str, Any]) -> str:
+    data = part.get("body", {}).get("data")
+    if not data:
+        return ""
+    raw = base64.urlsafe_b64decode(data)
+    match = re.search(r'charset="?([\w.:-]+)', _header(part, "content-type"), re.I)
+    try:
+        return raw.decode(match.group(1) if match else "utf-8", errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+def _is_attachment(part: Dict[str, Any]) -> bool:
+    return bool(part.get("filename")) or _header(part, "content-disposition").lower().startswith("attachment")
+
+def _walk(part: Dict[str, Any]) -> Optional[str]:
+    """Best text of a MIME (sub)tree: plain text over HTML in alternatives, inline parts of mixed mails joined."""
+    mime_type = (part.get("mimeType") or "").lower()
+    children = part.get("parts") or []
+    if _is_attachment(part):
+        return None
+    if mime_type == "text/plain":
+        return normalize_whitespace(_decode(part))
+    if mime_type == "text/html":
+        return html_to_text(_decode(part))
+    if mime_type == "multipart/alternative":
+        texts = {}
+        for child in children:
+            text = _walk(child)
+            if text:
+                texts.setdefault((child.get("mimeType") or "").lower(), text)
+        # A plain part that is just "view this mail in HTML" is worse than the HTML part
+        plain, html = texts.get("text/plain"), texts.get("text/html")
+        if plain and html and len(plain) < 200 and len(html) > 4 * len(plain):
+            return html
+        return plain or html or next(iter(texts.values()), None)
+    if children:
+        texts = [text for text in (_walk(child) for child in children) if text]
+        return "\n\n".join(texts) or None
+    if mime_type.startswith("text/") or not mime_type:
+        return normalize_whitespace(_decode(part))
+    return None
+
+def extract_body(payload: Dict[str, Any]) -> str:
+    """Readable text of a Gmail message payload (format=full), walking the whole MIME tree."""
+    return _walk(payload) or ""
+
+def _reply_header_at(lines: List[str], index: int) -> bool:
+    line = lines[index]
+    # Gmail wraps long "On ... wrote:" lines
+    joined = f"{line} {lines[index + 1]}" if index + 1 < len(lines) else line
+    if REPLY_HEADER_RE.match(line) or REPLY_HEADER_RE.match(joined):
+        return True
+    # Outlook: a "From:" line directly followed by "Sent:"/"To:"/... fields
+    if OUTLOOK_FROM_RE.match(line):
+        return any(OUTLOOK_FIELD_RE.match(following) for following in lines[index + 1:index + 3])
+    return False
+
+def clean_body(text: str) -> str:
+    """
+    Drop what the listener never needs: quoted reply history, signatures, "sent from"
+    lines, unsubscribe/legal footers and links. Forwarded messages are kept, the
+    forwarded content usually is the point of the mail.
+    """
+    lines = normalize_whitespace(unescape(text)).split("\n")
+    kept: List[str] = []
+    for index, line in enumerate(lines):
+        if _reply_header_at(lines, index) or SIGNATURE_RE.match(line):
+            break
+        if CLOSING_RE.match(line) and any(kept):
+            break
+        if line.startswith(">") or SENT_FROM_RE.match(line) or BOILERPLATE_RE.search(line):
+            continue
+        line = URL_RE.sub("", line).strip()
+        if line or (kept and kept[-1]):
+            kept.append(line)
+    return normalize_whitespace("\n".join(kept))
+
+def fit_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, at a sentence end if one is close, else at a word boundary."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if max_tokens <= 0 or len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    sentence_end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "), cut.rfind("\n"))
+    if sentence_end >= max_chars // 2:
+        return cut[:sentence_end + 1].rstrip() + " …"
+    return cut.rsplit(" ", 1)[0].rstrip() + " …"
+
+def prepare_body(text: Optional[str], max_tokens: int) -> str:
+    """Body text as it goes into a prompt: cleaned and within the per-mail token budget."""
+    return fit_tokens(clean_body(text or ""), max_tokens)
@@ -0,0 +1,289 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Callable, Set
+from googleapiclient.errors import HttpError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy import text, update
+from sqlmodel import Session, select, delete, func, col
+from ..database import engine
+from .metrics import traced
+from .contacts import contact_index, mail_headers
+from ..models import MailboxMessage, MailboxSyncState
+from ..config import MAILBOX_MIRROR_SIZE, MAILBOX_SYNC_INTERVAL, MAILBOX_SYNC_THREADS
+
+# Messages in these labels never show up in messages().list, so don't mirror them either
+EXCLUDED_LABELS = {'SPAM', 'TRASH'}
+
+# One sync at a time per user, otherwise concurrent turns race on the same rows
+_sync_locks: Dict[int, threading.Lock] = {}
+_sync_locks_guard = threading.Lock()
+# Full syncs fetch MAILBOX_MIRROR_SIZE mails with bodies, no turn waits for them
+_full_sync_pool = ThreadPoolExecutor(max_workers=MAILBOX_SYNC_THREADS, thread_name_prefix="mailbox-sync")
+_full_syncs_pending: Set[int] = set()
+# Advisory lock key space of the mailbox syncs ("MBOX"), the second key is the user id
+SYNC_LOCK_SPACE = 0x4D424F58
+
+def _sync_lock(user_id: int) -> threading.Lock:
+    with _sync_locks_guard:
+        return _sync_locks.setdefault(user_id, threading.Lock())
+
+@contextmanager
+def _db_sync_lock(user_id: int):
+    """
+    The same across workers: a Postgres advisory lock, held on its own connection for the sync.
+    SQLite has none, there the process lock above has to do (one worker in development).
+    """
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    keys = {"space": SYNC_LOCK_SPACE, "user_id": user_id}
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:space, :user_id)"), keys)
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:space, :user_id)"), keys)
+
+# Called with the user id after a sync changed the mirrored messages, e.g. to refresh prefetched read-outs
+_change_listeners: List[Callable[[int], None]] = []
+
+def on_mailbox_change(listener: Callable[[int], None]) -> None:
+    _change_listeners.append(listener)
+
+def _notify_change(user_id: int) -> None:
+    for listener in _change_listeners:
+        try:
+            listener(user_id)
+        except Exception as e:
+            print(f"Mailbox change listener failed: {e}")
+
+class MailboxMirror:
+    """
+    Per-user local copy of the newest Gmail messages.
+    The first sync pulls the newest MAILBOX_MIRROR_SIZE messages in the background (reads
+    go to Gmail until it is done), afterwards only history().list deltas since the stored
+    historyId are applied.
+    """
+    def __init__(self, user_id: int, gmail_service):
+        self.user_id = user_id
+        self.gmail = gmail_service
+
+    def list_messages(self, limit: int = 5, sender: str = None, recipient: str = None, include_body: bool = False) -> Optional[List[Dict[str, Any]]]:
+        """
+        Answer a list_messages call from the mirror.
+        Returns None if the mirror cannot answer it reliably, the caller then asks Gmail.
+        """
+        try:
+            state = self.ensure_fresh()
+            if state is None:
+                return None
+            with Session(engine) as session:
+                query = select(MailboxMessage).where(MailboxMessage.user_id == self.user_id)
+                if sender:
+                    query = query.where(col(MailboxMessage.sender).ilike(f"%{sender}%"))
+                if recipient:
+                    query = query.where(col(MailboxMessage.to).ilike(f"%{recipient}%"))
+                rows = session.exec(query.order_by(MailboxMessage.internal_date.desc()).limit(limit)).all()
+        except (HttpError, SQLAlchemyError) as error:
+            # Gmail or the database failed mid-sync: this read goes to Gmail, the next one syncs again
+            print(f'Mailbox sync failed for user {self.user_id}: {error}')
+            return None
+
+        # Fewer hits than asked for might just mean the older matches were never mirrored
+        if len(rows) < limit and not state.complete:
+            return None
+
+        return [self._to_dict(row, include_body) for row in rows]
+
+    def ensure_fresh(self) -> Optional[MailboxSyncState]:
+        """
+        Sync if the mirror is older than MAILBOX_SYNC_INTERVAL and return the sync state.
+        A mirror that needs a full sync is filled in the background, None until then.
+        """
+        state = self._get_state()
+        if state and self._is_fresh(state):
+            return state
+        if state is None or not state.history_id:
+            self.full_sync_in_background()
+            return None
+        with _sync_lock(self.user_id), _db_sync_lock(self.user_id):
+            # Another request or worker might have synced while we were waiting for the lock
+            state = self._get_state()
+            if state and self._is_fresh(state):
+                return state
+            return self.sync(state)
+
+    @traced("mailbox")
+    def sync(self, state: Optional[MailboxSyncState] = None) -> Optional[MailboxSyncState]:
+        if state is None or not state.history_id:
+            self.full_sync_in_background()
+            return None
+        try:
+            return self.incremental_sync(state)
+        except HttpError as error:
+            # Gmail only keeps history for a limited time, an expired historyId answers 404
+            if error.resp.status == 404:
+                self.full_sync_in_background()
+                return None
+            raise
+
+    def full_sync_in_background(self) -> None:
+        """Queue a full sync of this user's mirror, unless one is already queued in this worker."""
+        with _sync_locks_guard:
+            if self.user_id in _full_syncs_pending:
+                return
+            _full_syncs_pending.add(self.user_id)
+        # The context carries the user the Gmail calls are counted against
+        _full_sync_pool.submit(contextvars.copy_context().run, self._background_full_sync)
+
+    def _background_full_sync(self) -> None:
+        try:
+            with _sync_lock(self.user_id), _db_sync_lock(self.user_id):
+                # Another worker might have synced meanwhile
+                state = self._get_state()
+                if state and state.history_id and self._is_fresh(state):
+                    return
+                self.full_sync()
+        except Exception as e:
+            print(f'Background mailbox sync failed for user {self.user_id}: {e}')
+        finally:
+            with _sync_locks_guard:
+                _full_syncs_pending.discard(self.user_id)
+
+    def full_sync(self) -> MailboxSyncState:
+        # Read the historyId first, so changes that happen during the fetch are replayed next time
+        history_id = self.gmail.get_profile().get('historyId')
+        message_ids, complete = self.gmail.list_message_ids(limit=MAILBOX_MIRROR_SIZE)
+        full_msgs = [m for m in self.gmail._get_messages_batched(message_ids, include_body=True) if m]
+
+        with Session(engine) as session:
+            session.exec(delete(MailboxMessage).where(MailboxMessage.user_id == self.user_id))
+            for full_msg in full_msgs:
+                if not EXCLUDED_LABELS & set(full_msg.get('labelIds', [])):
+                    session.add(self._to_row(full_msg))
+            state = self._save_state(session, history_id, complete)
+            session.commit()
+            session.refresh(state)
+        self._index_contacts(full_msgs)
+        _notify_change(self.user_id)
+        return state
+
+    def incremental_sync(self, state: MailboxSyncState) -> MailboxSyncState:
+        added_ids, deleted_ids, label_changes, history_id = self.gmail.list_history(state.history_id)
+        label_changes = {msg_id: labels for msg_id, labels in label_changes.items() if msg_id not in deleted_ids}
+
+        # Trashed or spam: gone from the mirror. Restored from there: fetched like a new mail.
+        excluded_ids = [msg_id for msg_id, labels in label_changes.items() if EXCLUDED_LABELS & set(labels)]
+        relabeled = {msg_id: labels for msg_id, labels in label_changes.items() if msg_id not in excluded_ids}
+        if relabeled:
+            with Session(engine) as session:
+                mirrored = set(session.exec(select(MailboxMessage.gmail_id)
+                                            .where(MailboxMessage.user_id == self.user_id)
+                                            .where(col(MailboxMessage.gmail_id).in_(list(relabeled)))).all())
+            added_ids += [msg_id for msg_id in relabeled if msg_id not in mirrored and msg_id not in added_ids]
+
+        added_ids = [msg_id for msg_id in added_ids if msg_id not in deleted_ids]
+        full_msgs = [m for m in self.gmail._get_messages_batched(added_ids, include_body=True) if m] if added_ids else []
+
+        complete = state.complete
+        with Session(engine) as session:
+            stale_ids = list(deleted_ids) + excluded_ids + [m['id'] for m in full_msgs]
+            if stale_ids:
+                session.exec(delete(MailboxMessage)
+                             .where(MailboxMessage.user_id == self.user_id)
+                             .where(col(MailboxMessage.gmail_id).in_(stale_ids)))
+            for full_msg in full_msgs:
+                if not EXCLUDED_LABELS & set(full_msg.get('labelIds', [])):
+                    session.add(self._to_row(full_msg))
+            # Archived, read, starred, ...: still mirrored, with their current labels
+            fetched = {m['id'] for m in full_msgs}
+            for msg_id, labels in relabeled.items():
+                if msg_id not in fetched:
+                    session.exec(update(MailboxMessage)
+                                 .where(MailboxMessage.user_id == self.user_id)
+                                 .where(MailboxMessage.gmail_id == msg_id)
+                                 .values(label_ids=",".join(labels)))
+            session.flush()
+            if self._trim(session):
+                complete = False
+            state = self._save_state(session, history_id or state.history_id, complete)
+            session.commit()
+            session.refresh(state)
+        self._index_contacts(full_msgs)
+        if stale_ids:
+            _notify_change(self.user_id)
+        return state
+
+    def _index_contacts(self, full_msgs) -> None:
+        """Feed the senders and recipients of newly synced mail into the contact index."""
+        if not full_msgs:
+            return
+        with Session(engine) as session:
+            try:
+                contact_index.index(session, self.user_id, [mail_headers(m) for m in full_msgs])
+                session.commit()
+                contact_index.forget(self.user_id)
+            except IntegrityError:
+                # Another worker indexed the same new address first, it is picked up on the next sync
+                session.rollback()
+
+    def _trim(self, session: Session) -> bool:
+        """Drop everything beyond the newest MAILBOX_MIRROR_SIZE messages. Returns True if rows were dropped."""
+        count = session.exec(select(func.count()).select_from(MailboxMessage).where(MailboxMessage.user_id == self.user_id)).one()
+        if count <= MAILBOX_MIRROR_SIZE:
+            return False
+        keep = (select(MailboxMessage.id)
+                .where(MailboxMessage.user_id == self.user_id)
+                .order_by(MailboxMessage.internal_date.desc())
+                .limit(MAILBOX_MIRROR_SIZE))
+        session.exec(delete(MailboxMessage)
+                     .where(MailboxMessage.user_id == self.user_id)
+                     .where(col(MailboxMessage.id).not_in(keep)))
+        return True
+
+    def _get_state(self) -> Optional[MailboxSyncState]:
+        with Session(engine) as session:
+            return session.get(MailboxSyncState, self.user_id)
+
+    def _save_state(self, session: Session, history_id: Optional[str], complete: bool) -> MailboxSyncState:
+        state = session.get(MailboxSyncState, self.user_id) or MailboxSyncState(user_id=self.user_id)
+        state.history_id = str(history_id) if history_id else None
+        state.complete = complete
+        state.synced_at = datetime.utcnow()
+        session.add(state)
+        return state
+
+    @staticmethod
+    def _is_fresh(state: MailboxSyncState) -> bool:
+        return bool(state.synced_at) and datetime.utcnow() - state.synced_at < timedelta(seconds=MAILBOX_SYNC_INTERVAL)
+
+    def _to_row(self, full_msg) -> MailboxMessage:
+        parsed = self.gmail._parse_message(full_msg, include_body=True)
+        return MailboxMessage(
+            user_id=self.user_id,
+            gmail_id=parsed['id'],
+            thread_id=full_msg.get('threadId'),
+            subject=parsed['subject'],
+            sender=parsed['sender'],
+            to=parsed['to'],
+            date=parsed['date'],
+            snippet=parsed['snippet'],
+            body=parsed['body'],
+            label_ids=",".join(full_msg.get('labelIds', [])),
+            internal_date=int(full_msg.get('internalDate') or 0),
+        )
+
+    @staticmethod
+    def _to_dict(row: MailboxMessage, include_body: bool) -> Dict[str, Any]:
+        return {
+            'id': row.gmail_id,
+            'snippet': row.snippet,
+            'subject': row.subject,
+            'sender': row.sender,
+            'to': row.to,
+            'date': row.date,
+            'body': row.body if include_body else None
+        }
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Voice turns range from a few milliseconds (cache hits) to tens of seconds (long read-outs)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+
+REQUEST_LATENCY = Histogram("drivemail_request_duration_seconds", "HTTP request latency, including streamed bodies",
+                            ["method", "route", "status"], buckets=BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge("drivemail_requests_in_flight", "HTTP requests being handled", ["route"])
+REQUEST_ERRORS = Counter("drivemail_request_errors_total", "HTTP requests answered with 5xx or failed", ["route"])
+
+STAGE_LATENCY = Histogram("drivemail_stage_duration_seconds", "Latency of one external call or processing step",
+                          ["stage", "operation"], buckets=BUCKETS)
+STAGES_IN_FLIGHT = Gauge("drivemail_stages_in_flight", "Calls currently running per stage", ["stage"])
+STAGE_ERRORS = Counter("drivemail_stage_errors_total", "Calls that raised, per stage", ["stage", "operation"])
+
+INTENT_LATENCY = Histogram("drivemail_intent_duration_seconds", "Utterance classification latency",
+                           ["intent", "source"], buckets=BUCKETS)
+AGENT_LATENCY = Histogram("drivemail_agent_duration_seconds", "Agent execution latency",
+                          ["agent", "status"], buckets=BUCKETS)
+
+RATE_LIMIT_WAIT = Histogram("drivemail_rate_limit_wait_seconds", "Time a call waited for upstream quota",
+                            ["upstream"], buckets=BUCKETS)
+RATE_LIMITED = Counter("drivemail_upstream_rate_limited_total", "429 / quota errors returned by an upstream", ["upstream"])
+COALESCED_CALLS = Counter("drivemail_coalesced_calls_total", "Calls served by an identical call already in flight", ["upstream"])
+CACHE_LOOKUPS = Counter("drivemail_cache_lookups_total", "Shared cache lookups per namespace and outcome", ["namespace", "result"])
+
+# Per-request breakdown: seconds spent per stage, filled by span() while a request runs
+_request_stages: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_stages", default=None)
+# Stages already being timed further up the call stack, so nested spans aren't counted twice
+_open_stages: contextvars.ContextVar[frozenset] = contextvars.ContextVar("open_stages", default=frozenset())
+
+@contextmanager
+def span(stage: str, operation: str):
+    """Time a block as one call of `stage` (gmail, llm, tts, stt, ffmpeg, db)."""
+    outermost = stage not in _open_stages.get()
+    token = _open_stages.set(_open_stages.get() | {stage})
+    STAGES_IN_FLIGHT.labels(stage).inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage, operation).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGES_IN_FLIGHT.labels(stage).dec()
+        STAGE_LATENCY.labels(stage, operation).observe(elapsed)
+        _open_stages.reset(token)
+        stages = _request_stages.get()
+        if stages is not None and outermost:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+def traced(stage: str, operation: str = None):
+    """Decorator form of span() for sync and async functions, the operation defaults to the function name."""
+    def decorator(fn):
+        name = operation or fn.__name__.lstrip('_')
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage, name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: request latency (until the last body chunk is sent, so streamed audio
+    counts), in-flight and error counters, and one log line per slow request with the time
+    spent per stage.
+    """
+    def __init__(self, app, slow_request: float = 1.0):
+        self.app = app
+        self.slow_request = slow_request
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        stages: Dict[str, float] = {}
+        token = _request_stages.set(stages)
+        # The route template is only known after routing, count in-flight requests by raw path prefix
+        in_flight = REQUESTS_IN_FLIGHT.labels(_path_prefix(scope["path"]))
+        in_flight.inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight.dec()
+            _request_stages.reset(token)
+            route = _route_template(scope)
+            REQUEST_LATENCY.labels(scope["method"], route, str(status["code"])).observe(elapsed)
+            if status["code"] >= 500:
+                REQUEST_ERRORS.labels(route).inc()
+            if elapsed >= self.slow_request:
+                breakdown = " ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in sorted(stages.items()))
+                print(f"Slow request: {scope['method']} {route} {status['code']} {elapsed * 1000:.0f}ms {breakdown}")
+
+def _route_template(scope) -> str:
+    # Templates ("/auth/{x}") instead of raw paths keep the label set small
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+def _path_prefix(path: str) -> str:
+    return "/" + path.strip("/").split("/")[0]
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
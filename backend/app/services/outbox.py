@@ -0,0 +1,262 @@
+import asyncio
+import random
+import httplib2
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from googleapiclient.errors import HttpError
+from google.auth.exceptions import RefreshError, TransportError
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select, col
+from .gmail import GmailService
+from .ratelimit import gmail_rate_limit
+from ..models import OutboxMessage, OAuthCredential
+from ..config import (
+    OUTBOX_POLL_INTERVAL, OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX, OUTBOX_LEASE,
+)
+
+# Worth another try: timeouts, rate limits and trouble on Gmail's side
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Timeouts and dropped connections on the way to Gmail (socket errors are OSErrors)
+RETRYABLE_ERRORS = (OSError, asyncio.TimeoutError, httplib2.HttpLib2Error, TransportError)
+
+def message_id(item: OutboxMessage) -> str:
+    """Message-ID header of the mail, derived from the idempotency key so a retry can look it up in Gmail."""
+    return f"<{item.idempotency_key}@drivemail>"
+
+def _deliverable(now: datetime):
+    """Mails with a step left (draft, or send once confirmed) that no worker holds."""
+    return and_(
+        or_(OutboxMessage.status == "pending", and_(OutboxMessage.status == "drafted", OutboxMessage.send_requested)),
+        or_(col(OutboxMessage.locked_until).is_(None), OutboxMessage.locked_until < now),
+    )
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES or gmail_rate_limit(error) is not None
+    # A revoked grant stays revoked and a bug stays a bug, only transport trouble is usually gone on the next try
+    return isinstance(error, RETRYABLE_ERRORS)
+
+class Outbox:
+    """
+    Persistent queue of dictated mails (OutboxMessage rows). The turn only enqueues: the
+    writer stores the generated mail and the confirmation marks it for sending, a background
+    worker creates the Gmail draft and sends it with exponential-backoff retries.
+
+    Gmail has no idempotency keys of its own, so every mail carries a Message-ID derived from
+    its key. A retry after an unclear failure (timeout, 5xx after the request went out)
+    first looks the mail up by that id instead of creating or sending it a second time.
+    Claims are leases (locked_until), so several workers can share the table. attempts counts
+    the claims of the current step, so drafting and sending each get max_attempts tries.
+    """
+    def __init__(self, poll_interval: float = OUTBOX_POLL_INTERVAL, batch_size: int = OUTBOX_BATCH_SIZE,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, retry_base: float = OUTBOX_RETRY_BASE,
+                 retry_max: float = OUTBOX_RETRY_MAX, lease: float = OUTBOX_LEASE):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease = lease
+        self.drafted = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        # Unfinished deliveries stay in the table, their lease expires and the next worker picks them up
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def enqueue(self, user_id: int, recipient: str, subject: str, body: str, recipient_name: str = "",
+                      draft_id: Optional[str] = None, send: bool = False, key: Optional[str] = None) -> OutboxMessage:
+        """
+        Queue a mail for drafting (and sending, with send=True). A draft_id skips the draft step.
+        Enqueueing the same key twice (a retried request) returns the first entry.
+        """
+        item = OutboxMessage(
+            user_id=user_id, idempotency_key=key or uuid.uuid4().hex, recipient=recipient, recipient_name=recipient_name,
+            subject=subject, body=body, draft_id=draft_id, status="drafted" if draft_id else "pending", send_requested=send,
+        )
+        async with self._session() as session:
+            session.add(item)
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                item = (await session.exec(select(OutboxMessage).where(OutboxMessage.idempotency_key == item.idempotency_key))).one()
+        self._wake()
+        return item
+
+    async def request_send(self, user_id: int, outbox_id: int) -> Optional[OutboxMessage]:
+        """The user confirmed: send the mail once its draft exists. Confirming twice sends it once."""
+        async with self._session() as session:
+            await session.exec(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == outbox_id)
+                .where(OutboxMessage.user_id == user_id)
+                .where(col(OutboxMessage.status).in_(["pending", "drafted"]))
+                .values(send_requested=True)
+            )
+            await session.commit()
+            item = (await session.exec(
+                select(OutboxMessage).where(OutboxMessage.id == outbox_id).where(OutboxMessage.user_id == user_id)
+            )).first()
+        self._wake()
+        return item
+
+    async def latest(self, user_id: int) -> Optional[OutboxMessage]:
+        """The user's newest mail, for "wurde meine Mail gesendet?"."""
+        async with self._session() as session:
+            return (await session.exec(
+                select(OutboxMessage).where(OutboxMessage.user_id == user_id).order_by(col(OutboxMessage.created_at).desc()).limit(1)
+            )).first()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self.running, "drafted": self.drafted, "sent": self.sent, "retried": self.retried, "failed": self.failed}
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                # A full batch means more may be due
+                while await self.deliver_due() == self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"Outbox scan failed: {e}")
+
+    async def deliver_due(self) -> int:
+        """Claim and deliver up to batch_size due mails, returns how many were claimed."""
+        now = datetime.utcnow()
+        async with self._session() as session:
+            due = (await session.exec(
+                select(OutboxMessage.id)
+                .where(_deliverable(now))
+                .where(OutboxMessage.next_attempt_at <= now)
+                .order_by(OutboxMessage.next_attempt_at)
+                .limit(self.batch_size)
+            )).all()
+        claimed: List[OutboxMessage] = []
+        for item_id in due:
+            item = await self._claim(item_id, now)
+            if item is not None:
+                claimed.append(item)
+        await asyncio.gather(*(self._deliver(item) for item in claimed))
+        return len(claimed)
+
+    async def _claim(self, item_id: int, now: datetime) -> Optional[OutboxMessage]:
+        async with self._session() as session:
+            result = await session.exec(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == item_id)
+                .where(_deliverable(now))
+                .values(locked_until=now + timedelta(seconds=self.lease), attempts=OutboxMessage.attempts + 1)
+            )
+            await session.commit()
+            if result.rowcount != 1:
+                return None # another worker was faster, or already delivered it
+            return await session.get(OutboxMessage, item_id)
+
+    async def _deliver(self, item: OutboxMessage) -> None:
+        """One attempt at the next step of a claimed mail. No connection is held during the Gmail calls."""
+        async with self._session() as session:
+            creds = (await session.exec(select(OAuthCredential).where(OAuthCredential.user_id == item.user_id).limit(1))).first()
+
+        changes: Dict[str, Any] = {}
+        try:
+            if creds is None:
+                raise RefreshError("No Gmail credentials stored for this user")
+            gmail = await GmailService.open(creds)
+            draft_id = item.draft_id
+            if draft_id is None:
+                # An earlier attempt may have created the draft before it failed
+                if item.attempts > 1:
+                    draft_id = await gmail.afind_draft(message_id(item))
+                if draft_id is None:
+                    draft_id = (await gmail.ainsert_draft(item.recipient, item.subject, item.body, message_id=message_id(item)))['id']
+                # The send step starts with an attempt budget of its own
+                changes.update(draft_id=draft_id, status="drafted", attempts=0, last_error=None)
+                self.drafted += 1
+            if item.send_requested:
+                if "draft_id" in changes:
+                    # Drafted just now, this delivery is the send's first attempt
+                    item.attempts = changes["attempts"] = 1
+                changes["gmail_message_id"] = await self._send(gmail, item, draft_id)
+                changes.update(status="sent", sent_at=datetime.utcnow(), last_error=None)
+                self.sent += 1
+        except Exception as e:
+            changes.update(self._failed_attempt(item, e))
+
+        async with self._session() as session:
+            # Only the columns this attempt changed, send_requested may have been set meanwhile
+            await session.exec(update(OutboxMessage).where(OutboxMessage.id == item.id).values(locked_until=None, **changes))
+            await session.commit()
+        if changes.get("status") == "drafted":
+            # The user may have confirmed while the draft was being created
+            self._wake()
+
+    async def _send(self, gmail: GmailService, item: OutboxMessage, draft_id: str) -> str:
+        """Send the draft, returns the Gmail id of the sent message."""
+        if item.draft_id and item.attempts > 1:
+            sent_id = await gmail.afind_sent(message_id(item))
+            if sent_id:
+                return sent_id
+        try:
+            return (await gmail.asend_draft(draft_id))['id']
+        except HttpError as e:
+            # A draft disappears once sent: the response to an earlier send may just have been lost
+            if e.resp.status == 404:
+                sent_id = await gmail.afind_sent(message_id(item))
+                if sent_id:
+                    return sent_id
+            raise
+
+    def _failed_attempt(self, item: OutboxMessage, error: Exception) -> Dict[str, Any]:
+        if item.attempts >= self.max_attempts or not is_retryable(error):
+            self.failed += 1
+            print(f"Outbox mail {item.id} failed after {item.attempts} attempts: {error}")
+            return {"status": "failed", "last_error": str(error)[:500]}
+
+        delay = min(self.retry_max, self.retry_base * 2 ** (item.attempts - 1)) * random.uniform(0.8, 1.2)
+        if isinstance(error, HttpError):
+            retry_after = error.resp.get("retry-after", "")
+            if retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+        self.retried += 1
+        print(f"Outbox mail {item.id} attempt {item.attempts} failed, retrying in {delay:.0f}s: {error}")
+        return {"next_attempt_at": datetime.utcnow() + timedelta(seconds=delay), "last_error": str(error)[:500]}
+
+    @staticmethod
+    def _session():
+        # Imported here so the agents stay usable without a database (offline benchmarks)
+        from sqlmodel.ext.asyncio.session import AsyncSession
+        from ..database import async_engine
+        return AsyncSession(async_engine, expire_on_commit=False)
+
+outbox = Outbox()
@@ -0,0 +1,176 @@
+import asyncio
+import time
+from typing import Optional, List, Dict, Any, Tuple
+from .ratelimit import current_user
+from ..config import (
+    PREFETCH_ENABLED, PREFETCH_LIMIT, PREFETCH_FRESH_AGE, PREFETCH_MAX_AGE, PREFETCH_WAIT, PREFETCH_MAX_USERS, PREFETCH_IDLE,
+)
+
+# What the prefetched read-out and summary cover: the agents' defaults without a sender filter
+READ_DEFAULT_LIMIT = 5
+SUMMARY_DEFAULT_LIMIT = 3
+
+class PrefetchedInbox:
+    def __init__(self, messages: List[Dict[str, Any]], read_texts: List[str], summary: Optional[str], fetch_limit: int):
+        self.messages = messages
+        self.message_ids = [msg['id'] for msg in messages]
+        self.read_texts = read_texts
+        self.summary = summary
+        self.exhausted = len(messages) < fetch_limit # the mailbox has no more mails than these
+        self.created_at = time.monotonic()
+
+    def age(self) -> float:
+        return time.monotonic() - self.created_at
+
+    def covers(self, limit: int) -> bool:
+        """True if the newest `limit` mails are all in here."""
+        return limit <= len(self.messages) or self.exhausted
+
+class InboxPrefetcher:
+    """
+    Fetches the newest mails of a user in the background and pre-renders what the reader
+    and summarizer agents would say about them, so the most common first commands can be
+    answered without waiting for Gmail and Gemini.
+
+    Staleness rules (see lookup()):
+    - younger than PREFETCH_FRESH_AGE: used as is
+    - younger than PREFETCH_MAX_AGE: used if the newest message ids are still the same
+    - older, or the mailbox mirror reported a change: dropped
+
+    At most max_users results and users are kept; users without a turn for PREFETCH_IDLE
+    seconds are dropped, so mailbox syncs no longer prefetch for them.
+    """
+    def __init__(self, limit: int = PREFETCH_LIMIT, fresh_age: float = PREFETCH_FRESH_AGE, max_age: float = PREFETCH_MAX_AGE,
+                 wait: float = PREFETCH_WAIT, max_users: int = PREFETCH_MAX_USERS, idle: float = PREFETCH_IDLE):
+        self.limit = limit
+        self.fresh_age = fresh_age
+        self.max_age = max_age
+        self.wait = wait
+        self.max_users = max_users
+        self.idle = idle
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[int, PrefetchedInbox] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        # Users with prefetching on and when they were last active, for re-prefetching after a sync.
+        # Kept in activity order, the least recently active user comes first.
+        self._credentials: Dict[int, Tuple[Any, float]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Remember the server's event loop, so sync code (auth, mailbox syncs) can schedule prefetches."""
+        self._loop = loop
+
+    def schedule(self, user_credentials) -> None:
+        """Start a prefetch for the user unless one is running or a fresh result exists. Thread safe."""
+        if PREFETCH_ENABLED:
+            self._call_soon(self._schedule, user_credentials)
+
+    def notify_changed(self, user_id: int) -> None:
+        """Mailbox content changed: drop the result and prefetch again if the user has prefetching on. Thread safe."""
+        self._call_soon(self._changed, user_id)
+
+    def forget(self, user_id: int) -> None:
+        """Opt-out: drop everything for the user and stop prefetching for them."""
+        self._credentials.pop(user_id, None)
+        self._entries.pop(user_id, None)
+        task = self._tasks.pop(user_id, None)
+        if task:
+            task.cancel()
+
+    async def lookup(self, user_id: int, gmail_service) -> Optional[PrefetchedInbox]:
+        """The user's prefetched inbox, if it still matches the mailbox."""
+        task = self._tasks.get(user_id)
+        if task is not None:
+            # Already fetching and rendering the same mails, doing it twice would only be slower.
+            # Unless Gmail or Gemini hang: then the turn fetches itself and the prefetch finishes for the next one.
+            await asyncio.wait({task}, timeout=self.wait)
+            if not task.done():
+                self.misses += 1
+                return None
+        entry = self._entries.get(user_id)
+        if entry is None or entry.age() > self.max_age:
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+        if entry.age() > self.fresh_age:
+            current = await gmail_service.alist_messages(limit=len(entry.message_ids), include_body=False)
+            if [msg['id'] for msg in current] != entry.message_ids:
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+        self.hits += 1
+        return entry
+
+    def stats(self) -> Dict[str, int]:
+        return {"enabled": PREFETCH_ENABLED, "users": len(self._entries), "running": len(self._tasks), "hits": self.hits, "misses": self.misses}
+
+    def _call_soon(self, callback, arg) -> None:
+        """
+        Run callback on the server's event loop, also when called from a worker thread
+        (auth route, mailbox syncs). The dicts are only ever touched on the loop.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            if self._loop is not None and self._loop.is_running():
+                self._loop.call_soon_threadsafe(callback, arg)
+            return
+        callback(arg)
+
+    def _schedule(self, user_credentials) -> None:
+        user_id = user_credentials.user_id
+        self._credentials.pop(user_id, None)
+        self._credentials[user_id] = (user_credentials, time.monotonic())
+        self._start(user_id)
+
+    def _changed(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+        if PREFETCH_ENABLED and user_id in self._credentials:
+            self._start(user_id)
+
+    def _prune(self) -> None:
+        """Drop idle users and the least recently active ones above max_users, then their and expired results."""
+        now = time.monotonic()
+        for user_id in [user_id for user_id, (_, seen) in self._credentials.items() if now - seen > self.idle]:
+            del self._credentials[user_id]
+        while len(self._credentials) > self.max_users:
+            del self._credentials[next(iter(self._credentials))]
+        for user_id in [user_id for user_id, entry in self._entries.items()
+                        if user_id not in self._credentials or entry.age() > self.max_age]:
+            del self._entries[user_id]
+
+    def _start(self, user_id: int) -> None:
+        self._prune()
+        if user_id in self._tasks or user_id not in self._credentials:
+            return
+        entry = self._entries.get(user_id)
+        if entry is not None and entry.age() <= self.fresh_age:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(user_id, self._credentials[user_id][0]))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user_id, None))
+
+    async def _run(self, user_id: int, user_credentials) -> None:
+        # Imported here, the agents themselves look up prefetched results in this module
+        from .gmail import GmailService
+        from ..agents.email_reader import EmailReaderAgent
+        from ..agents.email_summarizer import EmailSummarizerAgent
+        current_user.set(user_id)
+        try:
+            gmail_service = await GmailService.open(user_credentials)
+            messages = await gmail_service.alist_messages(limit=self.limit, include_body=True)
+            reader = EmailReaderAgent(user_credentials)
+            if not reader.llm.available:
+                return
+            summarizer = EmailSummarizerAgent(user_credentials)
+            read_texts, summary = await asyncio.gather(
+                reader.format_messages(messages),
+                summarizer.summarize(messages[:SUMMARY_DEFAULT_LIMIT]) if messages else asyncio.sleep(0),
+            )
+            if user_id in self._credentials:
+                self._entries[user_id] = PrefetchedInbox(messages, read_texts, summary, self.limit)
+        except Exception as e:
+            print(f"Prefetch failed for user {user_id}: {e}")
+
+prefetcher = InboxPrefetcher()
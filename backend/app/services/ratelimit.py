@@ -0,0 +1,196 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from googleapiclient.errors import HttpError
+from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+from .metrics import RATE_LIMIT_WAIT, RATE_LIMITED, COALESCED_CALLS
+from ..config import (
+    RATE_LIMIT_ENABLED, RATE_LIMIT_BURST_SECONDS, RATE_LIMIT_MAX_RETRIES, RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_MAX,
+    GMAIL_QUOTA_USER_RATE, GMAIL_QUOTA_GLOBAL_RATE, LLM_RPM_USER, LLM_RPM_GLOBAL,
+)
+
+# Gmail quota units per API method (https://developers.google.com/gmail/api/reference/quota)
+GMAIL_QUOTA_UNITS = {
+    "messages.list": 5, "messages.get": 5, "history.list": 2, "getProfile": 1,
+    "drafts.create": 10, "drafts.send": 100, "drafts.list": 5,
+}
+GMAIL_RATE_LIMIT_REASONS = (b"rateLimitExceeded", b"userRateLimitExceeded")
+# Per-user buckets kept per limiter, idle ones are full anyway and cheap to recreate
+MAX_USER_BUCKETS = 10000
+
+# User whose quota the LLM calls of the current request (or background job) count against,
+# set once per task; Gmail calls know their user from the credentials
+current_user: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("rate_limit_user", default=None)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. reserve() takes the tokens right away and returns how long
+    the caller has to wait for them, so sync (time.sleep) and async (asyncio.sleep) callers
+    share one implementation and queue up fairly in arrival order.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, cost: float = 1.0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # A request larger than the bucket still goes through, it just drains it
+            self._tokens -= min(cost, self.capacity)
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def block(self, seconds: float) -> None:
+        """Upstream said "retry after": nobody gets tokens before then."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+class QuotaLimiter:
+    """A global bucket plus one bucket per user, a call waits until both have room."""
+    def __init__(self, name: str, user_rate: float, global_rate: float, burst_seconds: float = RATE_LIMIT_BURST_SECONDS,
+                 enabled: bool = RATE_LIMIT_ENABLED):
+        self.name = name
+        self.user_rate = user_rate
+        self.burst_seconds = burst_seconds
+        self.enabled = enabled
+        self.global_bucket = TokenBucket(global_rate, global_rate * burst_seconds)
+        self._user_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _user_bucket(self, user_id: int) -> TokenBucket:
+        with self._lock:
+            bucket = self._user_buckets.get(user_id)
+            if bucket is None:
+                bucket = self._user_buckets[user_id] = TokenBucket(self.user_rate, self.user_rate * self.burst_seconds)
+                while len(self._user_buckets) > MAX_USER_BUCKETS:
+                    self._user_buckets.popitem(last=False)
+            self._user_buckets.move_to_end(user_id)
+            return bucket
+
+    def reserve(self, user_id: Optional[int], cost: float) -> float:
+        if not self.enabled:
+            return 0.0
+        wait = self.global_bucket.reserve(cost)
+        if user_id is not None:
+            wait = max(wait, self._user_bucket(user_id).reserve(cost))
+        if wait > 0:
+            RATE_LIMIT_WAIT.labels(self.name).observe(wait)
+        return wait
+
+    def acquire(self, user_id: Optional[int], cost: float = 1.0) -> None:
+        """Blocking, for calls running on worker threads."""
+        wait = self.reserve(user_id, cost)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, user_id: Optional[int], cost: float = 1.0) -> None:
+        wait = self.reserve(user_id, cost)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def backoff(self, user_id: Optional[int], seconds: float, per_user: bool = True) -> None:
+        """Hold back further calls after a 429, for one user or (project-wide limits) everyone."""
+        RATE_LIMITED.labels(self.name).inc()
+        if per_user and user_id is not None:
+            self._user_bucket(user_id).block(seconds)
+        else:
+            self.global_bucket.block(seconds)
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Truncated exponential backoff with jitter, or the upstream's Retry-After if that is longer."""
+    delay = min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+    return max(delay, retry_after or 0.0)
+
+# A rate limit error classified as (per user?, retry-after seconds or None); None for other errors
+RateLimit = Optional[Tuple[bool, Optional[float]]]
+
+def gmail_rate_limit(error: Exception) -> RateLimit:
+    if not isinstance(error, HttpError):
+        return None
+    status = error.resp.status
+    content = error.content or b""
+    if status == 429 or (status == 403 and any(reason in content for reason in GMAIL_RATE_LIMIT_REASONS)):
+        retry_after = error.resp.get("retry-after", "")
+        # "rateLimitExceeded" is the project-wide limit, everything else counts against the user
+        return b'"rateLimitExceeded"' not in content, float(retry_after) if retry_after.isdigit() else None
+    return None
+
+def llm_rate_limit(error: Exception) -> RateLimit:
+    """Gemini quotas belong to the API key, so a 429 holds back every user."""
+    if not isinstance(error, (ResourceExhausted, TooManyRequests)):
+        return None
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None) # google.rpc.RetryInfo
+        if delay is not None:
+            return False, delay.seconds + delay.nanos / 1e9
+    return False, None
+
+def call_with_quota(limiter: "QuotaLimiter", user_id: Optional[int], cost: float, call: Callable[[], Any],
+                    rate_limit: Callable[[Exception], RateLimit]) -> Any:
+    """Run a blocking upstream call within the quota, retrying it when the upstream answers with a rate limit."""
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        limiter.acquire(user_id, cost)
+        try:
+            return call()
+        except Exception as error:
+            limited = rate_limit(error)
+            if limited is None or attempt == RATE_LIMIT_MAX_RETRIES:
+                raise
+            limiter.backoff(user_id, backoff_delay(attempt, limited[1]), per_user=limited[0])
+
+async def acall_with_quota(limiter: "QuotaLimiter", user_id: Optional[int], cost: float, call: Callable[[], Awaitable[Any]],
+                           rate_limit: Callable[[Exception], RateLimit]) -> Any:
+    """Async form of call_with_quota()."""
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        await limiter.aacquire(user_id, cost)
+        try:
+            return await call()
+        except Exception as error:
+            limited = rate_limit(error)
+            if limited is None or attempt == RATE_LIMIT_MAX_RETRIES:
+                raise
+            limiter.backoff(user_id, backoff_delay(attempt, limited[1]), per_user=limited[0])
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight async calls: while a call for a key runs, later callers
+    with the same key await its result instead of starting their own. The call runs as its
+    own task, so one caller giving up (cancelled request) does not cancel it for the others.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(call())
+            self._calls[key] = task
+
+            def finished(done: asyncio.Task) -> None:
+                if self._calls.get(key) is done:
+                    del self._calls[key]
+                if not done.cancelled():
+                    done.exception() # retrieved here in case every caller gave up
+            task.add_done_callback(finished)
+        else:
+            self.coalesced += 1
+            COALESCED_CALLS.labels(self.name).inc()
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "coalesced": self.coalesced}
+
+gmail_limiter = QuotaLimiter("gmail", GMAIL_QUOTA_USER_RATE, GMAIL_QUOTA_GLOBAL_RATE)
+llm_limiter = QuotaLimiter("llm", LLM_RPM_USER / 60, LLM_RPM_GLOBAL / 60)
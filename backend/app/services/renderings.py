@@ -0,0 +1,118 @@
+import hashlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Callable, Awaitable
+from sqlmodel import Session, select, delete, col
+from sqlalchemy.exc import IntegrityError
+from .metrics import traced
+from ..models import MessageRendering
+from ..config import MESSAGE_CACHE_ENABLED, MESSAGE_CACHE_MAX_AGE_DAYS
+
+# kind -> prompt version currently in use, filled by the RenderingCache instances of the agents
+CURRENT_VERSIONS: Dict[str, str] = {}
+
+def source_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+class RenderingCache:
+    """
+    Per-mail LLM output ("speakable" read-out text, short "summary") stored in the database.
+    Entries are keyed by (user, Gmail message id, kind, prompt version, model). Each entry also
+    stores a hash of the prompt it was rendered from, so a mail whose prompt input changed
+    (or a template edited without bumping the version) is rendered again.
+    """
+    def __init__(self, kind: str, prompt_version: str):
+        self.kind = kind
+        self.prompt_version = prompt_version
+        CURRENT_VERSIONS[kind] = prompt_version
+
+    async def render(self, user_id: Optional[int], model: str, gmail_ids: List[Optional[str]], prompts: List[str],
+                     render_missing: Callable[[List[int]], Awaitable[List[str]]],
+                     cacheable: Callable[[int, str], bool] = lambda i, text: True) -> List[str]:
+        """
+        Texts for all mails in order. Cached ones are reused, render_missing(indexes) produces
+        the rest; those that pass cacheable(index, text) (e.g. no fallback texts) are stored.
+        """
+        keyed = {gmail_id: prompt for gmail_id, prompt in zip(gmail_ids, prompts) if gmail_id}
+        use_cache = MESSAGE_CACHE_ENABLED and user_id is not None
+        cached = {}
+        if use_cache:
+            try:
+                cached = await self.load(user_id, model, keyed)
+            except Exception as e:
+                print(f"Rendering cache lookup failed: {e}")
+
+        texts = [cached.get(gmail_id) if gmail_id else None for gmail_id in gmail_ids]
+        missing = [i for i, text in enumerate(texts) if text is None]
+        if not missing:
+            return texts
+
+        fresh = {}
+        for i, text in zip(missing, await render_missing(missing)):
+            texts[i] = text
+            if gmail_ids[i] and cacheable(i, text):
+                fresh[gmail_ids[i]] = text
+        if use_cache:
+            try:
+                await self.store(user_id, model, keyed, fresh)
+            except Exception as e:
+                print(f"Rendering cache update failed: {e}")
+        return texts
+
+    async def load(self, user_id: int, model: str, prompts: Dict[str, str]) -> Dict[str, str]:
+        """Cached texts for the given {gmail_id: prompt}, only those whose prompt is unchanged."""
+        if not prompts:
+            return {}
+        async with self._session() as session:
+            rows = (await session.exec(
+                select(MessageRendering)
+                .where(MessageRendering.user_id == user_id)
+                .where(MessageRendering.kind == self.kind)
+                .where(MessageRendering.prompt_version == self.prompt_version)
+                .where(MessageRendering.model == model)
+                .where(col(MessageRendering.gmail_id).in_(list(prompts)))
+            )).all()
+        return {row.gmail_id: row.text for row in rows if row.source_hash == source_hash(prompts[row.gmail_id])}
+
+    @traced("db", "rendering_store")
+    async def store(self, user_id: int, model: str, prompts: Dict[str, str], texts: Dict[str, str]) -> None:
+        """Save freshly rendered texts, replacing outdated entries for the same mails."""
+        if not texts:
+            return
+        async with self._session() as session:
+            await session.exec(
+                delete(MessageRendering)
+                .where(MessageRendering.user_id == user_id)
+                .where(MessageRendering.kind == self.kind)
+                .where(MessageRendering.prompt_version == self.prompt_version)
+                .where(MessageRendering.model == model)
+                .where(col(MessageRendering.gmail_id).in_(list(texts)))
+            )
+            for gmail_id, text in texts.items():
+                session.add(MessageRendering(
+                    user_id=user_id, gmail_id=gmail_id, kind=self.kind, prompt_version=self.prompt_version,
+                    model=model, source_hash=source_hash(prompts[gmail_id]), text=text,
+                ))
+            try:
+                await session.commit()
+            except IntegrityError:
+                # A concurrent render (e.g. the prefetch) stored the same mails first, theirs is as good
+                await session.rollback()
+
+    @staticmethod
+    def _session():
+        # Imported here so the agents stay usable without a database (offline benchmarks)
+        from sqlmodel.ext.asyncio.session import AsyncSession
+        from ..database import async_engine
+        return AsyncSession(async_engine, expire_on_commit=False)
+
+def purge_outdated(session: Session) -> int:
+    """Delete entries rendered with a prompt version no longer in use or older than MESSAGE_CACHE_MAX_AGE_DAYS."""
+    deleted = 0
+    for kind, version in CURRENT_VERSIONS.items():
+        deleted += session.exec(
+            delete(MessageRendering).where(MessageRendering.kind == kind).where(MessageRendering.prompt_version != version)
+        ).rowcount
+    cutoff = datetime.utcnow() - timedelta(days=MESSAGE_CACHE_MAX_AGE_DAYS)
+    deleted += session.exec(delete(MessageRendering).where(MessageRendering.created_at < cutoff)).rowcount
+    session.commit()
+    return deleted
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import re
+import threading
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional
+from google.cloud import texttospeech
+from .cache import get_cache
+from .metrics import span
+from ..config import TTS_MAX_CHUNK_BYTES, TTS_CHUNK_CHARS, TTS_CONCURRENCY, TTS_CACHE_ENABLED, TTS_CACHE_TTL, TTS_CACHE_MEMORY_BYTES
+
+# Initialize Google Cloud TTS Client
+# Ensure GOOGLE_APPLICATION_CREDENTIALS is set in your environment or .env
+try:
+    tts_client = texttospeech.TextToSpeechClient()
+except Exception as e:
+    print(f"Warning: Could not initialize Google TTS Client: {e}")
+    tts_client = None
+
+# Select the language and voice (German Neural2 Female)
+VOICE = texttospeech.VoiceSelectionParams(
+    language_code="de-DE",
+    name="de-DE-Neural2-F",
+)
+
+# Select the type of audio file you want returned
+AUDIO_CONFIG = texttospeech.AudioConfig(
+    audio_encoding=texttospeech.AudioEncoding.MP3
+)
+
+# Content-addressed audio in the shared cache, so a text is synthesized once for all workers
+try:
+    tts_cache = get_cache("tts", ttl=TTS_CACHE_TTL, codec="bytes", memory_bytes=TTS_CACHE_MEMORY_BYTES) if TTS_CACHE_ENABLED else None
+except Exception as e:
+    print(f"Warning: Could not initialize TTS cache: {e}")
+    tts_cache = None
+
+# Fixed phrases the agents and process_intent say over and over, synthesized ahead of time
+COMMON_PHRASES = [
+    "Hier sind deine E-Mails.",
+    "Nächste E-Mail.",
+    "Keine E-Mails gefunden.",
+    "Keine E-Mails zum Zusammenfassen gefunden.",
+    "Alles klar, ich sende die E-Mail.",
+    "Die E-Mail wurde bereits gesendet.",
+    "Fehler: Kein Entwurf zum Senden gefunden.",
+    "Fehler: Keine Anmeldeinformationen gefunden.",
+    "Alles klar.",
+]
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…:])\s+")
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+def _byte_len(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+def _split_oversized(sentence: str, max_bytes: int) -> List[str]:
+    """Break a sentence that is too long for one TTS request at commas, then at spaces."""
+    pieces, current = [], ""
+    for word in re.split(r"(?<=,)\s+|\s+", sentence):
+        candidate = f"{current} {word}".strip()
+        if current and _byte_len(candidate) > max_bytes:
+            pieces.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_sentences(text: str, max_bytes: int = TTS_MAX_CHUNK_BYTES, chunk_chars: int = TTS_CHUNK_CHARS) -> List[str]:
+    """
+    Split text into TTS chunks at sentence boundaries.
+    The first sentence is its own chunk so playback can start early, later sentences are
+    merged up to chunk_chars to keep the number of TTS calls down. Sentences are never
+    merged across paragraphs, so stock phrases like "Nächste E-Mail." stay separate chunks
+    that the audio cache can answer. No chunk exceeds max_bytes.
+    """
+    chunks: List[str] = []
+    for paragraph in PARAGRAPH_RE.split(text):
+        paragraph_start = len(chunks)
+        for sentence in SENTENCE_END_RE.split(paragraph):
+            sentence = " ".join(sentence.split())
+            if not sentence:
+                continue
+            for piece in _split_oversized(sentence, max_bytes) if _byte_len(sentence) > max_bytes else [sentence]:
+                can_merge = len(chunks) > max(1, paragraph_start)
+                if can_merge and len(chunks[-1]) + len(piece) < chunk_chars and _byte_len(chunks[-1] + " " + piece) <= max_bytes:
+                    chunks[-1] = f"{chunks[-1]} {piece}"
+                else:
+                    chunks.append(piece)
+    return chunks
+
+def cache_key(text: str) -> str:
+    """Hash of everything that influences the audio."""
+    material = "\x1f".join([text, VOICE.language_code, VOICE.name, str(AUDIO_CONFIG.audio_encoding),
+                            str(AUDIO_CONFIG.speaking_rate), str(AUDIO_CONFIG.pitch)])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def _synthesize_uncached(text: str) -> bytes:
+    # Perform the text-to-speech request
+    with span("tts", "synthesize_speech"):
+        response = tts_client.synthesize_speech(
+            input=texttospeech.SynthesisInput(text=text),
+            voice=VOICE,
+            audio_config=AUDIO_CONFIG,
+        )
+    return response.audio_content
+
+def synthesize(text: str) -> bytes:
+    """
+    Synthesize one chunk (blocking), answered from the audio cache when possible.
+    Concurrent requests for the same uncached chunk (e.g. every worker prewarming the
+    same prompts at startup) wait for one synthesis instead of each calling Google.
+    """
+    if tts_cache:
+        return tts_cache.get_or_set(cache_key(text), lambda: _synthesize_uncached(text))
+    return _synthesize_uncached(text)
+
+def prewarm(texts: Iterable[str]) -> None:
+    """Synthesize texts into the cache in a background thread."""
+    if not (tts_client and tts_cache):
+        return
+
+    def run():
+        for text in texts:
+            for chunk in split_sentences(text):
+                try:
+                    synthesize(chunk)
+                except Exception as e:
+                    print(f"TTS prewarm failed for '{chunk}': {e}")
+                    return
+
+    threading.Thread(target=run, name="tts-prewarm", daemon=True).start()
+
+async def stream_speech(text: str) -> AsyncIterator[bytes]:
+    """
+    Yield MP3 audio for text chunk by chunk, in order.
+    Up to TTS_CONCURRENCY chunks are synthesized at the same time, so later sentences are
+    usually ready by the time the first one has been sent. MP3 frames can simply be
+    concatenated, the client sees one continuous stream.
+    """
+    async def whole_text():
+        yield text
+
+    async for audio in stream_speech_parts(whole_text()):
+        yield audio
+
+async def stream_speech_parts(texts: AsyncIterable[str]) -> AsyncIterator[bytes]:
+    """stream_speech() for text that is still being produced, e.g. the sentences of a streamed turn."""
+    semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+    tasks: "asyncio.Queue[Optional[asyncio.Task]]" = asyncio.Queue()
+    started: List[asyncio.Task] = []
+
+    async def synthesize_chunk(chunk: str) -> bytes:
+        async with semaphore:
+            return await asyncio.to_thread(synthesize, chunk)
+
+    async def schedule():
+        try:
+            async for text in texts:
+                for chunk in split_sentences(text):
+                    task = asyncio.create_task(synthesize_chunk(chunk))
+                    started.append(task)
+                    tasks.put_nowait(task)
+        finally:
+            tasks.put_nowait(None)
+
+    scheduler = asyncio.create_task(schedule())
+    try:
+        while (task := await tasks.get()) is not None:
+            yield await task
+        await scheduler # re-raises a failure of the text source
+    finally:
+        # Client went away or a chunk failed: don't keep synthesizing audio nobody will hear
+        scheduler.cancel()
+        for task in started:
+            task.cancel()
+
+async def synthesize_text(text: str) -> bytes:
+    """Whole text as one MP3, chunked the same way as the stream so there is no length limit."""
+    return b"".join([chunk async for chunk in stream_speech(text)])
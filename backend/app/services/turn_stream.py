@@ -0,0 +1,65 @@
+import asyncio
+import json
+import re
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+# Same boundaries the TTS chunking uses (services/tts.py), plus paragraph breaks
+SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?…:])\s+|\n\s*\n")
+
+class TurnStream:
+    """
+    Events of one streamed turn (/ai/process_intent/stream as Server-Sent Events, /voice/turn
+    straight into speech synthesis). handle_intent and the agents push response text while
+    they produce it; it goes out one complete sentence at a time, so the first sentence can
+    be synthesized while the rest is generated.
+    """
+    def __init__(self):
+        self.spoken = "" # all text pushed so far, complete sentences or not
+        self.sentences = 0
+        self._pending = ""
+        self._queue: "asyncio.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = asyncio.Queue()
+
+    def event(self, name: str, data: Dict[str, Any]) -> None:
+        self._queue.put_nowait((name, data))
+
+    def say(self, text: str) -> None:
+        """Add response text, every sentence it completes is sent right away."""
+        self.spoken += text
+        parts = SENTENCE_BOUNDARY_RE.split(self._pending + text)
+        for sentence in parts[:-1]:
+            self._send_sentence(sentence)
+        self._pending = parts[-1]
+
+    def finish(self, response: Optional[str]) -> None:
+        """Send whatever of the turn's final response text has not been streamed yet."""
+        response = response or ""
+        if response.startswith(self.spoken):
+            self.say(response[len(self.spoken):])
+        else:
+            # The agent failed after part of its answer went out: the error message follows
+            self._pending = ""
+            self.say(response)
+        self._send_sentence(self._pending)
+        self._pending = ""
+
+    def close(self) -> None:
+        self._queue.put_nowait(None)
+
+    async def messages(self) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """(event name, data) until the stream is closed."""
+        while True:
+            message = await self._queue.get()
+            if message is None:
+                return
+            yield message
+
+    async def events(self) -> AsyncIterator[str]:
+        """The same as Server-Sent Events."""
+        async for name, data in self.messages():
+            yield f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+    def _send_sentence(self, sentence: str) -> None:
+        sentence = " ".join(sentence.split())
+        if sentence:
+            self.event("sentence", {"index": self.sentences, "text": sentence})
+            self.sentences += 1
@@ -0,0 +1,70 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ..models import Conversation, Message, Task
+from ..config import HISTORY_WRITE_BEHIND
+from .history import history_writer
+from .metrics import traced
+
+class TurnUnitOfWork:
+    """
+    Collects the writes of one process_intent turn (messages, task, conversation state)
+    and saves them in a single transaction at the end of the turn.
+    Nothing is added to the session before commit(), so the reads during the turn never
+    autoflush, and release() can hand the connection back to the pool while the LLM and
+    the agents run. With HISTORY_WRITE_BEHIND the Message rows skip the transaction and
+    go to the background bulk writer instead.
+    """
+    def __init__(self, session: AsyncSession, conversation: Conversation):
+        self.session = session
+        self.conversation = conversation
+        self._messages: List[Tuple[str, str, datetime]] = []
+        self._tasks: List[Task] = []
+
+    def add_message(self, role: str, content: str) -> None:
+        self._messages.append((role, content, datetime.utcnow()))
+
+    def add_task(self, intent: str, slots: Dict[str, Any], agent_response: Dict[str, Any]) -> None:
+        self._tasks.append(Task(
+            intent=intent,
+            slots=json.dumps(slots),
+            status=agent_response.get("status", "completed"),
+            result=json.dumps(agent_response),
+            completed_at=datetime.utcnow()
+        ))
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        self.conversation.state = state
+        self.conversation.updated_at = datetime.utcnow()
+
+    @traced("db", "turn_release")
+    async def release(self) -> None:
+        """End the read-only transaction, the pooled connection is free until the next query."""
+        await self.session.commit()
+
+    @traced("db", "turn_commit")
+    async def commit(self) -> None:
+        session = self.session
+        session.add(self.conversation)
+        if self.conversation.id is None:
+            # First turn of a user: the insert is part of this transaction, flush only to get the id
+            await session.flush()
+
+        for task in self._tasks:
+            task.conversation_id = self.conversation.id
+        session.add_all(self._tasks)
+
+        rows = [
+            {"conversation_id": self.conversation.id, "role": role, "content": content, "created_at": created_at}
+            for role, content, created_at in self._messages
+        ]
+        write_behind = HISTORY_WRITE_BEHIND and history_writer.accepts(len(rows))
+        if not write_behind:
+            session.add_all([Message(**row) for row in rows])
+
+        await session.commit()
+        if write_behind:
+            history_writer.enqueue(rows)
+        self._messages.clear()
+        self._tasks.clear()
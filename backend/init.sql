@@ -3,7 +3,8 @@ CREATE TABLE IF NOT EXISTS "user" (
     id SERIAL PRIMARY KEY,
     email VARCHAR NOT NULL UNIQUE,
     name VARCHAR,
-    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    prefetch_enabled BOOLEAN NOT NULL DEFAULT TRUE
 );
 
 -- Create Index on email for faster lookups
@@ -23,16 +24,21 @@ CREATE TABLE IF NOT EXISTS oauthcredential (
     CONSTRAINT fk_user FOREIGN KEY (user_id) REFERENCES "user" (id) ON DELETE CASCADE
 );
 
+CREATE INDEX IF NOT EXISTS ix_oauthcredential_user_id ON oauthcredential (user_id);
+
 -- Create Conversation table
 CREATE TABLE IF NOT EXISTS conversation (
     id SERIAL PRIMARY KEY,
     user_id INTEGER NOT NULL,
     created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
     updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
-    state VARCHAR NOT NULL,
+    state JSONB NOT NULL DEFAULT '{}'::jsonb,
     CONSTRAINT fk_user_conversation FOREIGN KEY (user_id) REFERENCES "user" (id) ON DELETE CASCADE
 );
 
+-- Latest conversation of a user, read on every turn
+CREATE INDEX IF NOT EXISTS ix_conversation_user_id_updated_at ON conversation (user_id, updated_at);
+
 -- Create Message table
 CREATE TABLE IF NOT EXISTS message (
     id SERIAL PRIMARY KEY,
@@ -42,3 +48,122 @@ CREATE TABLE IF NOT EXISTS message (
     created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
     CONSTRAINT fk_conversation FOREIGN KEY (conversation_id) REFERENCES conversation (id) ON DELETE CASCADE
 );
+
+CREATE INDEX IF NOT EXISTS ix_message_conversation_id ON message (conversation_id);
+
+-- Create Task table
+CREATE TABLE IF NOT EXISTS task (
+    id SERIAL PRIMARY KEY,
+    conversation_id INTEGER NOT NULL,
+    intent VARCHAR NOT NULL,
+    slots VARCHAR NOT NULL,
+    status VARCHAR NOT NULL,
+    result VARCHAR,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    completed_at TIMESTAMP WITHOUT TIME ZONE,
+    CONSTRAINT fk_conversation_task FOREIGN KEY (conversation_id) REFERENCES conversation (id) ON DELETE CASCADE
+);
+
+-- Latest task of an intent in a conversation (confirm_send looks up the draft to send)
+CREATE INDEX IF NOT EXISTS ix_task_conversation_id_intent_created_at ON task (conversation_id, intent, created_at);
+
+-- Create MailboxMessage table (local Gmail mirror)
+CREATE TABLE IF NOT EXISTS mailboxmessage (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    gmail_id VARCHAR NOT NULL,
+    thread_id VARCHAR,
+    subject VARCHAR NOT NULL,
+    sender VARCHAR NOT NULL,
+    "to" VARCHAR NOT NULL,
+    date VARCHAR NOT NULL,
+    snippet VARCHAR,
+    body VARCHAR,
+    label_ids VARCHAR NOT NULL,
+    internal_date BIGINT NOT NULL,
+    synced_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    CONSTRAINT uq_mailboxmessage_user_gmail UNIQUE (user_id, gmail_id),
+    CONSTRAINT fk_user_mailboxmessage FOREIGN KEY (user_id) REFERENCES "user" (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_mailboxmessage_user_id ON mailboxmessage (user_id);
+
+-- Create MailboxSyncState table
+CREATE TABLE IF NOT EXISTS mailboxsyncstate (
+    user_id INTEGER PRIMARY KEY,
+    history_id VARCHAR,
+    complete BOOLEAN NOT NULL,
+    synced_at TIMESTAMP WITHOUT TIME ZONE,
+    CONSTRAINT fk_user_mailboxsyncstate FOREIGN KEY (user_id) REFERENCES "user" (id) ON DELETE CASCADE
+);
+
+-- Create Contact table (recipient resolution for spoken names)
+CREATE TABLE IF NOT EXISTS contact (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    address VARCHAR NOT NULL,
+    name VARCHAR NOT NULL,
+    phonetic VARCHAR NOT NULL,
+    sent_count INTEGER NOT NULL,
+    received_count INTEGER NOT NULL,
+    last_seen BIGINT NOT NULL,
+    CONSTRAINT uq_contact_user_address UNIQUE (user_id, address),
+    CONSTRAINT fk_user_contact FOREIGN KEY (user_id) REFERENCES "user" (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_contact_user_id ON contact (user_id);
+
+-- Create OutboxMessage table (drafts and sends delivered in the background)
+CREATE TABLE IF NOT EXISTS outboxmessage (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    idempotency_key VARCHAR NOT NULL,
+    recipient VARCHAR NOT NULL,
+    recipient_name VARCHAR NOT NULL,
+    subject VARCHAR NOT NULL,
+    body VARCHAR NOT NULL,
+    status VARCHAR NOT NULL,
+    send_requested BOOLEAN NOT NULL,
+    draft_id VARCHAR,
+    gmail_message_id VARCHAR,
+    attempts INTEGER NOT NULL,
+    next_attempt_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    locked_until TIMESTAMP WITHOUT TIME ZONE,
+    last_error VARCHAR,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    sent_at TIMESTAMP WITHOUT TIME ZONE,
+    CONSTRAINT uq_outboxmessage_idempotency_key UNIQUE (idempotency_key),
+    CONSTRAINT fk_user_outboxmessage FOREIGN KEY (user_id) REFERENCES "user" (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_outboxmessage_status_next_attempt_at ON outboxmessage (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS ix_outboxmessage_user_id_created_at ON outboxmessage (user_id, created_at);
+
+-- Create MessageRendering table (cached per-mail LLM output)
+CREATE TABLE IF NOT EXISTS messagerendering (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    gmail_id VARCHAR NOT NULL,
+    kind VARCHAR NOT NULL,
+    prompt_version VARCHAR NOT NULL,
+    model VARCHAR NOT NULL,
+    source_hash VARCHAR NOT NULL,
+    text VARCHAR NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    CONSTRAINT uq_messagerendering_key UNIQUE (user_id, gmail_id, kind, prompt_version, model),
+    CONSTRAINT fk_user_messagerendering FOREIGN KEY (user_id) REFERENCES "user" (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_messagerendering_user_id ON messagerendering (user_id);
+
+-- Create CacheEntry table (shared cache with CACHE_BACKEND=database, see services/cache.py)
+CREATE TABLE IF NOT EXISTS cacheentry (
+    key VARCHAR PRIMARY KEY,
+    value BYTEA NOT NULL,
+    expires_at DOUBLE PRECISION,
+    accessed_at DOUBLE PRECISION NOT NULL,
+    size INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_cacheentry_expires_at ON cacheentry (expires_at);
+CREATE INDEX IF NOT EXISTS ix_cacheentry_accessed_at ON cacheentry (accessed_at);
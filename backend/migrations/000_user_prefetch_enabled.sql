@@ -0,0 +1,2 @@
+-- Background prefetch opt-out (User.prefetch_enabled)
+ALTER TABLE "user" ADD COLUMN IF NOT EXISTS prefetch_enabled BOOLEAN NOT NULL DEFAULT TRUE;
@@ -0,0 +1,10 @@
+-- Conversation state: JSON text in VARCHAR -> JSONB.
+-- Rewrites the table under an exclusive lock, run it outside peak hours on large databases.
+ALTER TABLE conversation ALTER COLUMN state TYPE JSONB USING state::jsonb;
+ALTER TABLE conversation ALTER COLUMN state SET DEFAULT '{}'::jsonb;
+
+-- Indexes for the process_intent query path, built without blocking writes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_conversation_user_id_updated_at ON conversation (user_id, updated_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_oauthcredential_user_id ON oauthcredential (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_message_conversation_id ON message (conversation_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_task_conversation_id_intent_created_at ON task (conversation_id, intent, created_at);
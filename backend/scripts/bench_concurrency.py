@@ -0,0 +1,85 @@
+"""
+How many read_emails turns one worker serves concurrently, against the offline
+Gmail and LLM stand-ins.
+
+"thread-cap" simulates the old sync endpoint: every turn occupies one thread of a
+40-thread pool (anyio's limit for sync endpoints) for its whole duration. It runs the
+current async agents there through asyncio.run, not the pre-async sync code, so it
+measures the cost of the thread cap alone, not the old implementation end to end.
+"async" runs the agents on the event loop and only hands the Gmail calls to
+GmailService's I/O pool.
+
+    python -m scripts.bench_concurrency --turns 200 --gmail-latency 0.08 --llm-latency 0.4
+"""
+import os
+
+os.environ["MAILBOX_MIRROR_ENABLED"] = "false"
+os.environ["MESSAGE_CACHE_ENABLED"] = "false"
+
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+import anyio
+
+from app.agents.email_reader import EmailReaderAgent
+from app.services.gmail_pool import gmail_pool, build_gmail_client
+from scripts.fake_gmail import FakeGmailHttp
+from scripts.fake_llm import FakeLLMClient
+
+SYNC_ENDPOINT_THREADS = 40 # anyio's default thread limiter for sync endpoints
+
+
+def make_users(count, fake_http):
+    users = []
+    for user_id in range(1, count + 1):
+        creds = SimpleNamespace(
+            user_id=user_id, access_token=f"fake{user_id}", refresh_token=None, token_uri=None,
+            client_id=None, client_secret=None, scopes=None,
+        )
+        # Pre-register the client so GmailService picks up the fake transport from the pool
+        gmail_pool.put(creds, build_gmail_client(http=fake_http), None)
+        users.append(creds)
+    return users
+
+
+async def turn(creds, llm, limit):
+    response = await EmailReaderAgent(creds, llm=llm).execute({"limit": limit})
+    assert response["status"] == "success", response
+
+
+async def run_async(users, llm, limit):
+    await asyncio.gather(*(turn(creds, llm, limit) for creds in users))
+
+
+async def run_thread_capped(users, llm, limit):
+    """Every turn holds one of SYNC_ENDPOINT_THREADS threads until it is done."""
+    limiter = anyio.CapacityLimiter(SYNC_ENDPOINT_THREADS)
+    async with anyio.create_task_group() as tg:
+        for creds in users:
+            tg.start_soon(lambda c=creds: anyio.to_thread.run_sync(asyncio.run, turn(c, llm, limit), limiter=limiter))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200, help="concurrent turns, one per user")
+    parser.add_argument("--limit", type=int, default=3, help="mails read per turn")
+    parser.add_argument("--gmail-latency", type=float, default=0.08)
+    parser.add_argument("--llm-latency", type=float, default=0.4)
+    args = parser.parse_args()
+
+    fake_http = FakeGmailHttp(num_messages=max(20, args.limit), latency=args.gmail_latency)
+    users = make_users(args.turns, fake_http)
+
+    print(f"{'mode':<12}{'turns':>7}{'wall time':>12}{'turns/s':>10}")
+    for mode, runner in (("thread-cap", run_thread_capped), ("async", run_async)):
+        llm = FakeLLMClient(latency=args.llm_latency, per_mail_latency=0)
+        start = time.perf_counter()
+        asyncio.run(runner(users, llm, args.limit))
+        elapsed = time.perf_counter() - start
+        print(f"{mode:<12}{args.turns:>7}{elapsed:>11.2f}s{args.turns / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
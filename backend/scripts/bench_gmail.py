@@ -0,0 +1,49 @@
+"""
+Compare sequential vs batched message fetching in GmailService.list_messages
+against the offline Gmail stand-in.
+
+    python -m scripts.bench_gmail --limit 10 --latency 0.08
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+from app.services.gmail import GmailService
+from scripts.fake_gmail import FakeGmailHttp
+
+FAKE_CREDENTIALS = SimpleNamespace(
+    access_token="fake", refresh_token=None, token_uri=None, client_id=None, client_secret=None, scopes=None
+)
+
+
+def run(fake_http, limit, include_body, batch, repeat):
+    gmail_service = GmailService(FAKE_CREDENTIALS, http=fake_http)
+    fake_http.reset_counters()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        messages = gmail_service.list_messages(limit=limit, include_body=include_body, batch=batch)
+    elapsed = (time.perf_counter() - start) / repeat
+    assert len(messages) == limit, f"expected {limit} messages, got {len(messages)}"
+    return elapsed, fake_http.round_trips / repeat, fake_http.bytes_received / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.08, help="seconds per HTTP round trip")
+    parser.add_argument("--body-size", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    fake_http = FakeGmailHttp(num_messages=max(50, args.limit), body_size=args.body_size, latency=args.latency)
+
+    print(f"{'mode':<22}{'body':<7}{'round trips':>12}{'bytes':>10}{'latency':>11}")
+    for include_body in (False, True):
+        for batch in (False, True):
+            elapsed, trips, received = run(fake_http, args.limit, include_body, batch, args.repeat)
+            mode = "batched" if batch else "sequential"
+            print(f"{mode:<22}{str(include_body):<7}{trips:>12.0f}{received:>10.0f}{elapsed * 1000:>9.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
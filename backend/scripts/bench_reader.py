@@ -0,0 +1,56 @@
+"""
+Compare the EmailReaderAgent formatting modes (serial, parallel, batch)
+against an offline LLM stand-in.
+
+    python -m scripts.bench_reader --mails 5 --latency 0.4
+"""
+import os
+
+# Measure the LLM formatting itself, not the per-mail cache in the database
+os.environ["MESSAGE_CACHE_ENABLED"] = "false"
+
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+from app.agents.email_reader import EmailReaderAgent
+from scripts.fake_llm import FakeLLMClient
+
+FAKE_CREDENTIALS = SimpleNamespace(user_id=1)
+
+
+def make_messages(count):
+    return [
+        {
+            "id": f"msg{i}",
+            "sender": f"Sender {i} <sender{i}@example.com>",
+            "subject": f"Betreff {i}",
+            "date": "Fri, 06 Dec 2024 14:30:00 +0000",
+            "body": "Hallo, hier ist der Inhalt der Nachricht. " * 20,
+        }
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mails", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.4, help="seconds per LLM call")
+    parser.add_argument("--per-mail-latency", type=float, default=0.15, help="extra seconds per mail in the answer")
+    args = parser.parse_args()
+
+    messages = make_messages(args.mails)
+    print(f"{'mode':<10}{'llm calls':>10}{'latency':>11}")
+    for mode in ("serial", "parallel", "batch"):
+        llm = FakeLLMClient(latency=args.latency, per_mail_latency=args.per_mail_latency)
+        agent = EmailReaderAgent(FAKE_CREDENTIALS, format_mode=mode, llm=llm)
+        start = time.perf_counter()
+        texts = asyncio.run(agent.format_messages(messages))
+        elapsed = time.perf_counter() - start
+        assert len(texts) == args.mails
+        print(f"{mode:<10}{llm.calls:>10}{elapsed * 1000:>9.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
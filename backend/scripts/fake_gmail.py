@@ -0,0 +1,267 @@
+"""
+Offline stand-in for the Gmail HTTP API.
+
+FakeGmailHttp implements the httplib2 request() interface, so it can be passed to
+googleapiclient (and to GmailService(..., http=...)) in place of a real transport.
+It counts round trips and bytes and sleeps a configurable latency per round trip,
+which lets us benchmark Gmail access patterns without credentials or network.
+"""
+import base64
+import json
+import re
+import threading
+import time
+from email.parser import Parser
+from urllib.parse import urlparse, parse_qs
+
+import httplib2
+
+BATCH_BOUNDARY = "fake_gmail_batch"
+
+MESSAGE_RE = re.compile(r"^/gmail/v1/users/me/messages/([^/]+)$")
+DRAFTS_PATH = "/gmail/v1/users/me/drafts"
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def make_message(index: int, body_size: int = 2000, sender: str = None, to: str = "me@example.com"):
+    """Build a Gmail message resource in the shape messages().get(format='full') returns."""
+    sender = sender or f"Sender {index % 7} <sender{index % 7}@example.com>"
+    body = (f"Hallo, das ist die Nachricht Nummer {index}. " * (body_size // 40 + 1))[:body_size]
+    return {
+        "id": f"msg{index:06d}",
+        "threadId": f"thr{index:06d}",
+        "historyId": str(1000 + index),
+        "internalDate": str(1700000000000 - index * 60000),
+        "labelIds": ["INBOX"],
+        "snippet": body[:100],
+        "sizeEstimate": body_size + 500,
+        "payload": {
+            "mimeType": "multipart/alternative",
+            "headers": [
+                {"name": "Subject", "value": f"Betreff {index}"},
+                {"name": "From", "value": sender},
+                {"name": "To", "value": to},
+                {"name": "Date", "value": "Fri, 06 Dec 2024 14:30:00 +0000"},
+                {"name": "Message-ID", "value": f"<msg{index}@example.com>"},
+                {"name": "Received", "value": "from mail.example.com by mx.google.com " * 4},
+            ],
+            "body": {"size": 0},
+            "parts": [
+                {"partId": "0", "mimeType": "text/plain", "body": {"size": body_size, "data": _b64(body)}},
+                {"partId": "1", "mimeType": "text/html", "body": {"size": body_size, "data": _b64(f"<p>{body}</p>")}},
+            ],
+        },
+    }
+
+
+class FakeGmailHttp:
+    def __init__(self, num_messages: int = 50, body_size: int = 2000, latency: float = 0.08, per_item_latency: float = 0.002):
+        """
+        num_messages: size of the fake mailbox (newest first)
+        latency: seconds slept per HTTP round trip
+        per_item_latency: extra seconds per sub-request inside a batch
+        """
+        self.messages = [make_message(i, body_size) for i in range(num_messages)]
+        self.body_size = body_size
+        self.history = [] # (historyId, 'messagesAdded'|'messagesDeleted'|'labelsAdded'|'labelsRemoved', message id)
+        self.history_floor = 1000 # startHistoryIds below this answer 404, like expired Gmail history
+        self.drafts = {} # draft id -> raw message, until it is sent
+        self.sent = 0
+        self.sent_messages = {} # Message-ID header -> Gmail id of the sent message
+        self.fail_next = [] # HTTP statuses to answer the next calls with, e.g. [429, 503]
+        self._draft_counter = 0
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.round_trips = 0
+        self.sub_requests = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def reset_counters(self):
+        with self._lock:
+            self.round_trips = 0
+            self.sub_requests = 0
+            self.bytes_received = 0
+
+    def deliver(self, sender: str = None):
+        """Simulate a newly received message and record it in the mailbox history."""
+        history_id = self._history_id() + 1
+        msg = make_message(len(self.messages) + len(self.history), self.body_size, sender=sender)
+        msg["historyId"] = str(history_id)
+        msg["internalDate"] = str(max((int(m["internalDate"]) for m in self.messages), default=0) + 60000)
+        self.messages.insert(0, msg)
+        self.history.append((history_id, "messagesAdded", msg["id"]))
+        return msg
+
+    def remove(self, msg_id: str):
+        """Simulate a deleted message."""
+        self.messages = [m for m in self.messages if m["id"] != msg_id]
+        self.history.append((self._history_id() + 1, "messagesDeleted", msg_id))
+
+    def relabel(self, msg_id: str, add=(), remove=()):
+        """Simulate a label change, e.g. add=["TRASH"] for trashing or remove=["UNREAD"] for reading."""
+        msg = next(m for m in self.messages if m["id"] == msg_id)
+        msg["labelIds"] = [label for label in msg["labelIds"] if label not in remove] + [l for l in add if l not in msg["labelIds"]]
+        if add:
+            self.history.append((self._history_id() + 1, "labelsAdded", msg_id))
+        if remove:
+            self.history.append((self._history_id() + 1, "labelsRemoved", msg_id))
+
+    # httplib2.Http interface
+    def request(self, uri, method="GET", body=None, headers=None, redirections=None, connection_type=None):
+        parsed = urlparse(uri)
+        if parsed.path == "/batch" or parsed.path.startswith("/batch/"):
+            status, content_type, content, items = self._handle_batch(body, headers or {})
+        else:
+            status, payload = self._dispatch(method, parsed.path, parse_qs(parsed.query), body)
+            content_type, content, items = "application/json; charset=UTF-8", json.dumps(payload).encode(), 1
+
+        time.sleep(self.latency + self.per_item_latency * (items - 1))
+        with self._lock:
+            self.round_trips += 1
+            self.sub_requests += items
+            self.bytes_received += len(content)
+        return httplib2.Response({"status": str(status), "content-type": content_type}), content
+
+    def _handle_batch(self, body, headers):
+        content_type = headers.get("content-type") or headers.get("Content-Type")
+        if isinstance(body, bytes):
+            body = body.decode()
+        mime = Parser().parsestr(f"content-type: {content_type}\r\n\r\n{body}")
+
+        parts = []
+        for part in mime.get_payload():
+            request_line = part.get_payload().split("\n", 1)[0].strip()
+            method, path, _ = request_line.split(" ", 2)
+            parsed = urlparse(path)
+            status, payload = self._dispatch(method, parsed.path, parse_qs(parsed.query), None)
+            content_id = part["Content-ID"].replace("<", "<response-", 1)
+            parts.append(
+                f"--{BATCH_BOUNDARY}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: {content_id}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        content = ("".join(parts) + f"--{BATCH_BOUNDARY}--\r\n").encode()
+        return 200, f"multipart/mixed; boundary={BATCH_BOUNDARY}", content, len(parts)
+
+    def _dispatch(self, method, path, query, body):
+        if self.fail_next:
+            status = self.fail_next.pop(0)
+            reason = "userRateLimitExceeded" if status in (403, 429) else "backendError"
+            return status, {"error": {"code": status, "message": "Injected failure", "errors": [{"reason": reason}]}}
+        if path == "/gmail/v1/users/me/messages" and method == "GET":
+            return 200, self._list_messages(query)
+        if path == "/gmail/v1/users/me/profile":
+            return 200, {"emailAddress": "me@example.com", "messagesTotal": len(self.messages), "historyId": self._history_id()}
+        if path == "/gmail/v1/users/me/history":
+            return self._list_history(query)
+        match = MESSAGE_RE.match(path)
+        if match and method == "GET":
+            return self._get_message(match.group(1), query)
+        if path == DRAFTS_PATH and method == "GET":
+            return 200, self._list_drafts(query)
+        if path == DRAFTS_PATH and method == "POST":
+            return self._create_draft(body)
+        if path == DRAFTS_PATH + "/send" and method == "POST":
+            return self._send_draft(body)
+        return 404, {"error": {"code": 404, "message": f"Fake Gmail has no handler for {method} {path}"}}
+
+    def _history_id(self):
+        latest = max((int(m["historyId"]) for m in self.messages), default=1000)
+        return max([latest] + [h[0] for h in self.history])
+
+    def _list_history(self, query):
+        start = int(query["startHistoryId"][0])
+        if start < self.history_floor:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        labels = {m["id"]: m["labelIds"] for m in self.messages}
+        records = [
+            {"id": str(history_id), kind: [{"message": {"id": msg_id, "labelIds": labels.get(msg_id, [])}
+                                            if kind.startswith("labels") else {"id": msg_id}}]}
+            for history_id, kind, msg_id in self.history if history_id > start
+        ]
+        return 200, {"history": records, "historyId": str(self._history_id())}
+
+    def _list_messages(self, query):
+        limit = int(query.get("maxResults", ["100"])[0])
+        if "pageToken" in query:
+            return {"resultSizeEstimate": 0}
+        q = query.get("q", [""])[0]
+        if "rfc822msgid:" in q:
+            # Only used to look up sent mail by its Message-ID
+            sent_id = self.sent_messages.get(q.split("rfc822msgid:", 1)[1].split()[0])
+            return {"messages": [{"id": sent_id, "threadId": sent_id}] if sent_id else [], "resultSizeEstimate": int(bool(sent_id))}
+        matches = [m for m in self.messages if not {"TRASH", "SPAM"} & set(m["labelIds"])]
+        for term in q.split():
+            if term.startswith("from:"):
+                needle = term[5:].lower()
+                matches = [m for m in matches if needle in self._header(m, "From").lower()]
+            elif term.startswith("to:"):
+                needle = term[3:].lower()
+                matches = [m for m in matches if needle in self._header(m, "To").lower()]
+        result = {
+            "messages": [{"id": m["id"], "threadId": m["threadId"]} for m in matches[:limit]],
+            "resultSizeEstimate": len(matches),
+        }
+        if len(matches) > limit:
+            result["nextPageToken"] = "page2"
+        return result
+
+    def _list_drafts(self, query):
+        wanted = query.get("q", [""])[0].replace("rfc822msgid:", "")
+        with self._lock:
+            drafts = [{"id": draft_id} for draft_id, raw in self.drafts.items() if self._message_id(raw) == wanted]
+        return {"drafts": drafts, "resultSizeEstimate": len(drafts)}
+
+    def _create_draft(self, body):
+        raw = json.loads(body)["message"]["raw"]
+        with self._lock:
+            self._draft_counter += 1
+            draft_id = f"draft{self._draft_counter:06d}"
+            self.drafts[draft_id] = raw
+        return 200, {"id": draft_id, "message": {"id": f"m{draft_id}", "threadId": f"t{draft_id}", "labelIds": ["DRAFT"]}}
+
+    def _send_draft(self, body):
+        draft_id = json.loads(body)["id"]
+        with self._lock:
+            raw = self.drafts.pop(draft_id, None)
+            if raw is None:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            self.sent += 1
+            self.sent_messages[self._message_id(raw)] = f"m{draft_id}"
+        return 200, {"id": f"m{draft_id}", "threadId": f"t{draft_id}", "labelIds": ["SENT"]}
+
+    def _get_message(self, msg_id, query):
+        msg = next((m for m in self.messages if m["id"] == msg_id), None)
+        if msg is None:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+
+        fmt = query.get("format", ["full"])[0]
+        if fmt == "metadata":
+            wanted = set(query.get("metadataHeaders", []))
+            headers = [h for h in msg["payload"]["headers"] if not wanted or h["name"] in wanted]
+            result = {k: v for k, v in msg.items() if k != "payload"}
+            result["payload"] = {"mimeType": msg["payload"]["mimeType"], "headers": headers}
+        else:
+            result = msg
+
+        if "fields" in query:
+            # Rough emulation of partial responses: drop the top level keys that were not asked for
+            top_level = {re.split(r"[/(]", f, 1)[0] for f in query["fields"][0].split(",")}
+            result = {k: v for k, v in result.items() if k in top_level}
+        return 200, result
+
+    @staticmethod
+    def _message_id(raw):
+        message_id = Parser().parsestr(base64.urlsafe_b64decode(raw).decode(), headersonly=True).get("Message-ID") or ""
+        return message_id.strip("<>")
+
+    @staticmethod
+    def _header(msg, name):
+        return next((h["value"] for h in msg["payload"]["headers"] if h["name"] == name), "")
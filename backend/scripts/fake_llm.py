@@ -0,0 +1,89 @@
+"""
+Offline stand-in for the shared LLM client (app.services.llm.LLMClient).
+
+Latency is modelled as a fixed time-to-first-token plus a per-mail generation
+cost, so one prompt covering N mails costs more than one covering a single mail.
+"""
+import asyncio
+import json
+import re
+import threading
+import time
+
+MAIL_MARKER_RE = re.compile(r"### E-Mail \d+")
+USER_INPUT_RE = re.compile(r'User Input: "(.*)"')
+
+
+class FakeLLMClient:
+    available = True
+    model_name = "fake"
+
+    def __init__(self, latency: float = 0.4, per_mail_latency: float = 0.15, fail_every: int = 0,
+                 intents: dict = None, transcripts: dict = None, answer_chars: int = 0):
+        """
+        latency: seconds per call before any output
+        per_mail_latency: extra seconds per mail the answer covers
+        fail_every: raise on every n-th call (0 = never), to exercise fallbacks
+        intents: utterance -> intent result, answered for process_intent prompts with that user input
+        transcripts: audio bytes -> text, answer to transcription requests with that inline audio
+        answer_chars: pad free-text answers to this length, to model long generated mails
+        """
+        self.latency = latency
+        self.per_mail_latency = per_mail_latency
+        self.fail_every = fail_every
+        self.intents = intents or {}
+        self.transcripts = transcripts or {}
+        self.answer_chars = answer_chars
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, contents, json_output: bool = False, model_name: str = None, timeout: float = None) -> str:
+        delay, fail = self._begin(contents)
+        time.sleep(delay)
+        return self._answer(contents, json_output, fail)
+
+    async def agenerate(self, contents, json_output: bool = False, model_name: str = None, timeout: float = None) -> str:
+        delay, fail = self._begin(contents)
+        await asyncio.sleep(delay)
+        return self._answer(contents, json_output, fail)
+
+    async def agenerate_streamed(self, contents, on_text, json_output: bool = False, model_name: str = None,
+                                 timeout: float = None) -> str:
+        """The same answer as agenerate, in word groups: the first after latency, the rest over the per-mail cost."""
+        delay, fail = self._begin(contents)
+        await asyncio.sleep(self.latency)
+        words = self._answer(contents, json_output, fail).split(" ")
+        pieces = [" ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "") for i in range(0, len(words), 4)]
+        for number, piece in enumerate(pieces):
+            if number:
+                await asyncio.sleep((delay - self.latency) / len(pieces))
+            on_text(piece)
+        return "".join(pieces)
+
+    def _begin(self, contents):
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+        mails = max(1, len(MAIL_MARKER_RE.findall(str(contents))))
+        fail = bool(self.fail_every and call_number % self.fail_every == 0)
+        return self.latency + self.per_mail_latency * mails, fail
+
+    def _answer(self, contents, json_output, fail):
+        if fail:
+            raise RuntimeError("fake LLM failure")
+        prompt = str(contents)
+        if json_output and "JSON-Array" in prompt:
+            mails = max(1, len(MAIL_MARKER_RE.findall(prompt)))
+            return json.dumps([f"Vorlesetext für E-Mail {i + 1}." for i in range(mails)])
+        if json_output:
+            user_input = USER_INPUT_RE.search(prompt)
+            result = self.intents.get(user_input.group(1)) if user_input else None
+            return json.dumps(result or {"intent": "chitchat", "slots": {}, "missing_slots": [], "response": "Hallo!", "completed": True})
+        audio = next((part["data"] for part in contents if isinstance(part, dict) and "mime_type" in part), None) \
+            if isinstance(contents, list) else None
+        if audio is not None:
+            return self.transcripts.get(audio, "Lies meine E-Mails")
+        text = "Vorlesetext für eine E-Mail."
+        while len(text) < self.answer_chars:
+            text += " Weiterer Text der Antwort."
+        return text
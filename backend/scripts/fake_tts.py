@@ -0,0 +1,34 @@
+"""
+Offline stand-in for google.cloud.texttospeech.TextToSpeechClient.
+
+Only synthesize_speech() is implemented. Latency is a fixed time per request plus a
+per-character cost. The returned "MP3" is filler bytes sized like real speech:
+64 kbit/s is 8 kB per second, at about 15 spoken characters per second that is
+roughly 500 bytes per character.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeTTSClient:
+    def __init__(self, latency: float = 0.15, per_char_latency: float = 0.001, bytes_per_char: int = 500):
+        """
+        latency: seconds per synthesize_speech request
+        per_char_latency: extra seconds per input character
+        bytes_per_char: size of the returned audio per input character
+        """
+        self.latency = latency
+        self.per_char_latency = per_char_latency
+        self.bytes_per_char = bytes_per_char
+        self.calls = 0
+        self.chars = 0
+        self._lock = threading.Lock()
+
+    def synthesize_speech(self, input=None, voice=None, audio_config=None, **kwargs):
+        text = input.text
+        with self._lock:
+            self.calls += 1
+            self.chars += len(text)
+        time.sleep(self.latency + self.per_char_latency * len(text))
+        return SimpleNamespace(audio_content=b"\xff\xfb" + b"\x00" * (len(text) * self.bytes_per_char))
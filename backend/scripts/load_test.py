@@ -0,0 +1,387 @@
+"""
+Offline load test of the whole backend: Gmail, Gemini and Google TTS are replaced by
+the stand-ins in this directory, the app runs in-process behind an ASGI transport.
+
+Virtual users replay scripted conversations (reading, summarizing, a multi-turn send, the
+same send as streamed turns, voice turns, plain /speech calls and direct agent runs) against the users seeded by
+scripts/seed_db.py, and the run reports p50/p95/p99 latency and throughput per step.
+
+    DATABASE_URL=sqlite:///load.db python -m scripts.load_test --seed --users 50 --duration 30
+    DATABASE_URL=... python -m scripts.load_test --users 200 --scenario read,send --llm-latency 0.8
+
+The load generator shares the event loop with the app, so compare runs with each other
+rather than reading the numbers as production capacity.
+"""
+import os
+import tempfile
+
+# Every seeded user needs its fake Gmail client in the pool, and slow requests should not flood the output
+os.environ.setdefault("GMAIL_POOL_SIZE", "1000000")
+os.environ.setdefault("METRICS_SLOW_REQUEST", "3600")
+# The stand-ins' audio and answers must never end up in the real cache, and every run starts cold
+CACHE_DIR = tempfile.mkdtemp(prefix="drivemail-load-test-cache-")
+os.environ["CACHE_SQLITE_PATH"] = os.path.join(CACHE_DIR, "cache.db")
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import shutil
+import time
+from urllib.parse import unquote
+
+import httpx
+from sqlmodel import Session, select
+
+from app.main import app
+from app.database import engine, async_engine
+from app.models import OAuthCredential, OutboxMessage
+from app.agents.email_reader import EmailReaderAgent
+from app.agents.email_summarizer import EmailSummarizerAgent
+from app.services import llm, tts, audio
+from app.services.gmail_pool import gmail_pool, build_gmail_client
+from scripts.fake_gmail import FakeGmailHttp
+from scripts.fake_llm import FakeLLMClient
+from scripts.fake_tts import FakeTTSClient
+from scripts import seed_db
+
+# Answers of the LLM stand-in for utterances the fast path leaves to Gemini
+LLM_INTENTS = {
+    "Schreib eine E-Mail an Sender 2": {
+        "intent": "send_email", "slots": {"recipient": "Sender 2"}, "missing_slots": ["subject", "body"],
+        "response": "Was ist der Betreff der E-Mail?", "completed": False,
+    },
+    "Der Betreff ist Termin morgen": {
+        "intent": "send_email", "slots": {"subject": "Termin morgen"}, "missing_slots": ["body"],
+        "response": "Was ist die Nachricht, die Sie senden möchten?", "completed": False,
+    },
+    "Ich verspäte mich um zehn Minuten": {
+        "intent": "send_email", "slots": {"body": "Ich verspäte mich um zehn Minuten"}, "missing_slots": [],
+        "response": "Ich erstelle den Entwurf.", "completed": True,
+    },
+    "Wie wird das Wetter morgen?": {
+        "intent": "chitchat", "slots": {}, "missing_slots": [],
+        "response": "Das kann ich leider nicht nachsehen, aber ich lese dir gern deine E-Mails vor.", "completed": True,
+    },
+}
+
+# Conversation scripts: (step kind, argument). "speak" without an argument says the previous answer.
+SCRIPTS = {
+    "read": [("intent", "Lies meine E-Mails")],
+    "read_sender": [("intent", "Lies die E-Mails von Sender 3")],
+    "summarize": [("intent", "Fasse die letzten drei E-Mails zusammen")],
+    "send": [
+        ("intent", "Schreib eine E-Mail an Sender 2"),
+        ("intent", "Der Betreff ist Termin morgen"),
+        ("intent", "Ich verspäte mich um zehn Minuten"),
+        ("intent", "Ja, senden"),
+        ("intent", "Wurde meine Mail gesendet?"),
+    ],
+    "stream": [
+        ("stream", "Schreib eine E-Mail an Sender 2"),
+        ("stream", "Der Betreff ist Termin morgen"),
+        ("stream", "Ich verspäte mich um zehn Minuten"),
+        ("stream", "Ja, senden"),
+    ],
+    "chitchat": [("intent", "Wie wird das Wetter morgen?")],
+    "voice": [("voice", "Lies meine E-Mails")],
+    "speech": [("transcribe", "Fasse meine E-Mails zusammen"), ("speak", None)],
+    "agents": [("reader", 5), ("summarizer", 3)],
+}
+# Share of each script in --scenario mixed
+MIX = {"read": 30, "read_sender": 10, "summarize": 20, "send": 10, "stream": 5, "chitchat": 5, "voice": 15, "speech": 5, "agents": 5}
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, step, seconds, ok):
+        self.samples.setdefault(step, []).append(seconds)
+        if not ok:
+            self.errors[step] = self.errors.get(step, 0) + 1
+
+    def report(self, elapsed):
+        print(f"{'step':<28}{'count':>7}{'errors':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'req/s':>9}")
+        everything = []
+        for step, values in sorted(self.samples.items()):
+            everything.extend(values)
+            self._row(step, values, self.errors.get(step, 0), elapsed)
+        if everything:
+            self._row("total", everything, sum(self.errors.values()), elapsed)
+
+    @staticmethod
+    def _row(step, values, errors, elapsed):
+        print(f"{step:<28}{len(values):>7}{errors:>8}"
+              f"{percentile(values, 0.50) * 1000:>8.0f}ms{percentile(values, 0.95) * 1000:>8.0f}ms"
+              f"{percentile(values, 0.99) * 1000:>8.0f}ms{len(values) / elapsed:>9.1f}")
+
+
+class StreamingASGITransport(httpx.AsyncBaseTransport):
+    """
+    httpx.ASGITransport hands out a response only once the app finished its body, which
+    hides when a streamed turn's first sentence arrived. This one passes body chunks on
+    as the app sends them.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def handle_async_request(self, request):
+        body = await request.aread()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": request.method,
+            "headers": [(key.lower(), value) for key, value in request.headers.raw], "scheme": request.url.scheme,
+            "path": unquote(request.url.path), "raw_path": request.url.raw_path.split(b"?")[0],
+            "query_string": request.url.query, "server": (request.url.host, request.url.port),
+            "client": ("127.0.0.1", 123), "root_path": "",
+        }
+        started = asyncio.get_running_loop().create_future()
+        chunks = asyncio.Queue()
+        finished = asyncio.Event()
+        body_sent = False
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                started.set_result(message)
+            elif message["type"] == "http.response.body":
+                if message.get("body"):
+                    chunks.put_nowait(message["body"])
+                if not message.get("more_body", False):
+                    chunks.put_nowait(None)
+
+        async def run_app():
+            try:
+                await self.app(scope, receive, send)
+            except Exception as e:
+                if not started.done():
+                    started.set_exception(e)
+            finally:
+                chunks.put_nowait(None)
+
+        task = asyncio.create_task(run_app())
+        start = await started
+        return httpx.Response(start["status"], headers=start.get("headers", []), stream=_ChunkStream(chunks, finished, task))
+
+
+class _ChunkStream(httpx.AsyncByteStream):
+    def __init__(self, chunks, finished, task):
+        self.chunks = chunks
+        self.finished = finished
+        self.task = task
+
+    async def __aiter__(self):
+        while (chunk := await self.chunks.get()) is not None:
+            yield chunk
+
+    async def aclose(self):
+        self.finished.set()
+        await self.task
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def recordings(seconds):
+    """One silent WAV per scripted utterance, a few samples apart so the LLM stand-in can tell them apart."""
+    utterances = sorted({argument for steps in SCRIPTS.values() for kind, argument in steps if kind in ("voice", "transcribe")})
+    return {
+        utterance: audio.pcm_to_wav(b"\x00\x00" * (int(audio.PCM_RATE * seconds) + index))
+        for index, utterance in enumerate(utterances)
+    }
+
+
+def load_users(fake_http, limit):
+    """Register the fake Gmail transport for the seeded users' credentials."""
+    with Session(engine) as session:
+        creds = session.exec(select(OAuthCredential).order_by(OAuthCredential.user_id).limit(limit)).all()
+        for cred in creds:
+            session.expunge(cred)
+    for cred in creds:
+        gmail_pool.put(cred, build_gmail_client(http=fake_http), None)
+    return creds
+
+
+async def run_step(client, creds, kind, argument, previous, wavs, first_sentence):
+    """Run one step, returns (ok, response text for a following "speak")."""
+    if kind == "intent":
+        response = await client.post("/ai/process_intent", json={"text": argument, "user_id": creds.user_id})
+        return response.status_code == 200, response.json().get("response") if response.status_code == 200 else None
+    if kind == "stream":
+        return await stream_turn(client, creds, argument, first_sentence)
+    if kind == "voice":
+        return await voice_turn(client, creds, wavs[argument], first_sentence)
+    if kind == "transcribe":
+        response = await client.post("/speech/transcribe", files={"file": ("turn.wav", wavs[argument], "audio/wav")})
+        return response.status_code == 200, response.json().get("text") if response.status_code == 200 else None
+    if kind == "speak":
+        response = await client.post("/speech/speak", json={"text": argument or previous or "Alles klar.", "stream": True})
+        return response.status_code == 200 and len(response.content) > 0, None
+    agent_class = EmailReaderAgent if kind == "reader" else EmailSummarizerAgent
+    result = await agent_class(creds).execute({"limit": argument})
+    return result.get("status") == "success", result.get("message")
+
+
+async def stream_turn(client, creds, text, first_sentence):
+    """A streamed turn; first_sentence() is called when its first sentence arrives."""
+    event, result = None, None
+    async with client.stream("POST", "/ai/process_intent/stream", json={"text": text, "user_id": creds.user_id}) as response:
+        if response.status_code != 200:
+            return False, None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "sentence" and data["index"] == 0:
+                    first_sentence()
+                elif event == "done":
+                    result = data
+    return result is not None, result.get("response") if result else None
+
+
+async def voice_turn(client, creds, wav, first_audio):
+    """A /voice/turn; first_audio() is called when the first audio arrives. Returns the answer text."""
+    size = 0
+    async with client.stream("POST", "/voice/turn", data={"user_id": str(creds.user_id)},
+                             files={"file": ("turn.wav", wav, "audio/wav")}) as response:
+        if response.status_code != 200:
+            return False, None
+        turn_id = response.headers["X-Turn-Id"]
+        async for chunk in response.aiter_bytes():
+            if chunk and not size:
+                first_audio()
+            size += len(chunk)
+    texts = await client.get(f"/voice/turn/{turn_id}")
+    return size > 0 and texts.status_code == 200, texts.json().get("response") if texts.status_code == 200 else None
+
+
+async def virtual_user(client, creds, scripts, weights, deadline, iterations, think, wavs, recorder):
+    done = 0
+    while time.perf_counter() < deadline and (not iterations or done < iterations):
+        name = random.choices(scripts, weights)[0]
+        previous = None
+        steps = SCRIPTS[name]
+        for number, (kind, argument) in enumerate(steps, 1):
+            step = f"{name}/{kind}" if len(steps) == 1 else f"{name}/{number}-{kind}"
+            start = time.perf_counter()
+
+            def first_sentence(step=step, start=start):
+                recorder.record(f"{step} (first)", time.perf_counter() - start, True)
+            try:
+                ok, previous = await run_step(client, creds, kind, argument, previous, wavs, first_sentence)
+            except Exception as e:
+                ok, previous = False, None
+                print(f"{step} failed for user {creds.user_id}: {e!r}")
+            recorder.record(step, time.perf_counter() - start, ok)
+            if think:
+                await asyncio.sleep(random.uniform(0, 2 * think))
+        done += 1
+
+
+async def drain_outbox(timeout=30):
+    """Give the outbox worker time to deliver the confirmed mails, so the report counts them."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        with Session(engine) as session:
+            waiting = session.exec(select(OutboxMessage.id).where(OutboxMessage.send_requested)
+                                   .where(OutboxMessage.status.in_(["pending", "drafted"])).limit(1)).first()
+        if waiting is None:
+            return
+        await asyncio.sleep(0.2)
+
+
+async def run(args, wavs, users, scripts, weights):
+    recorder = Recorder()
+    transport = StreamingASGITransport(app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+            # Stagger the start so the first wave does not arrive in the same millisecond
+            started = time.perf_counter()
+            deadline = started + args.duration
+            workers = []
+            for creds in users:
+                workers.append(asyncio.create_task(virtual_user(
+                    client, creds, scripts, weights, deadline, args.iterations, args.think, wavs, recorder)))
+                await asyncio.sleep(args.ramp_up / len(users))
+            await asyncio.gather(*workers)
+            elapsed = time.perf_counter() - started
+            await drain_outbox()
+    await async_engine.dispose()
+    return recorder, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="virtual users, one seeded user each")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to keep starting new conversations")
+    parser.add_argument("--iterations", type=int, default=0, help="conversations per user (0 = until --duration)")
+    parser.add_argument("--scenario", default="mixed", help=f"'mixed' or a comma separated list of {', '.join(SCRIPTS)}")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause in seconds between steps")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="seconds over which the users start")
+    parser.add_argument("--seed", action="store_true", help="reset the database and seed --users users first")
+    parser.add_argument("--history", type=int, default=200, help="history messages per seeded user (with --seed)")
+    parser.add_argument("--mailbox", type=int, default=50, help="messages in the fake mailbox")
+    parser.add_argument("--body-size", type=int, default=2000, help="characters per mail body")
+    parser.add_argument("--gmail-latency", type=float, default=0.08)
+    parser.add_argument("--llm-latency", type=float, default=0.4)
+    parser.add_argument("--llm-per-mail-latency", type=float, default=0.15)
+    parser.add_argument("--llm-answer-chars", type=int, default=0, help="pad generated texts to this length")
+    parser.add_argument("--tts-latency", type=float, default=0.15)
+    parser.add_argument("--audio-seconds", type=float, default=2.0, help="length of the uploaded recordings")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own log output")
+    args = parser.parse_args()
+
+    if args.scenario == "mixed":
+        scripts, weights = list(MIX), list(MIX.values())
+    else:
+        scripts = args.scenario.split(",")
+        unknown = [name for name in scripts if name not in SCRIPTS]
+        if unknown:
+            parser.error(f"unknown scenario {', '.join(unknown)}, choose from {', '.join(SCRIPTS)}")
+        weights = [1] * len(scripts)
+
+    engine.echo = False
+    if args.seed:
+        seed_db.reset_db()
+        seed_db.seed(args.users, args.mailbox, args.body_size, args.history)
+
+    fake_http = FakeGmailHttp(num_messages=args.mailbox, body_size=args.body_size, latency=args.gmail_latency)
+    wavs = recordings(args.audio_seconds)
+    fake_llm = FakeLLMClient(latency=args.llm_latency, per_mail_latency=args.llm_per_mail_latency, intents=LLM_INTENTS,
+                             transcripts={wav: text for text, wav in wavs.items()}, answer_chars=args.llm_answer_chars)
+    fake_tts = FakeTTSClient(latency=args.tts_latency)
+    llm.set_llm(fake_llm)
+    tts.tts_client = fake_tts
+
+    users = load_users(fake_http, args.users)
+    if not users:
+        parser.error("no users in the database, run scripts.seed_db or pass --seed")
+
+    print(f"{len(users)} users, scenario {args.scenario}, {args.duration:.0f}s")
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            recorder, elapsed = asyncio.run(run(args, wavs, users, scripts, weights))
+    finally:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+    recorder.report(elapsed)
+    print(f"Backends: {fake_http.round_trips} Gmail round trips, {fake_http.sent} mails sent, "
+          f"{fake_llm.calls} LLM calls, {fake_tts.calls} TTS requests in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
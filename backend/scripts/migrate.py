@@ -0,0 +1,74 @@
+"""
+Bring an existing Postgres database up to date with the models.
+
+init.sql (and create_all at startup) only create what is missing, they never change
+existing tables. Schema changes for databases that already hold data live in
+backend/migrations/NNN_*.sql and are applied here in file name order, each one once;
+applied files are recorded in the schema_migration table.
+
+Statements run one by one in autocommit mode, so CREATE INDEX CONCURRENTLY works.
+Write them so they can run again (IF NOT EXISTS, ...): a file that failed half way
+is retried from its first statement.
+
+    python -m scripts.migrate            # apply pending migrations
+    python -m scripts.migrate --list     # show what is applied / pending
+"""
+import argparse
+import os
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app.database import engine
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+
+def migration_files():
+    return sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith(".sql"))
+
+
+def statements(sql):
+    """Split a migration file into statements (one per `;` at the end of a line)."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    statements = ("\n".join(lines) + "\n").split(";\n")
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def applied_migrations(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migration (version VARCHAR PRIMARY KEY, applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL)"
+    ))
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migration"))}
+
+
+def migrate(list_only=False):
+    if engine.dialect.name != "postgresql":
+        print(f"Migrations are written for Postgres, not {engine.dialect.name}. Use scripts/reset_db.py instead.")
+        return
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        applied = applied_migrations(conn)
+        for name in migration_files():
+            if name in applied:
+                print(f"applied  {name}")
+                continue
+            if list_only:
+                print(f"pending  {name}")
+                continue
+            print(f"applying {name}")
+            with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+                for statement in statements(f.read()):
+                    conn.execute(text(statement))
+            conn.execute(
+                text("INSERT INTO schema_migration (version, applied_at) VALUES (:version, :applied_at)"),
+                {"version": name, "applied_at": datetime.utcnow()},
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--list", action="store_true", help="only show applied and pending migrations")
+    args = parser.parse_args()
+    engine.echo = False
+    migrate(list_only=args.list)
@@ -0,0 +1,143 @@
+"""
+Reset the database (scripts/reset_db.py) and fill it with synthetic users for load tests.
+
+Every user gets OAuth credentials the offline Gmail stand-in accepts, a mailbox mirror
+that matches FakeGmailHttp(num_messages=--mailbox, body_size=--body-size), and a
+conversation history of --history messages with a task for every other turn.
+
+    python -m scripts.seed_db --users 200 --mailbox 100 --history 2000
+
+Large mailboxes: the mirror only holds the newest MAILBOX_MIRROR_SIZE messages, like
+after a real full sync. --no-reset appends to the existing data instead.
+"""
+import argparse
+import base64
+import json
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app.config import MAILBOX_MIRROR_SIZE
+from app.database import engine, create_db_and_tables
+from app.models import User, OAuthCredential, Conversation, Message, Task, MailboxMessage, MailboxSyncState
+from scripts.fake_gmail import make_message
+from scripts.reset_db import reset_db
+
+BATCH_SIZE = 5000
+TURN_TEXTS = [
+    ("user", "Lies meine E-Mails"),
+    ("assistant", "Hier sind deine E-Mails. Vorlesetext für eine E-Mail."),
+    ("user", "Fasse die letzten drei E-Mails zusammen"),
+    ("assistant", "Du hast 3 neue E-Mails. Vorlesetext für eine E-Mail."),
+]
+TASK_INTENTS = ["read_emails", "summarize_emails", "send_email"]
+
+
+def header(msg, name):
+    return next((h["value"] for h in msg["payload"]["headers"] if h["name"] == name), "")
+
+
+def mirror_rows(user_id, messages):
+    """MailboxMessage rows as MailboxMirror.full_sync would store them."""
+    return [
+        {
+            "user_id": user_id,
+            "gmail_id": msg["id"],
+            "thread_id": msg["threadId"],
+            "subject": header(msg, "Subject"),
+            "sender": header(msg, "From"),
+            "to": header(msg, "To"),
+            "date": header(msg, "Date"),
+            "snippet": msg["snippet"],
+            "body": base64.urlsafe_b64decode(msg["payload"]["parts"][0]["body"]["data"]).decode(),
+            "label_ids": ",".join(msg["labelIds"]),
+            "internal_date": int(msg["internalDate"]),
+            "synced_at": datetime.utcnow(),
+        }
+        for msg in messages
+    ]
+
+
+def history_rows(conversation_id, count, start):
+    messages, tasks = [], []
+    for turn in range(count):
+        role, content = TURN_TEXTS[turn % len(TURN_TEXTS)]
+        created_at = start + timedelta(seconds=30 * turn)
+        messages.append({"conversation_id": conversation_id, "role": role, "content": content, "created_at": created_at})
+        if role == "assistant":
+            intent = TASK_INTENTS[(turn // 2) % len(TASK_INTENTS)]
+            result = {"status": "success", "message": content}
+            if intent == "send_email":
+                result["draft_id"] = f"draft{conversation_id}-{turn}"
+            tasks.append({
+                "conversation_id": conversation_id, "intent": intent, "slots": "{}", "status": "success",
+                "result": json.dumps(result), "created_at": created_at, "completed_at": created_at,
+            })
+    return messages, tasks
+
+
+def insert_batched(conn, table, rows):
+    for offset in range(0, len(rows), BATCH_SIZE):
+        conn.execute(insert(table), rows[offset:offset + BATCH_SIZE])
+
+
+def seed(users, mailbox, body_size, history):
+    # The fake mailbox is the same for every user, so the mirror rows are built once
+    messages = [make_message(i, body_size) for i in range(mailbox)]
+    mirrored = messages[:MAILBOX_MIRROR_SIZE]
+    history_id = str(max((int(m["historyId"]) for m in messages), default=1000))
+    start = datetime.utcnow() - timedelta(seconds=30 * history)
+
+    with engine.begin() as conn:
+        # Ids come from the database so the Postgres sequences stay in step
+        tag = int(time.time())
+        user_ids = conn.execute(insert(User.__table__).returning(User.__table__.c.id), [
+            {"email": f"load{tag}-{n}@example.com", "name": f"Load {n}", "created_at": datetime.utcnow(), "prefetch_enabled": True}
+            for n in range(users)
+        ]).scalars().all()
+        insert_batched(conn, OAuthCredential.__table__, [
+            {"user_id": user_id, "access_token": f"fake{user_id}"} for user_id in user_ids
+        ])
+        for user_id in user_ids:
+            insert_batched(conn, MailboxMessage.__table__, mirror_rows(user_id, mirrored))
+        insert_batched(conn, MailboxSyncState.__table__, [
+            {"user_id": user_id, "history_id": history_id, "complete": mailbox <= MAILBOX_MIRROR_SIZE,
+             "synced_at": datetime.utcnow()}
+            for user_id in user_ids
+        ])
+
+        if history:
+            conversation_ids = conn.execute(insert(Conversation.__table__).returning(Conversation.__table__.c.id), [
+                {"user_id": user_id, "created_at": start, "updated_at": start, "state": {}} for user_id in user_ids
+            ]).scalars().all()
+            for conversation_id in conversation_ids:
+                message_rows, task_rows = history_rows(conversation_id, history, start)
+                insert_batched(conn, Message.__table__, message_rows)
+                insert_batched(conn, Task.__table__, task_rows)
+    return user_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--mailbox", type=int, default=50, help="messages in each fake mailbox")
+    parser.add_argument("--body-size", type=int, default=2000, help="characters per mail body")
+    parser.add_argument("--history", type=int, default=200, help="conversation messages per user")
+    parser.add_argument("--no-reset", action="store_true", help="keep the existing data")
+    args = parser.parse_args()
+
+    engine.echo = False
+    if args.no_reset:
+        create_db_and_tables()
+    else:
+        reset_db()
+
+    started = time.perf_counter()
+    user_ids = seed(args.users, args.mailbox, args.body_size, args.history)
+    print(f"Seeded users {user_ids[0]}-{user_ids[-1]} ({args.mailbox} mails, {args.history} history messages each) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()